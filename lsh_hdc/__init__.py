@@ -4,6 +4,7 @@ __version__ = "0.1.4"
 Algorithms based on 'Mining of Massive Datasets'
 """
 
+import os
 import re
 import sys
 import random
@@ -11,12 +12,14 @@ import collections
 from math import log1p
 from operator import itemgetter
 from heapq import nsmallest
-from logging import getLogger
+from logging import getLogger, DEBUG
 from itertools import imap, izip, islice, chain, combinations
 from abc import abstractmethod
+import numpy as np
 from pymaptools.iter import cycle, take, shinglify, isiterable
-from cityhash import CityHash64, CityHash64WithSeed, CityHash128WithSeed
-from lsh_hdc.utils import totuple, tsorted
+from cityhash import CityHash64, CityHash64WithSeed, CityHash128, \
+    CityHash128WithSeed
+from lsh_hdc.utils import tsorted
 
 
 LOG = getLogger(__name__)
@@ -35,6 +38,54 @@ def long2int(num):
     return int(num % (smi1 + smi1) - smi1)
 
 
+KEY_TYPES = ("str", "int")
+
+# odd constant used to give each band a distinct key space
+_BAND_KEY_STEP = 0x9e3779b97f4a7c15
+# XOR-ing with the sign bit is the same as subtracting sys.maxint + 1 mod 2^64
+_INT64_OFFSET = np.uint64(1 << 63)
+
+
+def band_key(band, value):
+    """Combine a band index and a 64-bit band hash into an integer key
+
+    The band index is mixed into the hash so that equal hashes from
+    different bands give different keys, and the result is mapped to the
+    range of int so that keys are stored and hashed as machine integers.
+
+    >>> band_key(0, 12345) == band_key(0, 12345)
+    True
+    >>> band_key(0, 12345) == band_key(1, 12345)
+    False
+    >>> isinstance(band_key(3, (1 << 64) - 1), int)
+    True
+
+    :param band: band index
+    :type band: int
+    :param value: 64-bit band hash
+    :type value: int,long
+    :return: a signed 64-bit key
+    :rtype: int
+    """
+    return long2int(value ^ ((band + 1) * _BAND_KEY_STEP))
+
+
+def format_key(band, value):
+    """Combine a band index and a band hash into a string key
+
+    >>> format_key(2, 12345)
+    '2:12345'
+
+    :param band: band index
+    :type band: int
+    :param value: band hash
+    :type value: int,long
+    :return: a string key
+    :rtype: str
+    """
+    return '{}:{}'.format(band, value)
+
+
 def chash(obj):
     """Convenience function for calling CityHash64
 
@@ -46,6 +97,277 @@ def chash(obj):
     return long2int(CityHash64(obj))
 
 
+def hash64(item, seed=0):
+    """Seeded 64-bit CityHash of an object
+
+    Byte strings are hashed as is, unicode strings as UTF-8, and other
+    objects (such as tuple shingles) by their repr.
+
+    :param item: input object
+    :type item: object
+    :param seed: hash seed
+    :type seed: int
+    :return: unsigned 64-bit hash
+    :rtype: long
+    """
+    type_of_x = type(item)
+    if type_of_x == str:
+        value = item
+    elif type_of_x == unicode:
+        value = item.encode("utf-8")
+    else:
+        value = repr(item)
+    return CityHash64WithSeed(value, seed)
+
+
+def _clock_evict(referenced, hand):
+    """Advance clock hand, giving referenced entries a second chance
+
+    :param referenced: reference bits of table slots
+    :type referenced: bytearray
+    :param hand: current position of clock hand
+    :type hand: int
+    :returns: slot to evict and new position of clock hand
+    :rtype: tuple
+    """
+    maxsize = len(referenced)
+    while referenced[hand]:
+        referenced[hand] = 0
+        hand = (hand + 1) % maxsize
+    return hand, (hand + 1) % maxsize
+
+
+class HashCache(object):
+    """Bounded cache mapping features to their 64-bit base hashes
+
+    Frequent features (common phrases, user-id prefixes) are hashed once
+    and looked up afterwards. When the cache is full, entries are evicted
+    using the CLOCK algorithm, which approximates LRU without reordering
+    entries on every hit. One instance can be shared by all signers that
+    use :func:`hash64` with the same seed.
+
+    Note: keys are compared by equality, so callers should not mix byte
+    and unicode strings of same content inside tuple features.
+    """
+
+    def __init__(self, maxsize=65536, seed=0):
+        """
+        :param maxsize: maximum number of entries
+        :type maxsize: int
+        :param seed: hash seed
+        :type seed: int
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self.seed = seed
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all entries (hit and miss counters are kept)"""
+        maxsize = self.maxsize
+        self._slots = dict()
+        self._keys = [None] * maxsize
+        self._values = [0] * maxsize
+        self._referenced = bytearray(maxsize)
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __call__(self, item, seed=None):
+        """Return base hash of an item
+
+        Has the same signature as :func:`hash64` for use in its place. The
+        seed argument is ignored -- the cache seed is used instead.
+        """
+        slot = self._slots.get(item)
+        if slot is not None:
+            self.hits += 1
+            self._referenced[slot] = 1
+            return self._values[slot]
+        self.misses += 1
+        value = hash64(item, self.seed)
+        slots = self._slots
+        if len(slots) < self.maxsize:
+            slot = len(slots)
+        else:
+            slot, self._hand = _clock_evict(self._referenced, self._hand)
+            del slots[self._keys[slot]]
+        slots[item] = slot
+        self._keys[slot] = item
+        self._values[slot] = value
+        return value
+
+    def hash_many(self, items):
+        """Return a list of base hashes of items
+
+        Faster than calling the cache on each item as hits are resolved
+        without a method call.
+
+        :param items: input objects
+        :type items: collections.Iterable
+        :rtype: list
+        """
+        get_slot = self._slots.get
+        values = self._values
+        referenced = self._referenced
+        result = []
+        append = result.append
+        hits = 0
+        for item in items:
+            slot = get_slot(item)
+            if slot is None:
+                append(self(item))
+            else:
+                hits += 1
+                referenced[slot] = 1
+                append(values[slot])
+        self.hits += hits
+        return result
+
+    def info(self):
+        """Return cache statistics
+
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self),
+                    maxsize=self.maxsize,
+                    hit_rate=float(self.hits) / total if total else 0.0)
+
+
+def fingerprint128(tokens, prefix=None):
+    """128-bit CityHash of a token sequence
+
+    Tokens (and prefix, if given) are joined with a separator that is not
+    expected in tokens, so sequences such as ["ab", "c"] and ["a", "bc"]
+    have different fingerprints.
+
+    >>> fingerprint128(["ab", "c"]) == fingerprint128([u"ab", u"c"])
+    True
+    >>> fingerprint128(["ab", "c"]) == fingerprint128(["a", "bc"])
+    False
+
+    :param tokens: a sequence of string tokens
+    :type tokens: collections.Iterable
+    :param prefix: an object the sequence is prefixed with when shingling
+    :type prefix: object
+    :returns: 128-bit hash
+    """
+    if prefix is not None:
+        tokens = chain([repr(prefix)], tokens)
+    value = "\x00".join(token.encode("utf-8") if type(token) == unicode else token
+                        for token in tokens)
+    return CityHash128(value)
+
+
+class FingerprintTable(object):
+    """Bounded table mapping content fingerprints to labels of documents
+    first seen with that content
+
+    Used to recognize exact duplicates before they are shingled and
+    signed. When the table is full, entries are evicted using the CLOCK
+    algorithm (same as :class:`HashCache`), so a duplicate of an evicted
+    entry is simply processed as a new document.
+    """
+
+    def __init__(self, maxsize=65536):
+        """
+        :param maxsize: maximum number of entries
+        :type maxsize: int
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._slots = dict()
+        self._keys = [None] * maxsize
+        self._labels = [None] * maxsize
+        self._referenced = bytearray(maxsize)
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def setdefault(self, fingerprint, label):
+        """Return label of first document with a fingerprint, storing the
+        given label if the fingerprint is new
+
+        >>> table = FingerprintTable(2)
+        >>> table.setdefault("a", 1), table.setdefault("a", 2)
+        (1, 1)
+
+        :param fingerprint: content fingerprint (see fingerprint128)
+        :param label: label of current document
+        :returns: label of first document seen with the fingerprint
+        """
+        slots = self._slots
+        slot = slots.get(fingerprint)
+        if slot is not None:
+            self.hits += 1
+            self._referenced[slot] = 1
+            return self._labels[slot]
+        self.misses += 1
+        if len(slots) < self.maxsize:
+            slot = len(slots)
+        else:
+            slot, self._hand = _clock_evict(self._referenced, self._hand)
+            del slots[self._keys[slot]]
+        slots[fingerprint] = slot
+        self._keys[slot] = fingerprint
+        self._labels[slot] = label
+        return label
+
+    def info(self):
+        """Return table statistics
+
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self),
+                    maxsize=self.maxsize,
+                    hit_rate=float(self.hits) / total if total else 0.0)
+
+
+def long2words(num, num_words):
+    """Split a non-negative long into 64-bit words, least significant first
+
+    :param num: input long variable
+    :type num: long
+    :param num_words: number of words to return
+    :type num_words: int
+    :return: list of 64-bit words
+    :rtype: list
+
+    >>> long2words((5 << 64) + 7, 2)
+    [7L, 5L]
+    """
+    mask = (1 << 64) - 1
+    return [long((num >> (64 * idx)) & mask) for idx in xrange(num_words)]
+
+
+def words2long(words):
+    """Inverse of long2words
+
+    :param words: sequence of 64-bit words, least significant first
+    :type words: collections.Iterable
+    :return: combined value
+    :rtype: long
+
+    >>> words2long([7, 5]) == (5 << 64) + 7
+    True
+    """
+    return sum(long(word) << (64 * idx) for idx, word in enumerate(words))
+
+
 def mshinglify(iterable, span, skip=0):
     """Same as shingligy except repeatedly mask one word
 
@@ -82,6 +404,114 @@ def mshinglify(iterable, span, skip=0):
         yield shingle[1:]
 
 
+# odd multipliers of token hashes by their position in a shingle
+_SHINGLE_MULTIPLIER = 0x9e3779b97f4a7c15
+
+
+def hash_shingles(token_hashes, span, skip=0):
+    """Hash shingles of a sequence of token hashes
+
+    Produces one 64-bit hash for every shingle that :func:`shinglify` would
+    return for the same tokens, combining token hashes by their position in
+    the shingle without allocating shingle tuples.
+
+    >>> token_hashes = np.array([1, 2, 3, 4], dtype=np.uint64)
+    >>> len(hash_shingles(token_hashes, 3))
+    2
+    >>> len(hash_shingles(token_hashes, 3, skip=1))
+    2
+    >>> hash_shingles(token_hashes, 2)[1] == hash_shingles(token_hashes[1:], 2)[0]
+    True
+
+    :param token_hashes: vector of 64-bit token hashes
+    :type token_hashes: numpy.ndarray
+    :param span: shingle span
+    :type span: int
+    :param skip: how many tokens to skip between shingle tokens
+    :type skip: int
+    :returns: vector of shingle hashes
+    :rtype: numpy.ndarray
+    """
+    token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+    num_tokens = len(token_hashes)
+    step = skip + 1
+    if num_tokens >= span:
+        offsets = np.arange(0, span, step)
+        starts = np.arange(num_tokens - offsets[-1])
+    else:
+        # shorter sequences give one shingle
+        offsets = np.arange(0, num_tokens, step)
+        starts = np.zeros(1, dtype=np.intp)
+    return _combine_token_hashes(token_hashes, starts, offsets)
+
+
+def _position_multipliers(count):
+    """Multipliers of token hashes at shingle positions 0 to count - 1"""
+    return np.array([pow(_SHINGLE_MULTIPLIER, idx + 1, 1 << 64)
+                     for idx in xrange(count)], dtype=np.uint64)
+
+
+def _combine_token_hashes(token_hashes, starts, offsets):
+    """Hash shingles given by start positions and offsets of their tokens"""
+    multipliers = _position_multipliers(len(offsets))
+    shingles = token_hashes[starts[:, np.newaxis] + offsets]
+    return fmix64((shingles * multipliers).sum(axis=1, dtype=np.uint64))
+
+
+def hash_mshingles(token_hashes, span, skip=0):
+    """Hash SBPH shingles of a sequence of token hashes
+
+    Produces one 64-bit hash for every shingle that :func:`mshinglify` would
+    return for the same tokens, in the same order. Hashes of a window with
+    one token masked are sums of a prefix (tokens before the mask, at their
+    own positions) and a suffix (tokens after the mask, shifted left by
+    one), both taken from running sums over the window, so no shingle
+    tuples are built. Equal shingles have equal hashes regardless of which
+    token was masked, and a shingle also hashes the same as it would in
+    :func:`hash_shingles`.
+
+    >>> token_hashes = np.array([1, 2, 3, 4], dtype=np.uint64)
+    >>> len(hash_mshingles(token_hashes, 4))
+    4
+    >>> len(hash_mshingles(token_hashes, 4, skip=1))
+    2
+    >>> hash_mshingles(token_hashes, 4)[2] == hash_shingles(token_hashes, 3)[0]
+    True
+
+    :param token_hashes: vector of 64-bit token hashes
+    :type token_hashes: numpy.ndarray
+    :param span: shingle span
+    :type span: int
+    :param skip: 0 or 1 (see mshinglify)
+    :type skip: int
+    :returns: vector of shingle hashes
+    :rtype: numpy.ndarray
+    """
+    if skip > 1:
+        raise NotImplementedError("Cannot use skip > 1 with SBPH")
+    token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+    num_tokens = len(token_hashes)
+    # range of indices where masking is allowed
+    mask = np.arange(1, min(num_tokens, span - skip))
+    if len(mask) == 0:
+        return np.empty(0, dtype=np.uint64)
+    window = min(num_tokens, span)
+    starts = np.arange(num_tokens - window + 1)
+    windows = token_hashes[starts[:, np.newaxis] + np.arange(window)]
+    multipliers = _position_multipliers(window)
+    shifted = np.concatenate([np.ones(1, dtype=np.uint64), multipliers[:-1]])
+    # prefixes[:, k] covers tokens up to k, suffixes[:, k] tokens from k on
+    prefixes = np.cumsum(windows * multipliers, axis=1, dtype=np.uint64)
+    suffixes = np.zeros((len(starts), window + 1), dtype=np.uint64)
+    suffixes[:, :-1] = np.cumsum((windows * shifted)[:, ::-1], axis=1,
+                                 dtype=np.uint64)[:, ::-1]
+    hashes = fmix64(prefixes[:, mask - 1] + suffixes[:, mask + 1]).ravel()
+    if skip == 0:
+        # the last window with its first token dropped
+        hashes = np.append(hashes, fmix64(suffixes[-1:, 1]))
+    return hashes
+
+
 def consistent_sampler(pool_length=24, step=3, sample_size=8):
     """Return samples from a list of runs starting from run heads
     """
@@ -160,19 +590,36 @@ def lsh_combinations(width, bandwidth, ramp):
     :type ramp: int
     :return: a sequence of tuples with elements representing indices
     :rtype: list
+
+    Every ``ramp``-combination of indices (the left part) is completed to a
+    band using the first split of band columns into left and right parts
+    that can hold it, and the smallest indices that keep the band sorted.
+    This equals picking the first matching band out of all (width choose
+    bandwidth) combinations, without materializing them.
     """
-    master = list(combinations(range(width), bandwidth))
-    cols = set(range(bandwidth))
-    left_cols = list(combinations(cols, ramp))
-    right_cols = [tsorted(cols - s) for s in imap(set, left_cols)]
-    left_getters = create_getters(left_cols)
-    right_getters = create_getters(right_cols)
-    mapping = collections.defaultdict(list)
-    for get_left, get_right in izip(left_getters, right_getters):
-        for element in master:
-            mapping[tsorted(totuple(get_left(element)))].append(
-                tsorted(totuple(get_right(element))))
-    return sorted(set(tsorted(k + v[0]) for k, v in mapping.iteritems()))
+    left_cols = list(combinations(xrange(bandwidth), ramp))
+    bands = set()
+    for left in combinations(xrange(width), ramp):
+        for cols in left_cols:
+            # left values must leave room for the right part around them
+            if left[0] < cols[0] or \
+                    width - left[-1] < bandwidth - cols[-1] or \
+                    any(left[j] - left[j - 1] < cols[j] - cols[j - 1]
+                        for j in xrange(1, ramp)):
+                continue
+            band = []
+            j = -1
+            for col in xrange(bandwidth):
+                if j + 1 < ramp and cols[j + 1] == col:
+                    j += 1
+                    band.append(left[j])
+                elif j < 0:
+                    band.append(col)
+                else:
+                    band.append(left[j] + col - cols[j])
+            bands.add(tuple(band))
+            break
+    return sorted(bands)
 
 
 def lsh_bands(width, bandwidth):
@@ -195,8 +642,17 @@ def lsh_bands(width, bandwidth):
     return zip(*(iter(xrange(width)),) * bandwidth)
 
 
-def create_sig_selectors(width, bandwidth, scheme):
-    """Generate indices for LSH band selectors
+# bands already built in this process, keyed by (width, bandwidth, scheme)
+_SIG_BANDS = {}
+
+
+def create_sig_bands(width, bandwidth, scheme, cache_dir=None):
+    """Generate band indices and bands (rows of signature indices)
+
+    Bands are memoized in memory and, if a cache directory is given (or set
+    through the LSH_HDC_CACHE_DIR environment variable), in .npy files
+    keyed by (width, bandwidth, scheme), so that processes which construct
+    the same LSHC do not rebuild them.
 
     :param width:
     :type width: int
@@ -204,9 +660,75 @@ def create_sig_selectors(width, bandwidth, scheme):
     :type bandwidth: int
     :param scheme:
     :type scheme: str
-    :return:
+    :param cache_dir: directory for cached bands
+    :type cache_dir: str
+    :return: a tuple of band indices and a (num_bands, bandwidth) matrix
     :rtype: tuple
     """
+    if re.match(r'^[a-zA-Z]+\d+$', scheme) is None:
+        raise ValueError("Invalid scheme")
+    if cache_dir is None:
+        cache_dir = os.environ.get("LSH_HDC_CACHE_DIR")
+    path = None if cache_dir is None else os.path.join(
+        cache_dir, "bands-{}-{}-{}.npy".format(width, bandwidth, scheme))
+    key = (width, bandwidth, scheme)
+    bands = _SIG_BANDS.get(key)
+    is_cached = False
+    if bands is None:
+        if path is not None and os.path.exists(path):
+            bands = _load_sig_bands(path, width, bandwidth)
+            is_cached = bands is not None
+        if bands is None:
+            bands = np.array(_build_sig_bands(width, bandwidth, scheme),
+                             dtype=np.intp).reshape(-1, bandwidth)
+        bands.setflags(write=False)
+        _SIG_BANDS[key] = bands
+    elif path is not None:
+        is_cached = os.path.exists(path)
+    if path is not None and not is_cached:
+        _save_sig_bands(path, bands)
+    LOG.info("Choosing %d LSH bands (width %d, bandwidth %d, scheme %s)",
+             len(bands), width, bandwidth, scheme)
+    if LOG.isEnabledFor(DEBUG):
+        LOG.debug("LSH bands: " + ", ".join("{}: {}".format(idx, tuple(band))
+                                             for idx, band in enumerate(bands.tolist())))
+    return range(len(bands)), bands
+
+
+def _load_sig_bands(path, width, bandwidth):
+    """Load cached bands, or return None if the file cannot be read or does
+    not hold a (num_bands, bandwidth) matrix of signature indices
+    """
+    try:
+        bands = np.load(path)
+    except (IOError, ValueError) as err:
+        LOG.warning("Could not load LSH bands from %s: %s", path, err)
+        return None
+    if bands.dtype != np.intp or bands.ndim != 2 or \
+            bands.shape[0] < 1 or bands.shape[1] != bandwidth or \
+            bands.min() < 0 or bands.max() >= width:
+        LOG.warning("Ignoring invalid LSH bands in %s (shape %s, dtype %s)",
+                    path, bands.shape, bands.dtype)
+        return None
+    return bands
+
+
+def _save_sig_bands(path, bands):
+    """Atomically write bands to path, logging on failure"""
+    dirname = os.path.dirname(path)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, bands)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        LOG.warning("Could not cache LSH bands in %s: %s", path, err)
+
+
+def _build_sig_bands(width, bandwidth, scheme):
+    """Generate bands (tuples of signature indices) for a scheme"""
     split_res = re.split(r'\b([a-zA-Z]+)(?=\d+\b)', scheme)
     _, scheme_code, ramp = split_res
     ramp = int(ramp)
@@ -227,18 +749,30 @@ def create_sig_selectors(width, bandwidth, scheme):
             bands = lsh_combinations(width, bandwidth, ramp)
         else:
             raise ValueError("ramp parameter cannot be negative")
-        indices = range(len(bands))
     elif scheme_code == "b":
         if ramp < 1:
             raise ValueError("for b-schemes, ramp value must be >= 1")
         bands = cntuplesx(width, bandwidth, ramp)
         # indices = list(chain(*[[x] * ramp for x in range(width / ramp)]))
-        indices = range(len(bands))
     else:
         raise ValueError("Invalid scheme")
-    LOG.info("Choosing LSH bands: " + ", ".join("{}: {}".format(idx, band)
-                                                for idx, band in izip(indices, bands)))
-    return zip(indices, create_getters(bands))
+    return bands
+
+
+def create_sig_selectors(width, bandwidth, scheme):
+    """Generate indices for LSH band selectors
+
+    :param width:
+    :type width: int
+    :param bandwidth:
+    :type bandwidth: int
+    :param scheme:
+    :type scheme: str
+    :return:
+    :rtype: tuple
+    """
+    indices, bands = create_sig_bands(width, bandwidth, scheme)
+    return zip(indices, create_getters(imap(tuple, bands.tolist())))
 
 
 class Shingler(object):
@@ -248,8 +782,15 @@ class Shingler(object):
         "sbph": mshinglify      # after "sparse binary polynomial hashing"
     }
 
+    # variants of the above producing shingle hashes (hashed=True)
+    _hashed_algorithms = {
+        "standard": hash_shingles,
+        "sbph": hash_mshingles
+    }
+
     def __init__(self, span=3, skip=0, kmin=0, algorithm="standard", unique=True,
-                 tokenizer=None, normalizer=None):
+                 tokenizer=None, normalizer=None, hashed=False, seed=0,
+                 hash_cache=None):
         """
         :param span: How many words should a shingle span
         :type span: int
@@ -263,15 +804,46 @@ class Shingler(object):
         :type tokenizer: Tokenizer
         :param normalizer: instance of Normalizer class
         :type normalizer: Normalizer
+        :param hashed: return shingles as a vector of 64-bit hashes instead
+                       of tuples of tokens (see hash_shingles and
+                       hash_mshingles)
+        :type hashed: bool
+        :param seed: seed for hashing tokens (hashed shingles only)
+        :type seed: int
+        :param hash_cache: optional cache of token hashes (hashed shingles only)
+        :type hash_cache: HashCache
         """
+        if hashed and algorithm not in self._hashed_algorithms:
+            raise NotImplementedError("Hashed shingles are not supported by '%s'"
+                                      % algorithm)
+        if hash_cache is not None and hash_cache.seed != seed:
+            raise ValueError("hash cache seed must match shingler seed")
         self._algorithm = algorithm
         self._shinglify = self._algorithms[algorithm]
+        self._hash_shinglify = self._hashed_algorithms.get(algorithm)
         self._span = span
         self._skip = skip
         self._kmin = kmin
         self._unique = unique
         self._tokenize = list if tokenizer is None else tokenizer.tokenize
         self._normalizer = normalizer
+        self._hashed = hashed
+        self._seed = seed
+        self._hash_cache = hash_cache
+
+    def _hash_tokens(self, tokens):
+        """Hash every token once
+
+        :returns: a vector of token hashes
+        :rtype: numpy.ndarray
+        """
+        hash_cache = self._hash_cache
+        if hash_cache is None:
+            seed = self._seed
+            hashes = [hash64(token, seed) for token in tokens]
+        else:
+            hashes = hash_cache.hash_many(tokens)
+        return np.array(hashes, dtype=np.uint64)
 
     def get_shingles(self, input_text, prefix=None):
         """Return a vector of shingles from a source text
@@ -280,8 +852,9 @@ class Shingler(object):
         :type input_text: collections.Iterable
         :param prefix: an object to prepend to token sequence
         :type prefix: object
-        :return: A set of shingles (tuples)
-        :rtype: set, list
+        :return: A set of shingles (tuples), or a vector of shingle hashes
+                 (sorted and unique if unique=True) when hashed=True
+        :rtype: set, list, numpy.ndarray
         """
         normalizer = self._normalizer
         text = input_text \
@@ -300,10 +873,289 @@ class Shingler(object):
             if append_num > 0:
                 tokens = take(token_count + append_num, cycle(tokens))
         final_it = tokens if prefix is None else chain([prefix], tokens)
+        if self._hashed:
+            shingles = self._hash_shinglify(self._hash_tokens(final_it), span,
+                                            skip=self._skip)
+            return np.unique(shingles) if unique else shingles
         shingles = self._shinglify(final_it, span, skip=self._skip)
         result = set(shingles) if unique else list(shingles)
         return result
 
+    def iter_hashes(self, input_text, prefix=None, chunk_size=4096):
+        """Stream shingle hashes of a source text in chunks
+
+        Tokens are consumed from an iterator chunk_size at a time and only
+        the last few token hashes are carried over between chunks, so memory
+        use does not depend on document length. Concatenated chunks are the
+        same as the output of get_shingles with hashed=True and unique=False;
+        duplicate shingles are not removed, which does not matter for minhash
+        signers (see VectorMinHashSignature.get_signature_stream).
+
+        :param input_text: Input sequence or iterator of tokens
+        :type input_text: collections.Iterable
+        :param prefix: an object to prepend to token sequence
+        :type prefix: object
+        :param chunk_size: number of tokens to hash at once
+        :type chunk_size: int
+        :return: a generator of vectors of shingle hashes
+        :rtype: collections.Iterable
+        """
+        if self._algorithm != "standard":
+            raise NotImplementedError("Streaming is not supported by '%s'"
+                                      % self._algorithm)
+        normalizer = self._normalizer
+        text = input_text \
+            if normalizer is None \
+            else normalizer.normalize(input_text)
+        tokens = iter(text if isiterable(text) else self._tokenize(text))
+        span = self._span
+        kmin = self._kmin
+        if not self._unique and kmin > 0:
+            # only documents shorter than kmin shingles need to be cycled
+            prefix_token_count = 0 if prefix is None else 1
+            head = take(kmin + span - 1 - prefix_token_count, tokens)
+            token_count = len(head)
+            num_shingles = token_count - span + prefix_token_count + 1
+            append_num = kmin - num_shingles
+            if append_num > 0 and token_count > 0:
+                head = take(token_count + append_num, cycle(head))
+            tokens = chain(head, tokens)
+        if prefix is not None:
+            tokens = chain([prefix], tokens)
+
+        step = self._skip + 1
+        offsets = np.arange(0, span, step)
+        last_offset = offsets[-1]
+        carry = np.empty(0, dtype=np.uint64)
+        started = False
+        while True:
+            chunk = take(chunk_size, tokens)
+            if not chunk:
+                break
+            token_hashes = np.concatenate([carry, self._hash_tokens(chunk)])
+            if not started and len(token_hashes) < span:
+                carry = token_hashes
+                continue
+            started = True
+            num_shingles = len(token_hashes) - last_offset
+            if num_shingles > 0:
+                yield _combine_token_hashes(
+                    token_hashes, np.arange(num_shingles), offsets)
+                token_hashes = token_hashes[num_shingles:]
+            carry = token_hashes
+        if not started:
+            # documents shorter than span give one shingle
+            yield hash_shingles(carry, span, skip=self._skip)
+
+
+# base of the rolling polynomial hash (odd, so invertible mod 2 ** 64)
+_ROLLING_BASE = 0x100000001b3
+
+
+def _inverse_mod64(num):
+    """Multiplicative inverse of an odd number modulo 2 ** 64
+
+    >>> (_inverse_mod64(3) * 3) % (1 << 64)
+    1L
+    """
+    inverse = num
+    for _ in xrange(6):
+        inverse = (inverse * (2 - num * inverse)) % (1 << 64)
+    return inverse
+
+
+def _powers64(base, count):
+    """Vector of base ** i (mod 2 ** 64) for i in range(count)"""
+    powers = np.empty(count, dtype=np.uint64)
+    if count > 0:
+        powers[0] = 1
+        powers[1:] = base
+        powers = np.cumprod(powers, dtype=np.uint64)
+    return powers
+
+
+class CharShingler(object):
+    """Hash character k-grams of strings with a rolling polynomial hash
+
+    A Rabin-Karp style alternative to ``Shingler(span, tokenizer=None)`` for
+    short strings such as names: k-gram hashes are computed from prefix sums
+    over character codes instead of building one tuple per k-gram, and a
+    batch of strings is hashed in one pass. The result is a vector of
+    64-bit hashes that minhash signers take directly.
+
+    Characters at positions t, t + step, ... (where step = skip + 1) are
+    weighted by inverse powers of the base, so that a cumulative sum over
+    every residue class of positions gives the polynomial hash of any
+    k-gram (times a known power of the base) as a difference of two sums.
+    """
+
+    def __init__(self, span=3, skip=0, kmin=0, unique=True, seed=0):
+        """
+        :param span: How many characters should a shingle span
+        :type span: int
+        :param skip: How many characters should a shingle skip
+        :type skip: int
+        :param kmin: minimum expected number of shingles (not set if 0 or unique=True)
+        :type kmin: int
+        :param unique: whether to de-dupe shingles
+        :type unique: bool
+        :param seed: hash seed
+        :type seed: int
+        """
+        if span < 1:
+            raise ValueError("span must be a positive integer")
+        self._span = span
+        self._step = skip + 1
+        self._kmin = kmin
+        self._unique = unique
+        self._seed = seed
+        self._seed_mix = np.uint64(hash64("", seed))
+
+    def _char_codes(self, text):
+        """Vector of character codes of a string"""
+        if isinstance(text, unicode):
+            return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        return np.frombuffer(text, dtype=np.uint8)
+
+    def _batch_codes(self, texts, prefixes):
+        """Concatenated character codes of strings and their lengths
+
+        Prefixes are coded as their hash and placed before their string.
+
+        :returns: a tuple of a vector of codes and a vector of lengths
+        :rtype: tuple
+        """
+        lengths = np.fromiter(imap(len, texts), dtype=np.int64, count=len(texts))
+        types = set(imap(type, texts))
+        codes = None
+        if types == {str}:
+            codes = np.frombuffer("".join(texts), dtype=np.uint8)
+        elif types == {unicode}:
+            codes = self._char_codes(u"".join(texts))
+        if codes is None or len(codes) != lengths.sum():
+            # mixed strings or surrogate pairs on a narrow Python build
+            all_codes = map(self._char_codes, texts)
+            lengths = np.fromiter(imap(len, all_codes), dtype=np.int64,
+                                  count=len(texts))
+            codes = np.concatenate(all_codes) if all_codes else codes
+        codes = codes.astype(np.uint64)
+        has_prefix = np.array([prefix is not None for prefix in prefixes],
+                              dtype=bool)
+        if not self._unique and self._kmin > 0:
+            codes, lengths = self._cycle_codes(codes, lengths, has_prefix)
+        if has_prefix.any():
+            seed = self._seed
+            prefix_codes = np.array([hash64(prefix, seed) for prefix in prefixes
+                                     if prefix is not None], dtype=np.uint64)
+            offsets = np.cumsum(lengths) - lengths
+            codes = np.insert(codes, offsets[has_prefix], prefix_codes)
+            lengths = lengths + has_prefix
+        return codes, lengths
+
+    def _cycle_codes(self, codes, lengths, has_prefix):
+        """Cycle characters of every string until it has kmin shingles"""
+        kmin = self._kmin
+        extra = np.maximum(0, kmin - (lengths + has_prefix - self._span + 1))
+        extra[lengths == 0] = 0
+        if not extra.any():
+            return codes, lengths
+        parts = np.split(codes, np.cumsum(lengths)[:-1])
+        codes = np.concatenate([np.resize(part, len(part) + num_extra)
+                                for part, num_extra in izip(parts, extra)])
+        return codes, lengths + extra
+
+    def _hash_windows(self, codes, starts, lengths):
+        """Rolling hashes of windows of characters
+
+        :param codes: vector of character codes
+        :type codes: numpy.ndarray
+        :param starts: window start positions
+        :type starts: numpy.ndarray
+        :param lengths: number of characters in each window
+        :type lengths: numpy.ndarray
+        :returns: vector of window hashes
+        :rtype: numpy.ndarray
+        """
+        step = self._step
+        num_rows = (len(codes) + step - 1) // step
+        max_length = int(lengths.max()) if len(lengths) else 0
+        powers = _powers64(_ROLLING_BASE, num_rows + max_length + 1)
+        inverse_powers = _powers64(_inverse_mod64(_ROLLING_BASE), num_rows)
+
+        # per residue class of positions, prefix sums of weighted codes
+        weighted = np.zeros(num_rows * step, dtype=np.uint64)
+        weighted[:len(codes)] = codes * np.repeat(inverse_powers, step)[:len(codes)]
+        sums = np.zeros((num_rows + 1, step), dtype=np.uint64)
+        np.cumsum(weighted.reshape(num_rows, step), axis=0, dtype=np.uint64,
+                  out=sums[1:])
+
+        rows, cols = np.divmod(starts, step)
+        window_sums = sums[rows + lengths, cols] - sums[rows, cols]
+        # empty windows (of empty strings) have zero sums
+        hashes = window_sums * powers[np.maximum(rows + lengths - 1, 0)]
+        return fmix64(hashes ^ self._seed_mix)
+
+    def _window_layout(self, lengths):
+        """Window starts and lengths for every string, same as shinglify
+
+        :returns: a tuple of window starts, window lengths and the number
+                  of windows per string
+        :rtype: tuple
+        """
+        span = self._span
+        step = self._step
+        last_offset = ((span - 1) // step) * step
+        # strings shorter than span give one shingle
+        short = lengths < span
+        counts = np.where(short, 1, lengths - last_offset)
+        window_lengths = np.where(short, (lengths + step - 1) // step,
+                                  (span - 1) // step + 1)
+        offsets = np.cumsum(lengths) - lengths
+        first_windows = np.cumsum(counts) - counts
+        starts = np.arange(counts.sum()) + np.repeat(offsets - first_windows, counts)
+        return starts, np.repeat(window_lengths, counts), counts
+
+    def get_shingles(self, input_text, prefix=None):
+        """Return a vector of k-gram hashes of a string
+
+        :param input_text: input string
+        :type input_text: str, unicode
+        :param prefix: an object to prepend to the string
+        :type prefix: object
+        :return: a vector of shingle hashes (sorted and unique if unique=True)
+        :rtype: numpy.ndarray
+        """
+        return self.get_shingles_batch([input_text], [prefix])[0]
+
+    def get_shingles_batch(self, texts, prefixes=None):
+        """Return vectors of k-gram hashes of a batch of strings
+
+        :param texts: input strings
+        :type texts: collections.Sequence
+        :param prefixes: objects to prepend to each string
+        :type prefixes: collections.Sequence
+        :return: a list of vectors of shingle hashes
+        :rtype: list
+        """
+        if len(texts) == 0:
+            return []
+        if prefixes is None:
+            prefixes = [None] * len(texts)
+        codes, lengths = self._batch_codes(texts, prefixes)
+        starts, window_lengths, counts = self._window_layout(lengths)
+        hashes = self._hash_windows(codes, starts, window_lengths)
+        if self._unique:
+            # sort by string, then by hash, and drop repeated hashes
+            doc_ids = np.repeat(np.arange(len(texts)), counts)
+            order = np.lexsort((hashes, doc_ids))
+            hashes = hashes[order]
+            keep = np.ones(len(hashes), dtype=bool)
+            keep[1:] = (hashes[1:] != hashes[:-1]) | \
+                (doc_ids[1:] != doc_ids[:-1])
+            hashes = hashes[keep]
+            counts = np.bincount(doc_ids[keep], minlength=len(texts))
+        return np.split(hashes, np.cumsum(counts)[:-1])
+
 
 def jaccard_sim(set1, set2):
     """Return Jaccard similarity between two sets
@@ -321,6 +1173,26 @@ def jaccard_sim(set1, set2):
     return float(len(set_x & set_y)) / float(len(set_x | set_y))
 
 
+def weighted_jaccard_sim(weights1, weights2):
+    """Return weighted Jaccard similarity between two weight mappings
+
+    :param weights1: mapping of features to non-negative weights
+    :type weights1: collections.Mapping
+    :param weights2: mapping of features to non-negative weights
+    :type weights2: collections.Mapping
+    :returns: sum of minimum weights over sum of maximum weights
+    :rtype: float
+    :raises ZeroDivisionError:
+
+    >>> weighted_jaccard_sim({'a': 1, 'b': 2}, {'b': 1, 'c': 1})
+    0.25
+    """
+    keys = set(weights1) | set(weights2)
+    pairs = [(weights1.get(key, 0.0), weights2.get(key, 0.0)) for key in keys]
+    return float(sum(min(pair) for pair in pairs)) / \
+        float(sum(max(pair) for pair in pairs))
+
+
 def get_bandwidth(width, threshold):
     """Approximates the bandwidth needed to achieve a threshold.
 
@@ -329,6 +1201,9 @@ def get_bandwidth(width, threshold):
     rows = #rows per band
     width = bands * rows = #elements in signature
 
+    See lsh_hdc.optimize for selection of LSH parameters based on error
+    rates and cost.
+
     :returns: number of rows per band
     :rtype: int
     """
@@ -375,6 +1250,14 @@ class Signature(object):
         :rtype : list
         """
 
+    @abstractmethod
+    def get_signatures(self, batch, with_sketch=False):
+        """Return signatures for a batch of vectors as a 2-D array
+        :param batch: a sequence of vectors
+        :type batch: collections.Sequence
+        :rtype : numpy.ndarray
+        """
+
 
 def extend(lst, k):
     """
@@ -392,7 +1275,8 @@ def extend(lst, k):
 class MinHashSignature(Signature):
     """Obtain minhash signature"""
 
-    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1, seed=0):
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1, seed=0,
+                 key_type="str"):
         if width % kmin != 0:
             raise ValueError("width must be a multiple of kmin")
         if type(kmin) != int:
@@ -406,13 +1290,17 @@ class MinHashSignature(Signature):
         self.width = width / kmin
         self.kmin = kmin
 
+        if key_type not in KEY_TYPES:
+            raise ValueError("key_type must be one of %s" % (KEY_TYPES,))
         self.lsh_hasher = lsh_hasher
+        self.key_type = key_type
         self.seed = seed
         self.universe_size = universe_size
 
         self._sketch_getter = None
         self._simhash_sketcher = None
         self._sketch_weights = None
+        self._sketch_size = 0
 
         self.hashes = self.create_hash_functions()
 
@@ -422,6 +1310,7 @@ class MinHashSignature(Signature):
         sketch_indices, sketch_classes = \
             self.create_sketch_getter(sketch_size)
         self._sketch_getter = itemgetter(*sketch_indices)
+        self._sketch_size = len(sketch_indices)
         self._sketch_weights = \
             self.sketch_weight_builder(sketch_base, sketch_classes)
         if sketch_type == 'simhash':
@@ -503,7 +1392,7 @@ class MinHashSignature(Signature):
             sig_fun = lambda f: extend([f("")], kmin)
 
         # flatten list of lists
-        return sum(imap(sig_fun, self.hashes), [])
+        return list(chain.from_iterable(imap(sig_fun, self.hashes)))
 
     def _get_minhashes_kmin1(self, vec):
         """Returns minhash signature from a feature vector
@@ -524,6 +1413,57 @@ class MinHashSignature(Signature):
         sketch = sum(1 << idx for idx, bit in enumerate(bits) if bit > 0)
         return sketch
 
+    def _get_sketch(self, minhashes):
+        """Returns a sketch from a minhash vector"""
+        minhash_sample = self._sketch_getter(minhashes)
+        if self._simhash_sketcher is not None:
+            return self._simhash_sketcher._sig_with_weights(
+                minhash_sample, self._sketch_weights)
+        else:
+            return self._minhash_sketch(minhash_sample)
+
+    def _get_minhash_matrix(self, batch):
+        """Returns minhash signatures from a batch of feature vectors
+        :returns: a matrix of shape (len(batch), width * kmin)
+        :rtype : numpy.ndarray
+        """
+        sig_len = self.width * self.kmin
+        matrix = np.empty((len(batch), sig_len), dtype=np.uint64)
+        for idx, vec in enumerate(batch):
+            matrix[idx] = self._get_minhashes(vec)
+        return matrix
+
+    def get_keys(self, minhashes):
+        """Returns LSH keys from a minhash vector
+
+        :param minhashes: a minhash vector (a signature matrix row)
+        :type minhashes: collections.Iterable
+        :returns: a list of keys
+        :rtype : list
+        """
+        lsh = self.lsh_hasher
+        if lsh is not None:
+            return lsh.hash_matrix(minhashes)[0]
+        if isinstance(minhashes, np.ndarray):
+            # mixing uint64 with Python longs would promote to float
+            minhashes = minhashes.tolist()
+        make_key = band_key if self.key_type == "int" else format_key
+        return [make_key(idx, minhash)
+                for idx, minhash in enumerate(minhashes)]
+
+    def get_batch_keys(self, matrix):
+        """Returns LSH keys for every row of a signature matrix
+
+        :param matrix: signature matrix as returned by get_signatures
+        :type matrix: numpy.ndarray
+        :returns: a list of lists of keys
+        :rtype : list
+        """
+        lsh = self.lsh_hasher
+        if lsh is not None:
+            return lsh.hash_matrix(matrix)
+        return [self.get_keys(row) for row in matrix.tolist()]
+
     def get_signature(self, vec, with_sketch=False):
         """Returns minhash signature from a feature vector (with optional LSH)
 
@@ -531,23 +1471,37 @@ class MinHashSignature(Signature):
         :rtype : list
         """
         minhashes = self._get_minhashes(vec)
-        lsh = self.lsh_hasher
-        if lsh is None:
-            sig_vector = ["{}:{}".format(idx, minhash)
-                          for idx, minhash in enumerate(minhashes)]
+        sig_vector = self.get_keys(minhashes)
+        if with_sketch:
+            return sig_vector, self._get_sketch(minhashes)
         else:
-            sig_vector = list(lsh.hash(minhashes))
+            return sig_vector
+
+    def get_signatures(self, batch, with_sketch=False):
+        """Returns raw minhash signatures from a batch of feature vectors
 
+        Unlike get_signature, no LSH is applied -- rows of the returned
+        matrix can be converted to keys with get_keys. Sketches of up to
+        64 bits are returned as a uint64 vector, wider ones as an object
+        vector of Python longs.
+
+        :param batch: a sequence of feature vectors
+        :type batch: collections.Sequence
+        :returns: a contiguous matrix of shape (len(batch), width * kmin),
+                  or a tuple of the matrix and a vector of sketches
+        :rtype : numpy.ndarray, tuple
+        """
+        matrix = self._get_minhash_matrix(batch)
         if with_sketch:
-            minhash_sample = self._sketch_getter(minhashes)
-            if self._simhash_sketcher is not None:
-                sketch = self._simhash_sketcher._sig_with_weights(
-                    minhash_sample, self._sketch_weights)
+            sketches = imap(self._get_sketch, matrix.tolist())
+            if self._sketch_size <= 64:
+                sketches = np.fromiter(sketches, dtype=np.uint64,
+                                       count=len(matrix))
             else:
-                sketch = self._minhash_sketch(minhash_sample)
-            return sig_vector, sketch
+                sketches = np.array(list(sketches), dtype=object)
+            return matrix, sketches
         else:
-            return sig_vector
+            return matrix
 
     def get_threshold(self):
         """
@@ -572,6 +1526,992 @@ class MinHashSketchSignature(MinHashSignature):
         minhash_sample = self._sketch_getter(minhashes)
         return self._minhash_sketch(minhash_sample)
 
+    def get_signatures(self, batch, with_sketch=False):
+        """Returns sketches from a batch of token vectors
+
+        :returns: a matrix of 64-bit words (least significant first) with
+                  one row per sketch
+        :rtype : numpy.ndarray
+        """
+        num_words = (self._actual_width + 63) // 64
+        matrix = self._get_minhash_matrix(batch)
+        result = np.empty((len(batch), num_words), dtype=np.uint64)
+        for idx, minhashes in enumerate(matrix.tolist()):
+            sketch = self._minhash_sketch(self._sketch_getter(minhashes))
+            result[idx] = long2words(sketch, num_words)
+        return result
+
+
+# constants of the 64-bit finalizer from MurmurHash3
+_FMIX64_MUL1 = np.uint64(0xff51afd7ed558ccd)
+_FMIX64_MUL2 = np.uint64(0xc4ceb9fe1a85ec53)
+_FMIX64_SHIFT = np.uint64(33)
+
+
+def fmix64(arr):
+    """Avalanche bits of an array of 64-bit hashes (MurmurHash3 finalizer)
+
+    The transform is a bijection on 64-bit integers and operates on uint64
+    arrays in place, relying on wrap-around multiplication.
+
+    :param arr: array of hashes
+    :type arr: numpy.ndarray
+    :returns: the same array, mixed
+    :rtype: numpy.ndarray
+    """
+    arr ^= arr >> _FMIX64_SHIFT
+    arr *= _FMIX64_MUL1
+    arr ^= arr >> _FMIX64_SHIFT
+    arr *= _FMIX64_MUL2
+    arr ^= arr >> _FMIX64_SHIFT
+    return arr
+
+
+# largest number of permuted hashes (features times width) to compute at
+# once when signing a batch
+_PERMUTE_BLOCK_SIZE = 1 << 16
+
+
+def _feature_blocks(lengths, width):
+    """Split a batch into runs of consecutive documents with at most
+    _PERMUTE_BLOCK_SIZE permuted hashes each (or one document, if it is
+    larger than that)
+
+    :param lengths: number of features of each document
+    :type lengths: numpy.ndarray
+    :param width: number of permuted hashes per feature
+    :type width: int
+    :returns: a list of (first, last) document index ranges
+    :rtype: list
+    """
+    max_features = max(1, _PERMUTE_BLOCK_SIZE // width)
+    blocks = []
+    first = 0
+    total = 0
+    for idx, length in enumerate(lengths.tolist()):
+        if idx > first and total + length > max_features:
+            blocks.append((first, idx))
+            first = idx
+            total = 0
+        total += length
+    blocks.append((first, len(lengths)))
+    return blocks
+
+
+class VectorMinHashSignature(MinHashSignature):
+    """Obtain minhash signature by hashing each feature once
+
+    Instead of calling ``width`` seeded CityHash functions on every feature,
+    each feature is hashed to a 64-bit value once and the ``width``
+    permutations are derived from it in NumPy using universal hashing
+    ``a * x + b (mod 2 ** 64)`` with odd ``a``, followed by a 64-bit
+    finalizer to avalanche low-order bits. Permutation coefficients are
+    drawn from a generator seeded with ``seed``, so a given seed always
+    produces the same signatures.
+
+    Base hashes are computed with :func:`hash64`, optionally through a
+    :class:`HashCache` instance created with the same seed.
+    """
+
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
+                 seed=0, hash_cache=None, key_type="str"):
+        """
+        :param hash_cache: optional cache of base hashes
+        :type hash_cache: HashCache
+        :param key_type: type of LSH keys when lsh_hasher is not given
+                         ("str" or "int")
+        :type key_type: str
+        """
+        if hash_cache is not None and hash_cache.seed != seed:
+            raise ValueError("hash cache seed must match signer seed")
+        self.hash_cache = hash_cache
+        MinHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                  universe_size=universe_size, kmin=kmin,
+                                  seed=seed, key_type=key_type)
+
+    def _hash_iter(self, features):
+        """Return a generator of base hashes of features"""
+        hash_cache = self.hash_cache
+        if hash_cache is None:
+            seed = self.seed
+            return (hash64(feature, seed) for feature in features)
+        else:
+            return iter(hash_cache.hash_many(features))
+
+    def create_hash_functions(self):
+        """Return permutation coefficients as a pair of column vectors
+
+        :returns: tuple of (multipliers, increments)
+        :rtype: tuple
+        """
+        rng = random.Random(self.seed)
+        mask = (1 << 64) - 1
+        multipliers = [rng.getrandbits(64) | 1 for _ in xrange(self.width)]
+        increments = [rng.getrandbits(64) & mask for _ in xrange(self.width)]
+        return (np.array(multipliers, dtype=np.uint64)[:, np.newaxis],
+                np.array(increments, dtype=np.uint64)[:, np.newaxis])
+
+    def _hash_features(self, vec):
+        """Hash each feature once
+
+        Empty sets are treated as sets consisting of an empty string,
+        same as in :class:`MinHashSignature`
+
+        Vectors of 64-bit integers (such as hashed shingles returned by
+        Shingler with hashed=True) are taken to be hashes already.
+
+        :returns: a vector of base hashes
+        :rtype: numpy.ndarray
+        """
+        if isinstance(vec, np.ndarray) and vec.dtype == np.uint64 and len(vec):
+            return vec
+        if len(vec) == 0:
+            vec = [""]
+        return np.fromiter(self._hash_iter(vec), dtype=np.uint64,
+                           count=len(vec))
+
+    def _permute(self, base_hashes):
+        """Derive all permuted hashes from base hashes
+
+        :returns: a matrix of shape (width, len(base_hashes))
+        :rtype: numpy.ndarray
+        """
+        multipliers, increments = self.hashes
+        permuted = fmix64(multipliers * base_hashes + increments)
+        universe_size = self.universe_size
+        if universe_size is not None:
+            permuted %= np.uint64(universe_size)
+        return permuted
+
+    def _minhash_matrix(self, permuted):
+        """Reduce a matrix of permuted hashes to a flat minhash vector
+
+        :returns: a vector of length width * kmin
+        :rtype: numpy.ndarray
+        """
+        kmin = self.kmin
+        if kmin == 1:
+            return permuted.min(axis=1)
+        num_features = permuted.shape[1]
+        if num_features > kmin:
+            permuted = np.partition(permuted, kmin - 1, axis=1)[:, :kmin]
+        smallest = np.sort(permuted, axis=1)
+        if num_features < kmin:
+            # extend by duplicating last item
+            padding = np.repeat(smallest[:, -1:], kmin - num_features, axis=1)
+            smallest = np.hstack((smallest, padding))
+        return smallest.ravel()
+
+    def _get_minhashes_kmin1p(self, vec):
+        """Returns minhash signature from a feature vector
+        :returns: a signature vector
+        :rtype : list
+        """
+        permuted = self._permute(self._hash_features(vec))
+        return self._minhash_matrix(permuted).tolist()
+
+    _get_minhashes_kmin1 = _get_minhashes_kmin1p
+
+    def _permute_rows(self, base_hashes):
+        """Same as _permute, but with one row per feature
+
+        :returns: a matrix of shape (len(base_hashes), width)
+        :rtype: numpy.ndarray
+        """
+        multipliers, increments = self.hashes
+        permuted = fmix64(base_hashes[:, np.newaxis] * multipliers.T +
+                          increments.T)
+        universe_size = self.universe_size
+        if universe_size is not None:
+            permuted %= np.uint64(universe_size)
+        return permuted
+
+    def _get_minhash_matrix(self, batch):
+        """Returns minhash signatures from a batch of feature vectors
+
+        Features of consecutive documents are permuted together in blocks
+        of bounded size (see _feature_blocks) and then reduced per document.
+
+        :returns: a matrix of shape (len(batch), width * kmin)
+        :rtype : numpy.ndarray
+        """
+        num_docs = len(batch)
+        sig_len = self.width * self.kmin
+        matrix = np.empty((num_docs, sig_len), dtype=np.uint64)
+        if num_docs == 0:
+            return matrix
+        hashed = map(self._hash_features, batch)
+        lengths = np.fromiter(imap(len, hashed), dtype=np.intp, count=num_docs)
+        for first, last in _feature_blocks(lengths, self.width):
+            block_lengths = lengths[first:last]
+            ends = np.cumsum(block_lengths)
+            starts = ends - block_lengths
+            permuted = self._permute_rows(np.concatenate(hashed[first:last]))
+            if self.kmin == 1:
+                # every document has at least one feature, so offsets are
+                # strictly increasing as reduceat requires
+                matrix[first:last] = np.minimum.reduceat(permuted, starts, axis=0)
+                continue
+            for idx in xrange(last - first):
+                matrix[first + idx] = self._minhash_matrix(
+                    permuted[starts[idx]:ends[idx]].T)
+        return matrix
+
+    def get_signature_stream(self, hash_chunks, with_sketch=False):
+        """Returns minhash signature from a stream of base hash vectors
+
+        Each vector of hashes (such as a chunk yielded by
+        Shingler.iter_hashes) is folded into running minima, so memory use
+        is O(width * kmin) regardless of the number of hashes. The result
+        is the same as that of get_signature on the set of all hashes.
+
+        :param hash_chunks: an iterable of vectors of 64-bit hashes
+        :type hash_chunks: collections.Iterable
+        :returns: a signature vector
+        :rtype : list
+        """
+        minhashes = self._stream_minhashes(hash_chunks)
+        sig_vector = self.get_keys(minhashes)
+        if with_sketch:
+            return sig_vector, self._get_sketch(minhashes)
+        else:
+            return sig_vector
+
+    def _stream_minhashes(self, hash_chunks):
+        """Returns minhashes from a stream of base hash vectors"""
+        state = None
+        for base_hashes in hash_chunks:
+            if len(base_hashes) > 0:
+                state = self._stream_update(
+                    state, np.asarray(base_hashes, dtype=np.uint64))
+        if state is None:
+            state = self._stream_update(state, self._hash_features(()))
+        return self._stream_finish(state)
+
+    def _stream_update(self, state, base_hashes):
+        """Fold base hashes into running minima
+
+        For kmin > 1, the state holds the kmin smallest distinct values in
+        every row (or the largest 64-bit value in unused slots).
+        """
+        permuted = self._permute(base_hashes)
+        if self.kmin == 1:
+            minima = permuted.min(axis=1)
+            return minima if state is None else np.minimum(state, minima)
+        return _merge_smallest(state, permuted, self.kmin)
+
+    def _stream_finish(self, state):
+        """Convert running minima to a minhash vector"""
+        if self.kmin == 1:
+            return state.tolist()
+        return _pad_smallest(state).ravel().tolist()
+
+
+def _merge_smallest(state, values, k):
+    """Merge rows of values into rows of k smallest distinct values
+
+    :param state: a (rows, k) matrix of sorted values, or None
+    :type state: numpy.ndarray
+    :param values: a (rows, n) matrix of new values
+    :type values: numpy.ndarray
+    :param k: number of values to keep in every row
+    :type k: int
+    :returns: a (rows, k) matrix of sorted values, with unused slots set to
+              the largest 64-bit value
+    :rtype: numpy.ndarray
+    """
+    unused = np.iinfo(np.uint64).max
+    if values.shape[1] > k:
+        values = np.partition(values, k - 1, axis=1)[:, :k]
+    merged = values if state is None else np.hstack((state, values))
+    merged = np.sort(merged, axis=1)
+    merged[:, 1:][merged[:, 1:] == merged[:, :-1]] = unused
+    merged = np.sort(merged, axis=1)
+    if merged.shape[1] < k:
+        padding = np.full((merged.shape[0], k - merged.shape[1]), unused,
+                          dtype=np.uint64)
+        merged = np.hstack((merged, padding))
+    return merged[:, :k]
+
+
+def _pad_smallest(state):
+    """Fill unused slots with the last used value in each row"""
+    unused = np.iinfo(np.uint64).max
+    num_used = np.maximum((state != unused).sum(axis=1), 1)
+    positions = np.minimum(np.arange(state.shape[1]), num_used[:, np.newaxis] - 1)
+    return state[np.arange(state.shape[0])[:, np.newaxis], positions]
+
+
+# odd multiplier separating probe sequences of optimal densification
+_OPH_PROBE_STEP = np.uint64(0x9e3779b97f4a7c15)
+
+# number of probes of optimal densification tried at once
+_OPH_PROBE_BLOCK = 8
+
+
+class OnePermutationMinHashSignature(VectorMinHashSignature):
+    """Obtain minhash signature with one permutation hashing (OPH)
+
+    Each feature is hashed exactly once and the hash range is split into
+    ``width / kmin`` bins, each bin contributing its ``kmin`` smallest
+    hashes to the signature. Bins left empty are filled from non-empty bins
+    either by rotation (Shrivastava & Li, 2014) or by optimal densification
+    (Shrivastava, 2017), which keeps the signature LSH-compatible. Signing
+    cost is O(N + width * probes_per_bin) instead of O(N * width).
+
+    Note: rotation makes neighboring bins of very sparse sets highly
+    correlated, which inflates collisions under contiguous banding schemes
+    such as "a0". Optimal densification does not have this problem.
+    """
+
+    densification_methods = ("optimal", "rotation")
+
+    def __init__(self, width, lsh_hasher=None, universe_size=None, kmin=1,
+                 seed=0, densification="optimal", probes_per_bin=8,
+                 hash_cache=None, key_type="str"):
+        """
+        :param densification: how to fill empty bins ("optimal" or "rotation")
+        :type densification: str
+        :param probes_per_bin: for optimal densification, the number of
+                               random probes (per bin) to try before falling
+                               back to rotation
+        :type probes_per_bin: int
+        """
+        if densification not in self.densification_methods:
+            raise ValueError("Densification method %s not supported"
+                             % densification)
+        self.densification = densification
+        self.probes_per_bin = probes_per_bin
+        VectorMinHashSignature.__init__(
+            self, width, lsh_hasher=lsh_hasher, universe_size=universe_size,
+            kmin=kmin, seed=seed, hash_cache=hash_cache, key_type=key_type)
+
+    def create_hash_functions(self):
+        """Return per-bin seeds of probe sequences for optimal densification
+
+        Probe ``j`` of an empty bin ``i`` is a hash of ``j`` seeded with the
+        ``i``-th value (see _get_probes), so probe sequences are computed on
+        the fly rather than stored. All signers created with the same seed
+        share the sequences, so similar sets borrow consistently.
+
+        :rtype: numpy.ndarray
+        """
+        rng = random.Random(self.seed)
+        return np.array([rng.getrandbits(64) for _ in xrange(self.width)],
+                        dtype=np.uint64)
+
+    def _get_probes(self, empty, attempts):
+        """Returns a (len(empty), len(attempts)) matrix of bins probed by
+        empty bins
+        """
+        probes = fmix64(self.hashes[empty][:, np.newaxis] +
+                        attempts * _OPH_PROBE_STEP)
+        shift = np.uint64(32)
+        return (((probes >> shift) * np.uint64(self.width)) >> shift) \
+            .astype(np.intp)
+
+    def _get_bins(self, base_hashes):
+        """Map hashes to bins by their high-order bits
+
+        Bin index is monotonic in hash value, so a sorted vector of hashes
+        is also sorted by bin.
+        """
+        shift = np.uint64(32)
+        return ((base_hashes >> shift) * np.uint64(self.width)) >> shift
+
+    def _get_bin_minima(self, base_hashes):
+        """Returns a (num_bins, kmin) matrix of per-bin minima and a mask
+        of non-empty bins
+        """
+        num_bins = self.width
+        kmin = self.kmin
+        if kmin == 1:
+            bins = self._get_bins(base_hashes).astype(np.intp)
+            minima = np.full(num_bins, np.iinfo(np.uint64).max, dtype=np.uint64)
+            np.minimum.at(minima, bins, base_hashes)
+            nonempty = np.bincount(bins, minlength=num_bins) > 0
+            return minima[:, np.newaxis], nonempty
+        hashes = np.sort(base_hashes)
+        bins = self._get_bins(hashes)
+        bin_range = np.arange(num_bins, dtype=np.uint64)
+        starts = np.searchsorted(bins, bin_range, side='left')
+        counts = np.searchsorted(bins, bin_range, side='right') - starts
+        nonempty = counts > 0
+        # extend bins with fewer than kmin hashes by duplicating last item
+        offsets = np.minimum(np.arange(kmin), np.maximum(counts, 1)[:, np.newaxis] - 1)
+        positions = np.minimum(starts[:, np.newaxis] + offsets, len(hashes) - 1)
+        return hashes[positions], nonempty
+
+    def _densify_rotation(self, minima, nonempty, empty):
+        """Fill empty bins from the nearest non-empty bin to the right,
+        offsetting borrowed values by distance
+        """
+        num_bins = self.width
+        filled = np.flatnonzero(nonempty)
+        idx = np.searchsorted(filled, empty) % len(filled)
+        donors = filled[idx]
+        distances = (donors - empty) % num_bins
+        bin_size = np.uint64(((1 << 64) - 1) // num_bins)
+        offsets = distances.astype(np.uint64) * bin_size
+        minima[empty] = minima[donors] + offsets[:, np.newaxis]
+
+    def _densify_optimal(self, minima, nonempty, empty):
+        """Fill each empty bin from the first non-empty bin in its probe
+        sequence, falling back to rotation when all probes are empty
+
+        Probes are tried in blocks, only for bins not filled yet.
+        """
+        pending = empty
+        probes_per_bin = self.probes_per_bin
+        for start in xrange(0, probes_per_bin, _OPH_PROBE_BLOCK):
+            attempts = np.arange(start, min(start + _OPH_PROBE_BLOCK,
+                                            probes_per_bin), dtype=np.uint64)
+            probes = self._get_probes(pending, attempts)
+            hits = nonempty[probes]
+            first_hit = hits.argmax(axis=1)
+            found = hits[np.arange(len(pending)), first_hit]
+            minima[pending[found]] = minima[probes[found, first_hit[found]]]
+            pending = pending[~found]
+            if len(pending) == 0:
+                return
+        self._densify_rotation(minima, nonempty, pending)
+
+    def _get_minhashes_kmin1p(self, vec):
+        """Returns minhash signature from a feature vector
+        :returns: a signature vector
+        :rtype : list
+        """
+        minima, nonempty = self._get_bin_minima(self._hash_features(vec))
+        return self._densify(minima, nonempty)
+
+    def _densify(self, minima, nonempty):
+        """Fill empty bins and flatten bin minima to a signature vector"""
+        empty = np.flatnonzero(~nonempty)
+        if len(empty) > 0:
+            if self.densification == "optimal":
+                self._densify_optimal(minima, nonempty, empty)
+            else:
+                self._densify_rotation(minima, nonempty, empty)
+        universe_size = self.universe_size
+        if universe_size is not None:
+            minima %= np.uint64(universe_size)
+        return minima.ravel().tolist()
+
+    _get_minhashes_kmin1 = _get_minhashes_kmin1p
+
+    def _get_minhash_matrix(self, batch):
+        return MinHashSignature._get_minhash_matrix(self, batch)
+
+    def _stream_update(self, state, base_hashes):
+        """Fold base hashes into running bin minima (kmin=1 only)"""
+        if self.kmin != 1:
+            raise NotImplementedError(
+                "Streaming OPH signatures require kmin=1")
+        minima, nonempty = self._get_bin_minima(base_hashes)
+        if state is None:
+            return minima, nonempty
+        return np.minimum(state[0], minima), state[1] | nonempty
+
+    def _stream_finish(self, state):
+        minima, nonempty = state
+        return self._densify(minima, nonempty)
+
+
+# marks unused slots in bottom-k sketches of sets smaller than k
+BOTTOMK_EMPTY = np.iinfo(np.uint64).max
+
+
+def _bottomk_valid(sketch):
+    """Return the non-padding part of a bottom-k sketch"""
+    sketch = np.asarray(sketch, dtype=np.uint64)
+    return sketch[:np.searchsorted(sketch, BOTTOMK_EMPTY)]
+
+
+def bottomk_cardinality(sketch):
+    """Estimate set size from a bottom-k sketch
+
+    Sets with fewer than k distinct elements are counted exactly;
+    otherwise the estimate is (k - 1) / u where u is the k-th smallest
+    hash scaled to the unit interval.
+
+    :param sketch: sorted bottom-k sketch
+    :type sketch: numpy.ndarray
+    :rtype: float
+    """
+    valid = _bottomk_valid(sketch)
+    if len(valid) < len(sketch):
+        return float(len(valid))
+    kth = (float(valid[-1]) + 1.0) / 2.0 ** 64
+    return (len(valid) - 1) / kth
+
+
+def bottomk_jaccard(sketch1, sketch2):
+    """Estimate Jaccard similarity from two bottom-k sketches
+
+    Uses the k smallest hashes of the union of both sketches, which is the
+    bottom-k sketch of the union of both sets, and counts how many of
+    them occur in both sketches.
+
+    :param sketch1: sorted bottom-k sketch
+    :type sketch1: numpy.ndarray
+    :param sketch2: sorted bottom-k sketch
+    :type sketch2: numpy.ndarray
+    :rtype: float
+    """
+    valid1 = _bottomk_valid(sketch1)
+    valid2 = _bottomk_valid(sketch2)
+    k = min(len(sketch1), len(sketch2))
+    union = np.union1d(valid1, valid2)[:k]
+    if len(union) == 0:
+        return 1.0
+    both = np.intersect1d(valid1, valid2, assume_unique=True)
+    shared = np.count_nonzero(np.in1d(union, both, assume_unique=True))
+    return float(shared) / len(union)
+
+
+def bottomk_containment(sketch1, sketch2):
+    """Estimate containment of the first set in the second set
+    (|A & B| / |A|) from two bottom-k sketches
+
+    Only elements of the first sketch that fall within the hash range
+    sampled by the second sketch are considered; for those, membership in
+    the second set is known exactly.
+
+    :param sketch1: sorted bottom-k sketch of the first set
+    :type sketch1: numpy.ndarray
+    :param sketch2: sorted bottom-k sketch of the second set
+    :type sketch2: numpy.ndarray
+    :rtype: float
+    """
+    valid1 = _bottomk_valid(sketch1)
+    valid2 = _bottomk_valid(sketch2)
+    if len(valid2) == len(sketch2) and len(valid2) > 0:
+        # second sketch is full, so only its hash range is known
+        valid1 = valid1[valid1 <= valid2[-1]]
+    if len(valid1) == 0:
+        return 0.0
+    shared = np.count_nonzero(np.in1d(valid1, valid2, assume_unique=True))
+    return float(shared) / len(valid1)
+
+
+class BottomKSignature(VectorMinHashSignature):
+    """Obtain bottom-k sketch using a single hash function
+
+    Every feature is hashed once and the ``width`` smallest distinct hashes
+    are kept, so signing costs O(N) regardless of width. Sketches are
+    sorted arrays of fixed size, with sets of fewer than ``width`` distinct
+    features padded with ``BOTTOMK_EMPTY``. Use :func:`bottomk_jaccard` and
+    :func:`bottomk_containment` to compare sketches.
+
+    Since the position of a hash in a bottom-k sketch shifts when smaller
+    hashes are added, LSH keys by default are the sketch hashes themselves:
+    two sets sharing a key share one of their k smallest hashes, and the
+    number of shared keys (Cluster min_support) grows with similarity. When
+    ``lsh_hasher`` is given, positional bands are used instead, which only
+    suits near-duplicate detection.
+    """
+
+    def __init__(self, width, lsh_hasher=None, seed=0, hash_cache=None,
+                 key_type="str"):
+        VectorMinHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                        kmin=1, seed=seed,
+                                        hash_cache=hash_cache,
+                                        key_type=key_type)
+
+    def create_hash_functions(self):
+        """No permutations are needed -- base hashes are used directly"""
+        return None
+
+    def _get_minhashes_kmin1(self, vec):
+        """Returns bottom-k sketch from a feature vector
+        :returns: a sorted sketch vector
+        :rtype : list
+        """
+        return self._get_sketch_array(vec).tolist()
+
+    _get_minhashes_kmin1p = _get_minhashes_kmin1
+
+    def _get_sketch_array(self, vec):
+        """Returns bottom-k sketch as an array"""
+        width = self.width
+        hashes = self._hash_features(vec)
+        if len(hashes) > width:
+            smallest = np.unique(np.partition(hashes, width - 1)[:width])
+            if len(smallest) < width:
+                # duplicate features among the smallest hashes
+                smallest = np.unique(hashes)[:width]
+        else:
+            smallest = np.unique(hashes)
+        sketch = np.full(width, BOTTOMK_EMPTY, dtype=np.uint64)
+        sketch[:len(smallest)] = smallest
+        return sketch
+
+    def _get_minhash_matrix(self, batch):
+        """Returns bottom-k sketches from a batch of feature vectors
+        :returns: a matrix of shape (len(batch), width)
+        :rtype : numpy.ndarray
+        """
+        matrix = np.empty((len(batch), self.width), dtype=np.uint64)
+        for idx, vec in enumerate(batch):
+            matrix[idx] = self._get_sketch_array(vec)
+        return matrix
+
+    def _stream_update(self, state, base_hashes):
+        """Fold base hashes into the running bottom-k sketch"""
+        return _merge_smallest(state, base_hashes[np.newaxis, :], self.width)
+
+    def _stream_finish(self, state):
+        return state.ravel().tolist()
+
+    def get_keys(self, minhashes):
+        """Returns LSH keys from a bottom-k sketch
+
+        :param minhashes: a bottom-k sketch (a signature matrix row)
+        :type minhashes: collections.Iterable
+        :returns: a list of keys
+        :rtype : list
+        """
+        if self.lsh_hasher is not None:
+            return MinHashSignature.get_keys(self, minhashes)
+        if isinstance(minhashes, np.ndarray):
+            minhashes = minhashes.tolist()
+        make_key = long2int if self.key_type == "int" else str
+        return [make_key(minhash) for minhash in minhashes
+                if minhash != BOTTOMK_EMPTY]
+
+
+# number of uniform variates drawn per feature per hash function in ICWS
+_ICWS_NUM_UNIFORMS = 5
+_GOLDEN_GAMMA = np.uint64(0x9e3779b97f4a7c15)
+
+
+class WeightedMinHashSignature(VectorMinHashSignature):
+    """Obtain weighted minhash signature using Improved Consistent Weighted
+    Sampling (Ioffe, "Improved Consistent Sampling, Weighted Minhash and L1
+    Sketching", 2010)
+
+    Input vectors consist of (feature, weight) pairs or are mappings of
+    features to weights, such as a Counter over shingles returned by
+    Shingler with unique=False. The probability of two signatures matching
+    at a given index equals the weighted Jaccard similarity of the inputs.
+    Signatures are vectors of 64-bit hashes, so they can be used with LSHC
+    and Cluster same as regular minhash signatures.
+
+    All random variates are derived from feature hashes, so each feature is
+    hashed once, and a batch of documents is sampled in one operation.
+    """
+
+    def __init__(self, width, lsh_hasher=None, seed=0, hash_cache=None,
+                 key_type="str"):
+        VectorMinHashSignature.__init__(self, width, lsh_hasher=lsh_hasher,
+                                        kmin=1, seed=seed,
+                                        hash_cache=hash_cache,
+                                        key_type=key_type)
+
+    def create_hash_functions(self):
+        """Return coefficients for the uniform variate generators, as a
+        pair of arrays of shape (5, width, 1)
+        """
+        rng = random.Random(self.seed)
+        shape = (_ICWS_NUM_UNIFORMS, self.width, 1)
+        size = _ICWS_NUM_UNIFORMS * self.width
+        multipliers = [rng.getrandbits(64) | 1 for _ in xrange(size)]
+        increments = [rng.getrandbits(64) for _ in xrange(size)]
+        return (np.array(multipliers, dtype=np.uint64).reshape(shape),
+                np.array(increments, dtype=np.uint64).reshape(shape))
+
+    @staticmethod
+    def _get_pairs(vec):
+        """Aggregate input into lists of features and positive weights"""
+        items = vec.iteritems() \
+            if isinstance(vec, collections.Mapping) \
+            else vec
+        weights = collections.defaultdict(float)
+        for feature, weight in items:
+            weights[feature] += weight
+        pairs = [(feature, weight) for feature, weight in weights.iteritems()
+                 if weight > 0]
+        if not pairs:
+            # support empty sets by treating them as empty strings
+            pairs = [("", 1.0)]
+        return pairs
+
+    def _uniforms(self, base_hashes):
+        """Return uniform variates in (0, 1) of shape (5, width, N)"""
+        multipliers, increments = self.hashes
+        hashed = fmix64(multipliers * base_hashes + increments)
+        return ((hashed >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+
+    def _get_minhash_matrix(self, batch):
+        """Returns weighted minhash signatures from a batch of vectors
+
+        :returns: a matrix of shape (len(batch), width)
+        :rtype : numpy.ndarray
+        """
+        num_docs = len(batch)
+        matrix = np.empty((num_docs, self.width), dtype=np.uint64)
+        if num_docs == 0:
+            return matrix
+        all_pairs = map(self._get_pairs, batch)
+        lengths = np.fromiter(imap(len, all_pairs), dtype=np.intp,
+                              count=num_docs)
+        # five uniform variates are drawn per feature and hash function
+        for first, last in _feature_blocks(lengths, 5 * self.width):
+            matrix[first:last] = self._get_block_matrix(
+                all_pairs[first:last], lengths[first:last])
+        return matrix
+
+    def _get_block_matrix(self, all_pairs, lengths):
+        """Returns weighted minhash signatures of a block of documents
+        given their (feature, weight) pairs
+        """
+        starts = np.cumsum(lengths) - lengths
+        pairs = list(chain.from_iterable(all_pairs))
+        num_pairs = len(pairs)
+        base_hashes = np.fromiter(
+            self._hash_iter(feature for feature, _ in pairs),
+            dtype=np.uint64, count=num_pairs)
+        log_weights = np.log(np.fromiter(
+            (weight for _, weight in pairs), dtype=np.float64, count=num_pairs))
+
+        # r, c ~ Gamma(2, 1) and beta ~ Uniform(0, 1)
+        uniforms = self._uniforms(base_hashes)
+        log_uniforms = np.log(uniforms[:4])
+        r = -(log_uniforms[0] + log_uniforms[1])
+        log_c = np.log(-(log_uniforms[2] + log_uniforms[3]))
+        beta = uniforms[4]
+        t = np.floor(log_weights / r + beta)
+        log_y = r * (t - beta)
+        log_a = log_c - log_y - r
+
+        # pick the feature with smallest a per hash function and document
+        min_log_a = np.minimum.reduceat(log_a, starts, axis=1)
+        is_min = log_a == np.repeat(min_log_a, lengths, axis=1)
+        samples = fmix64(base_hashes ^ fmix64(
+            t.astype(np.int64).view(np.uint64) + _GOLDEN_GAMMA))
+        samples[~is_min] = np.iinfo(np.uint64).max
+        minima = np.minimum.reduceat(samples, starts, axis=1)
+        return np.ascontiguousarray(minima.T)
+
+    def _get_minhashes_kmin1(self, vec):
+        """Returns weighted minhash signature from a weighted vector
+        :returns: a signature vector
+        :rtype : list
+        """
+        return self._get_minhash_matrix([vec])[0].tolist()
+
+    _get_minhashes_kmin1p = _get_minhashes_kmin1
+
+    def _stream_update(self, state, base_hashes):
+        raise NotImplementedError(
+            "Weighted minhash signatures cannot be built from a hash stream")
+
+
+BBIT_SIZES = (1, 2, 4, 8, 16)
+
+
+def bbit_pack(minhashes, bits):
+    """Pack lowest b bits of each minhash into a compact buffer
+
+    Values narrower than a byte are packed least significant first, and
+    the last byte of a row is zero-padded.
+
+    :param minhashes: a minhash vector or a matrix with one vector per row
+    :type minhashes: numpy.ndarray
+    :param bits: number of bits to keep per minhash (1, 2, 4, 8 or 16)
+    :type bits: int
+    :returns: uint8 array with one packed signature per row
+    :rtype: numpy.ndarray
+
+    >>> bbit_pack(np.array([1, 2, 3, 5, 6], dtype=np.uint64), 2).tolist()
+    [121, 2]
+    """
+    if bits not in BBIT_SIZES:
+        raise ValueError("bits must be one of %s" % (BBIT_SIZES,))
+    minhashes = np.asarray(minhashes, dtype=np.uint64)
+    if bits == 16:
+        values = (minhashes & np.uint64(0xffff)).astype('<u2')
+        return values.view(np.uint8)
+    values = (minhashes & np.uint64((1 << bits) - 1)).astype(np.uint8)
+    if bits == 8:
+        return values
+    per_byte = 8 // bits
+    width = values.shape[-1]
+    padding = -width % per_byte
+    if padding:
+        pad_shape = values.shape[:-1] + (padding,)
+        values = np.concatenate(
+            (values, np.zeros(pad_shape, dtype=np.uint8)), axis=-1)
+    grouped = values.reshape(values.shape[:-1] + (-1, per_byte))
+    shifts = np.arange(0, 8, bits, dtype=np.uint8)
+    return np.bitwise_or.reduce(grouped << shifts, axis=-1).astype(np.uint8)
+
+
+def bbit_unpack(packed, bits, width):
+    """Inverse of bbit_pack
+
+    :param packed: uint8 array with one packed signature per row
+    :type packed: numpy.ndarray
+    :param bits: number of bits per minhash
+    :type bits: int
+    :param width: number of minhashes per signature
+    :type width: int
+    :returns: array of b-bit values
+    :rtype: numpy.ndarray
+
+    >>> bbit_unpack(np.array([121, 2], dtype=np.uint8), 2, 5).tolist()
+    [1, 2, 3, 1, 2]
+    """
+    if bits not in BBIT_SIZES:
+        raise ValueError("bits must be one of %s" % (BBIT_SIZES,))
+    packed = np.asarray(packed, dtype=np.uint8)
+    if bits == 16:
+        return np.ascontiguousarray(packed).view('<u2')
+    if bits == 8:
+        return packed
+    shifts = np.arange(0, 8, bits, dtype=np.uint8)
+    values = (packed[..., np.newaxis] >> shifts) & np.uint8((1 << bits) - 1)
+    values = values.reshape(values.shape[:-2] + (-1,))
+    return values[..., :width]
+
+
+def _bbit_collision_terms(r1, r2, bits):
+    """Return (C1, C2) correction terms of Li & Konig (2010)"""
+    span = 1 << bits
+
+    def collision_prob(ratio):
+        if ratio <= 0.0:
+            return 1.0 / span
+        return ratio * (1.0 - ratio) ** (span - 1) / \
+            (1.0 - (1.0 - ratio) ** span)
+
+    a1 = collision_prob(r1)
+    a2 = collision_prob(r2)
+    total = r1 + r2
+    if total <= 0.0:
+        return a1, a2
+    c1 = (a1 * r2 + a2 * r1) / total
+    c2 = (a1 * r1 + a2 * r2) / total
+    return c1, c2
+
+
+def bbit_jaccard(sig1, sig2, bits, r1=0.0, r2=0.0):
+    """Estimate Jaccard similarity from two b-bit minhash signatures
+
+    Matching b-bit values occur by chance with probability of about
+    ``2 ** -bits`` even for disjoint sets; the estimator corrects for that
+    following Li & Konig, "b-Bit Minwise Hashing" (2010).
+
+    :param sig1: unpacked b-bit signature
+    :type sig1: numpy.ndarray
+    :param sig2: unpacked b-bit signature
+    :type sig2: numpy.ndarray
+    :param bits: number of bits per minhash
+    :type bits: int
+    :param r1: ratio of first set size to universe size (zero if unknown)
+    :type r1: float
+    :param r2: ratio of second set size to universe size (zero if unknown)
+    :type r2: float
+    :returns: estimated Jaccard similarity
+    :rtype: float
+    """
+    sig1 = np.asarray(sig1)
+    sig2 = np.asarray(sig2)
+    if sig1.shape != sig2.shape:
+        raise ValueError("signatures must have the same shape")
+    matches = float(np.count_nonzero(sig1 == sig2)) / sig1.size
+    c1, c2 = _bbit_collision_terms(r1, r2, bits)
+    estimate = (matches - c1) / (1.0 - c2)
+    return min(1.0, max(0.0, estimate))
+
+
+class BBitMinHashSignature(VectorMinHashSignature):
+    """Obtain compact b-bit minhash signatures
+
+    Only the lowest ``bits`` bits of every minhash are kept and packed into
+    a byte buffer, shrinking stored signatures 4-64 times compared to
+    64-bit minhashes. Use :meth:`jaccard` to compare two packed signatures.
+    """
+
+    def __init__(self, width, bits=1, universe_size=None, kmin=1, seed=0,
+                 hash_cache=None):
+        """
+        :param bits: number of bits to keep per minhash (1, 2, 4, 8 or 16)
+        :type bits: int
+        """
+        if bits not in BBIT_SIZES:
+            raise ValueError("bits must be one of %s" % (BBIT_SIZES,))
+        self.bits = bits
+        VectorMinHashSignature.__init__(
+            self, width, universe_size=universe_size, kmin=kmin, seed=seed,
+            hash_cache=hash_cache)
+
+    def get_signature(self, vec, with_sketch=False):
+        """Returns packed b-bit minhash signature from a feature vector
+
+        :returns: a packed signature
+        :rtype : str
+        """
+        minhashes = self._get_minhashes(vec)
+        packed = bbit_pack(minhashes, self.bits).tobytes()
+        if with_sketch:
+            return packed, self._get_sketch(minhashes)
+        else:
+            return packed
+
+    def get_signatures(self, batch, with_sketch=False):
+        """Returns packed b-bit minhash signatures from a batch of feature
+        vectors
+
+        :returns: a uint8 matrix with one packed signature per row, or a
+                  tuple of the matrix and a vector of sketches
+        :rtype : numpy.ndarray, tuple
+        """
+        if with_sketch:
+            matrix, sketches = VectorMinHashSignature.get_signatures(
+                self, batch, with_sketch=True)
+            return bbit_pack(matrix, self.bits), sketches
+        else:
+            matrix = VectorMinHashSignature.get_signatures(self, batch)
+            return bbit_pack(matrix, self.bits)
+
+    def get_signature_stream(self, hash_chunks, with_sketch=False):
+        """Returns packed b-bit minhash signature from a stream of base
+        hash vectors
+
+        :returns: a packed signature
+        :rtype : str
+        """
+        minhashes = self._stream_minhashes(hash_chunks)
+        packed = bbit_pack(minhashes, self.bits).tobytes()
+        if with_sketch:
+            return packed, self._get_sketch(minhashes)
+        else:
+            return packed
+
+    def unpack(self, packed):
+        """Unpack a packed signature (or a matrix of them) into b-bit values
+        """
+        if isinstance(packed, basestring):
+            packed = np.frombuffer(packed, dtype=np.uint8)
+        return bbit_unpack(packed, self.bits, self.width * self.kmin)
+
+    def jaccard(self, sig1, sig2, size1=None, size2=None):
+        """Estimate Jaccard similarity between two packed signatures
+
+        When set sizes are given and universe_size is set, the estimator
+        also corrects for the sets being dense in the universe.
+
+        :rtype: float
+        """
+        r1 = r2 = 0.0
+        universe_size = self.universe_size
+        if universe_size is not None and size1 is not None and size2 is not None:
+            r1 = float(size1) / universe_size
+            r2 = float(size2) / universe_size
+        return bbit_jaccard(self.unpack(sig1), self.unpack(sig2),
+                            self.bits, r1=r1, r2=r2)
+
 
 def hash_combine(seed, val):
     """Combine seed with hash value
@@ -613,35 +2553,63 @@ def create_varlen_hash(scale=sys.maxint):
     return _hash_fun_long
 
 
+WIDE_HASH_SEED_STEP = 0x9e3779b97f4a7c15
+
+
+def create_wide_hash(bit_depth):
+    """Create a hash function of arbitrary output length
+
+    Output is a tuple of 64-bit CityHash values (least significant first),
+    one per 64-bit word, each computed with a different seed. The first
+    word uses the seed as is, so it is the same as the output of hash64.
+
+    :param bit_depth: number of bits the hash values should cover
+    :type bit_depth: int
+    :returns: a function of (item, seed) returning a tuple of words
+    :rtype: function
+    """
+    word_offsets = [(idx * WIDE_HASH_SEED_STEP) % (1 << 64)
+                    for idx in xrange((bit_depth + 63) // 64)]
+
+    def _hash_fun_wide(item, seed=0):
+        """Concatenated seeded 64-bit hashes"""
+        if type(item) == unicode:
+            item = item.encode("utf-8")
+        elif type(item) != str:
+            item = repr(item)
+        return tuple(CityHash64WithSeed(item, (seed + offset) % (1 << 64))
+                     for offset in word_offsets)
+    return _hash_fun_wide
+
+
 class SimHashSignature(Signature):
 
-    def __init__(self, bit_depth=64, seed=0):
+    def __init__(self, bit_depth=64, seed=0, hash_cache=None):
         """
         :param bit_depth: Length of binary vector (bit resolution)
         :type bit_depth: int
+        :param hash_cache: optional cache of 64-bit feature hashes (only
+                           used when bit_depth <= 64)
+        :type hash_cache: HashCache
         """
+        if hash_cache is not None and hash_cache.seed != seed:
+            raise ValueError("hash cache seed must match signer seed")
         self.bits = range(bit_depth)
         self.seed = seed
+        self.hash_cache = hash_cache
         if bit_depth <= 64:
-            self.hash_fun = self._hash_fun_64
+            self.hash_fun = self._hash_fun_64 \
+                if hash_cache is None \
+                else hash_cache
         elif bit_depth <= 128:
             self.hash_fun = self._hash_fun_128
         else:
-            self.hash_fun = create_varlen_hash(bit_depth)
+            self.hash_fun = create_wide_hash(bit_depth)
 
     def create_hash_functions(self):
         raise NotImplementedError
 
-    @staticmethod
-    def _hash_fun_64(item, seed=0):
-        type_of_x = type(item)
-        if type_of_x == str:
-            value = item
-        elif type_of_x == unicode:
-            value = item.encode("utf-8")
-        else:
-            value = repr(item)
-        return CityHash64WithSeed(value, seed)
+    _hash_fun_64 = staticmethod(hash64)
 
     @staticmethod
     def _hash_fun_128(item, seed=0):
@@ -655,6 +2623,25 @@ class SimHashSignature(Signature):
         part_a, part_b = CityHash128WithSeed(value, (seed, seed))
         return (1 << 64) * part_a + part_b
 
+    def _weighted_features(self, tokens, features=()):
+        """Returns hashed features and their raw weights
+
+        :returns: a tuple of two iterables
+        :rtype: tuple
+        """
+        hash_fun = self.hash_fun
+        seed = self.seed
+        token_weights = (log1p(sum(imap(len, token))) for token in tokens)
+        if features:
+            features, feature_weights = izip(*features)
+            fin_features = (hash_fun(feature, seed)
+                            for feature in chain(tokens, features))
+            fin_weights = chain(token_weights, feature_weights)
+        else:
+            fin_features = (hash_fun(feature, seed) for feature in tokens)
+            fin_weights = token_weights
+        return fin_features, fin_weights
+
     def get_signature(self, tokens, *features):
         """Returns weighted SimHash signature of a word vector
         and of (optional) feature vectors
@@ -669,18 +2656,150 @@ class SimHashSignature(Signature):
         :rtype: long
         :raises: OverflowError
         """
-        hash_fun = self.hash_fun
-        seed = self.seed
-        token_weights = (log1p(sum(imap(len, token))) for token in tokens)
-        if features:
-            features, feature_weights = izip(*features)
-            fin_features = (hash_fun(feature, seed)
-                            for feature in chain(tokens, features))
-            fin_weights = chain(token_weights, feature_weights)
-        else:
-            fin_features = (hash_fun(feature, seed) for feature in tokens)
-            fin_weights = token_weights
-        return self._sig_with_weights(fin_features, fin_weights)
+        return self._sig_with_weights(*self._weighted_features(tokens, features))
+
+    def get_signatures(self, batch, with_sketch=False):
+        """Returns SimHash signatures of a batch of token vectors
+
+        Features of all documents are accumulated in one operation.
+
+        :param batch: a sequence of token vectors
+        :type batch: collections.Sequence
+        :return: a matrix of 64-bit words (least significant first) with
+                 one row per signature
+        :rtype: numpy.ndarray
+        """
+        hashed_features = []
+        feature_weights = []
+        lengths = []
+        for tokens in batch:
+            doc_features, doc_weights = self._weighted_features(tokens)
+            doc_features = list(doc_features)
+            hashed_features.extend(doc_features)
+            feature_weights.extend(doc_weights)
+            lengths.append(len(doc_features))
+        words = self._feature_words(hashed_features)
+        weights = np.log1p(np.array(feature_weights, dtype=np.float64))
+        return self._accumulate(words, weights, lengths)
+
+    def _feature_words(self, hashed_features):
+        """Returns hashed features as a matrix of 64-bit words
+
+        :returns: a matrix of shape (N, ceil(bit_depth / 64))
+        :rtype: numpy.ndarray
+        """
+        bit_depth = len(self.bits)
+        if bit_depth <= 64:
+            mask = (1 << 64) - 1
+            words = np.fromiter((feature & mask for feature in hashed_features),
+                                dtype=np.uint64)
+            return words[:, np.newaxis]
+        num_words = (bit_depth + 63) // 64
+        mod_base = 1 << (64 * num_words)
+        # wide hashes (see create_wide_hash) are already split into words,
+        # but plain integer features (such as minhashes) can reach any branch
+        features = [feature if isinstance(feature, tuple)
+                    else long2words(feature % mod_base, num_words)
+                    for feature in hashed_features]
+        return np.array(features, dtype=np.uint64).reshape(-1, num_words)
+
+    def _accumulate(self, words, weights, lengths):
+        """Compute SimHash signatures over bit planes
+
+        Feature hashes are unpacked into a matrix with one column per bit,
+        each feature adds its weight to columns where its bit is set and
+        subtracts it elsewhere, and the column sums are thresholded at
+        zero. Rows are summed in feature order, same as in a loop.
+
+        :param words: matrix of feature hashes, one row per feature
+        :type words: numpy.ndarray
+        :param weights: vector of scaled feature weights
+        :type weights: numpy.ndarray
+        :param lengths: number of features in each document
+        :type lengths: collections.Sequence
+        :returns: a matrix of 64-bit words with one row per document
+        :rtype: numpy.ndarray
+        """
+        bit_depth = len(self.bits)
+        num_words = (bit_depth + 63) // 64
+        num_docs = len(lengths)
+        result = np.zeros((num_docs, num_words), dtype=np.uint64)
+        lengths = np.asarray(lengths, dtype=np.intp)
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return result
+
+        signed = self._signed_planes(words, weights)
+
+        # sum(axis=0) adds rows sequentially, so ties are resolved exactly
+        # as in a feature loop (unlike reduceat, which sums pairwise)
+        ends = np.cumsum(lengths)
+        set_bits = np.zeros((num_docs, bit_depth), dtype=bool)
+        for idx in np.flatnonzero(nonempty):
+            doc_signed = signed[ends[idx] - lengths[idx]:ends[idx]]
+            set_bits[idx] = doc_signed.sum(axis=0) > 0
+        result[:] = self._pack_planes(set_bits)
+        return result
+
+    def _signed_planes(self, words, weights):
+        """Returns a matrix of weights signed by feature bits
+
+        :returns: a matrix of shape (N, bit_depth)
+        :rtype: numpy.ndarray
+        """
+        bit_depth = len(self.bits)
+        # bit planes, little-endian within each byte
+        num_features = len(words)
+        as_bytes = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+        planes = np.unpackbits(as_bytes.reshape(num_features, -1, 1), axis=2)
+        planes = planes[:, :, ::-1].reshape(num_features, -1)[:, :bit_depth]
+        column_weights = weights[:, np.newaxis]
+        return np.where(planes, column_weights, -column_weights)
+
+    def _pack_planes(self, set_bits):
+        """Pack a boolean matrix of shape (M, bit_depth) into 64-bit words
+
+        :returns: a matrix of shape (M, ceil(bit_depth / 64))
+        :rtype: numpy.ndarray
+        """
+        num_rows, bit_depth = set_bits.shape
+        num_words = (bit_depth + 63) // 64
+        padded = np.zeros((num_rows, num_words * 64), dtype=np.uint64)
+        padded[:, :bit_depth] = set_bits
+        shifts = np.arange(64, dtype=np.uint64)
+        return (padded.reshape(num_rows, num_words, 64) << shifts).sum(axis=2)
+
+    def get_signature_stream(self, hash_chunks):
+        """Returns SimHash signature from a stream of feature hashes
+
+        Each chunk (such as one yielded by Shingler.iter_hashes) is either a
+        vector of 64-bit feature hashes, all with raw weight of 1.0, or a
+        tuple of a hash vector and a vector of raw weights. Only the running
+        sum of each bit plane is kept between chunks.
+
+        :param hash_chunks: an iterable of hash vectors or (hashes, weights)
+                            tuples
+        :type hash_chunks: collections.Iterable
+        :return: SimHash signature
+        :rtype: long
+        :raises: ValueError
+        """
+        bit_depth = len(self.bits)
+        if bit_depth > 64:
+            raise ValueError("Streaming SimHash requires bit_depth <= 64")
+        totals = np.zeros(bit_depth, dtype=np.float64)
+        for chunk in hash_chunks:
+            if isinstance(chunk, tuple):
+                hashes, raw_weights = chunk
+                weights = np.log1p(np.asarray(raw_weights, dtype=np.float64))
+            else:
+                hashes = chunk
+                weights = np.full(len(hashes), log1p(1.0), dtype=np.float64)
+            if len(hashes) == 0:
+                continue
+            words = np.asarray(hashes, dtype=np.uint64)[:, np.newaxis]
+            totals += self._signed_planes(words, weights).sum(axis=0)
+        return words2long(self._pack_planes(totals[np.newaxis, :] > 0)[0].tolist())
 
     def _sig_with_weights(self, hashed_features, feature_weights):
         """SimHash signature from a list of hashes and corresponding weights
@@ -691,33 +2810,12 @@ class SimHashSignature(Signature):
                                 meaning feature not considered)
         :type feature_weights: collections.Iterable
         """
-        bits = self.bits
-        bit_depth = len(bits)
-        mod_base = 1 << bit_depth
-        vec = [0] * bit_depth
-        for feature, weight in izip(hashed_features, feature_weights):
-            scaled_weight = log1p(weight)
-            mod_feature = feature % mod_base
-            for i in bits:
-                if mod_feature & (1 << i):
-                    vec[i] += scaled_weight
-                else:
-                    vec[i] -= scaled_weight
-        return sum(1 << i for i in bits if vec[i] > 0)
-
-
-class HashCombiner(object):
-
-    """use polynomial hashing to reduce a vector of hashes
-    """
-    def __init__(self, size, prime=31, mod=18446744073709551615L):
-        self._coeffs = [prime ** i for i in xrange(size)]
-        self._mod = mod
-
-    def combine(self, hashes):
-        # TODO: Cythonize this?
-        return sum(hsh * coeff for hsh, coeff in izip(hashes, self._coeffs)) \
-            % self._mod
+        words = self._feature_words(hashed_features)
+        weights = np.log1p(np.fromiter(feature_weights, dtype=np.float64))
+        num_features = min(len(words), len(weights))
+        result = self._accumulate(words[:num_features], weights[:num_features],
+                                  [num_features])
+        return words2long(result[0].tolist())
 
 
 class LSHC(object):
@@ -725,7 +2823,8 @@ class LSHC(object):
 
     Use a banding approach to hash similar signatures to the same buckets.
     """
-    def __init__(self, bandwidth, width, scheme="a1", seed=0):
+    def __init__(self, bandwidth, width, scheme="a1", seed=0, key_type="str",
+                 prime=31, cache_dir=None):
         """
         :param bandwidth: Band size
         :type bandwidth: int
@@ -735,28 +2834,74 @@ class LSHC(object):
                 When following number is zero, get non-overlapping bands.
                 When following number is equal to bandwidth, get all possible combinations
         :type scheme: str
+        :param seed: not used (bands and band hashes do not depend on it),
+                     kept for backward compatibility
+        :type seed: int
+        :param key_type: "str" for keys formatted as "band:hash", "int" for
+                         64-bit integer keys (see band_key), which take less
+                         memory and are faster to look up
+        :type key_type: str
+        :param prime: base of polynomial hashing of bands
+        :type prime: int
+        :param cache_dir: directory for caching generated bands
+        :type cache_dir: str
         """
-        self.selectors = create_sig_selectors(width, bandwidth, scheme)
-        self.combiner = HashCombiner(bandwidth)
+        if key_type not in KEY_TYPES:
+            raise ValueError("key_type must be one of %s" % (KEY_TYPES,))
+        indices, bands = create_sig_bands(width, bandwidth, scheme,
+                                          cache_dir=cache_dir)
+        self.bandwidth = bandwidth
+        self.key_type = key_type
+        self.band_indices = np.array(indices, dtype=np.int64)
+        self.bands = bands
+        self.coeffs = np.array([pow(prime, i, 1 << 64) for i in xrange(bandwidth)],
+                               dtype=np.uint64)
+        self._band_offsets = np.array(
+            [((idx + 1) * _BAND_KEY_STEP) % (1 << 64) for idx in indices],
+            dtype=np.uint64)
+
+    def band_hashes(self, matrix):
+        """Hash bands of a signature matrix
+
+        Band columns are gathered with one fancy-indexing operation and
+        combined with polynomial hashing in wrap-around uint64 arithmetic,
+        that is, modulo 2 ** 64 (earlier versions reduced modulo
+        2 ** 64 - 1, so keys differ from theirs).
+
+        :param matrix: signature matrix with one signature per row
+        :type matrix: numpy.ndarray
+        :return: a matrix of band hashes with one row per signature
+        :rtype: numpy.ndarray
+        """
+        matrix = np.asarray(matrix, dtype=np.uint64)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        return (matrix[:, self.bands] * self.coeffs).sum(axis=2, dtype=np.uint64)
+
+    def hash_matrix(self, matrix):
+        """Get LSH keys from a signature matrix
+
+        :param matrix: signature matrix with one signature per row
+        :type matrix: numpy.ndarray
+        :return: a list of lists of keys, one list per signature
+        :rtype: list
+        """
+        hashes = self.band_hashes(matrix)
+        if self.key_type == "int":
+            # same as band_key, which maps hashes to int range by an offset
+            keys = (hashes ^ self._band_offsets) ^ _INT64_OFFSET
+            return keys.view(np.int64).tolist()
+        indices = self.band_indices.tolist()
+        return [map(format_key, indices, row) for row in hashes.tolist()]
 
     def hash(self, sig):
         """Get combinatorial sketches from a signature
 
         :param sig: signature to process
         :type sig: collections.Iterable
-        :return: 64-bit hash digest
+        :return: LSH keys, one per band
         :rtype: collections.Iterable
-
-        Note: we use XOR-ing because it seems to be the fastest way to combine
-        hashes, but we could also use CityHash64 or even the poorly distributed
-        default hash function. For example, we could do this:
-
-        .. code-block:: python
-
-            lsh_sig = CityHash64(repr(band))
-
         """
-        list_sig = sig if isinstance(sig, list) else list(sig)
-        hash_combine = self.combiner.combine
-        for prefix, selector in self.selectors:
-            yield '{}:{}'.format(prefix, hash_combine(selector(list_sig)))
+        if not isinstance(sig, np.ndarray):
+            sig = np.fromiter(sig, dtype=np.uint64)
+        return iter(self.hash_matrix(sig)[0])
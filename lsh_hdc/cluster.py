@@ -1,14 +1,21 @@
 import operator
+import threading
+from array import array
+from bisect import bisect_left
 from functools import partial
-from pymaptools import UnionFind
+from multiprocessing import Pool, Process, Pipe
 from pymaptools.bitwise import hamming
-from itertools import imap
-from collections import defaultdict, Counter
+from itertools import imap, izip
+from collections import defaultdict, Counter, namedtuple
 from math import floor
+import numpy as np
 from lflearn.content import MessageSource
 from lflearn.preprocess import HTMLNormalizer, RegexTokenizer, URLNormalizer
 from lsh_hdc import Shingler, SimHashSignature, MinHashSketchSignature, \
-    MinHashSignature, LSHC
+    MinHashSignature, VectorMinHashSignature, LSHC, HashCache, words2long, \
+    FingerprintTable, fingerprint128
+from lsh_hdc.unionfind import UnionFind
+from lsh_hdc.utils import chunked
 from logging import getLogger
 
 LOG = getLogger(__name__)
@@ -18,6 +25,44 @@ OPERATOR_MAP = {
     'or': operator.__or__
 }
 
+SIGNER_MAP = {
+    'python': MinHashSignature,
+    'numpy': VectorMinHashSignature
+}
+
+# Takes place of LSH keys of a document whose content is an exact duplicate
+# of that of an earlier document (with label `original`)
+Duplicate = namedtuple("Duplicate", ["original"])
+
+# marks label IDs that are not in the compact index
+_NOT_INDEXED = object()
+
+# smallest number of matched posting list entries to count with NumPy
+_NUMPY_COUNT_MIN = 256
+
+
+def _count_ids(posting_lists, extra_ids):
+    """Count occurrences of label IDs in posting lists
+
+    :param posting_lists: arrays of label IDs
+    :type posting_lists: list
+    :param extra_ids: label IDs to count in addition
+    :type extra_ids: list
+    :returns: an iterable of (label ID, count) tuples
+    :rtype: collections.Iterable
+    """
+    total = sum(imap(len, posting_lists))
+    if total < _NUMPY_COUNT_MIN:
+        counter = Counter(extra_ids)
+        for posting_list in posting_lists:
+            counter.update(posting_list)
+        return counter.iteritems()
+    ids = np.concatenate([np.frombuffer(posting_list, dtype=np.int_)
+                          for posting_list in posting_lists] +
+                         [np.array(extra_ids, dtype=np.int_)])
+    unique_ids, counts = np.unique(ids, return_counts=True)
+    return izip(unique_ids.tolist(), counts.tolist())
+
 
 class Cluster(object):
     """Clusters sets with Jaccard similarity above threshold with high
@@ -27,18 +72,77 @@ class Cluster(object):
     1. Generate set signature
     2. Use LSH to map similar signatures to same buckets
     3. Use UnionFind to merge buckets containing same values
+
+    Buckets shared by very many items (from empty or boilerplate content)
+    make every insert O(bucket size). Keys listed in stop_keys are ignored
+    altogether, and buckets reaching max_bucket_size stop accepting items.
+    Items hitting a full bucket are either not compared to its members at
+    all (heavy_bucket_mode="cap") or only compared to one representative
+    member (heavy_bucket_mode="representative").
+
+    With min_support=1 and no sketch comparison, any one shared key is
+    enough to merge two items, and all items in a bucket are already in
+    one cluster. In this case buckets only store their first item, which
+    every later item in the bucket is united with, so adding an item is
+    O(number of keys) regardless of bucket sizes (and max_bucket_size has
+    no effect).
+
+    With compact_index=True, buckets are stored as arrays of label IDs
+    (same as in union_find) called posting lists, with sketches kept in
+    one list indexed by ID. Most buckets only ever hold one item, so a
+    bucket is stored as a bare label ID until a second item arrives. This
+    takes several times less memory than a dict per bucket and counts
+    matches over contiguous arrays.
     """
+
+    heavy_bucket_modes = ("cap", "representative")
+
     def __init__(self, signer=None, sketch_dist_fn=None, max_dist=0,
                  min_support=1, sketch_operator=operator.__and__,
-                 sketch_bits=0):
+                 sketch_bits=0, max_bucket_size=None, heavy_bucket_mode="cap",
+                 stop_keys=None, compact_index=False):
+        """
+        :param max_bucket_size: largest number of items in a bucket (no
+                                limit if None or 0)
+        :type max_bucket_size: int
+        :param heavy_bucket_mode: how to treat full buckets ("cap" or
+                                  "representative")
+        :type heavy_bucket_mode: str
+        :param stop_keys: LSH keys to ignore (see get_heavy_keys)
+        :type stop_keys: collections.Iterable
+        :param compact_index: store buckets as arrays of label IDs
+        :type compact_index: bool
+        """
+        if heavy_bucket_mode not in self.heavy_bucket_modes:
+            raise ValueError("Heavy bucket mode %s not supported"
+                             % heavy_bucket_mode)
         self.union_find = UnionFind()
         self.signer = signer
-        self.buckets = defaultdict(dict)
+        self.compact_index = compact_index
+        if compact_index:
+            # label IDs of single items, or posting lists
+            self.buckets = dict()
+            self.label_sketches = []
+        else:
+            self.buckets = defaultdict(dict)
         self.sketch_dist_fn = sketch_dist_fn
         self.sketch_bits = sketch_bits
         self.max_dist = max_dist
         self.min_support = min_support
         self.sketch_operator = sketch_operator
+        self.num_items = 0
+        self.num_duplicates = 0
+        self.max_bucket_size = max_bucket_size or None
+        self.heavy_bucket_mode = heavy_bucket_mode
+        self.stop_keys = frozenset(stop_keys or ())
+        # full buckets mapped to their representative members
+        self.capped_buckets = dict()
+        self.num_skipped_comparisons = 0
+        self.num_stopped_keys = 0
+        # first item of every bucket, used instead of buckets when no
+        # counting of matches is needed
+        self.representatives = dict()
+        self._fast_union = min_support <= 1 and sketch_dist_fn is None
 
     def _closeness_measure(self, sketch):
         min_support = self.min_support
@@ -61,19 +165,30 @@ class Cluster(object):
         # Add to union-find structure
         union_find = self.union_find
         union_find.__getitem__(label)
+        self.num_items += 1
 
         # Get signature vector and hash it
         keys = item \
             if self.signer is None \
             else self.signer.get_signature(item)
 
+        if self._fast_union:
+            self._union_representatives(keys, label)
+            return
+        if self.compact_index:
+            self._add_compact(keys, label, sketch)
+            return
+
         # Unite labels with same LSH keys
         counter = Counter()
         sketches = dict()
-        for bucket in imap(self.buckets.__getitem__, keys):
-            bucket[label] = sketch
-            counter.update(bucket.keys())
-            sketches.update(bucket)
+        if self.max_bucket_size is None and not self.stop_keys:
+            for bucket in imap(self.buckets.__getitem__, keys):
+                bucket[label] = sketch
+                counter.update(bucket.keys())
+                sketches.update(bucket)
+        else:
+            self._match_heavy(keys, label, sketch, counter, sketches)
 
         is_close = self._closeness_measure(sketch)
         for matched_label, support in counter.iteritems():
@@ -81,6 +196,152 @@ class Cluster(object):
                     is_close(support, sketches[matched_label]):
                 union_find.union(matched_label, label)
 
+    def _union_representatives(self, keys, label):
+        """Unite an item with first items of its buckets"""
+        stop_keys = self.stop_keys
+        if stop_keys:
+            num_keys = len(keys)
+            keys = [key for key in keys if key not in stop_keys]
+            self.num_stopped_keys += num_keys - len(keys)
+        union_find = self.union_find
+        get_representative = self.representatives.setdefault
+        for key in keys:
+            representative = get_representative(key, label)
+            if representative != label:
+                union_find.union(representative, label)
+
+    def _intern(self, label, sketch):
+        """Return ID of a label, storing its sketch"""
+        label_id = self.union_find.add(label)
+        label_sketches = self.label_sketches
+        if label_id >= len(label_sketches):
+            label_sketches.extend(
+                [_NOT_INDEXED] * (label_id + 1 - len(label_sketches)))
+        label_sketches[label_id] = sketch
+        return label_id
+
+    def _add_compact(self, keys, label, sketch):
+        """Same as the matching part of add_item, for compact index
+
+        Posting lists are kept sorted by label ID, so membership is found
+        by binary search. New labels usually have the largest ID and are
+        appended.
+        """
+        label_id = self._intern(label, sketch)
+        buckets = self.buckets
+        stop_keys = self.stop_keys
+        max_bucket_size = self.max_bucket_size or float('inf')
+        capped_buckets = self.capped_buckets
+        representative_only = self.heavy_bucket_mode == "representative"
+        matched = []
+        # matched label IDs not in posting lists (single items of buckets
+        # and representatives of full buckets)
+        extra_ids = []
+        for key in keys:
+            if key in stop_keys:
+                self.num_stopped_keys += 1
+                continue
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = label_id
+                continue
+            if not isinstance(bucket, array):
+                if bucket == label_id:
+                    continue
+                if max_bucket_size > 1:
+                    buckets[key] = array('l', sorted((bucket, label_id)))
+                    extra_ids.append(bucket)
+                    continue
+                bucket = array('l', (bucket,))
+            size = len(bucket)
+            pos = size \
+                if size == 0 or bucket[-1] < label_id \
+                else bisect_left(bucket, label_id)
+            is_member = pos < size and bucket[pos] == label_id
+            if size < max_bucket_size or is_member:
+                if not is_member:
+                    bucket.insert(pos, label_id)
+                matched.append(bucket)
+                continue
+            # full buckets no longer change, so their first ID is stable
+            representative = capped_buckets.setdefault(key, bucket[0])
+            if representative_only:
+                extra_ids.append(representative)
+                self.num_skipped_comparisons += len(bucket) - 1
+            else:
+                self.num_skipped_comparisons += len(bucket)
+
+        union_ids = self.union_find.union_ids
+        label_sketches = self.label_sketches
+        is_close = self._closeness_measure(sketch)
+        for matched_id, support in _count_ids(matched, extra_ids):
+            if matched_id != label_id and \
+                    is_close(support, label_sketches[matched_id]):
+                union_ids(matched_id, label_id)
+
+    def _match_heavy(self, keys, label, sketch, counter, sketches):
+        """Same as the bucket loop in add_item, but skipping stop keys and
+        treating full buckets according to heavy_bucket_mode
+        """
+        buckets = self.buckets
+        stop_keys = self.stop_keys
+        max_bucket_size = self.max_bucket_size or float('inf')
+        capped_buckets = self.capped_buckets
+        representative_only = self.heavy_bucket_mode == "representative"
+        for key in keys:
+            if key in stop_keys:
+                self.num_stopped_keys += 1
+                continue
+            bucket = buckets[key]
+            if len(bucket) < max_bucket_size or label in bucket:
+                bucket[label] = sketch
+                counter.update(bucket.keys())
+                sketches.update(bucket)
+                continue
+            representative = capped_buckets.get(key)
+            if representative is None:
+                representative = next(iter(bucket))
+                capped_buckets[key] = representative
+            if representative_only:
+                counter[representative] += 1
+                sketches[representative] = bucket[representative]
+                self.num_skipped_comparisons += len(bucket) - 1
+            else:
+                self.num_skipped_comparisons += len(bucket)
+
+    def get_heavy_keys(self, min_size):
+        """Return keys of buckets with at least min_size items
+
+        Keys of buckets that are large on a sample of data can be passed as
+        stop_keys when clustering the full data.
+
+        :rtype: list
+        """
+        if self._fast_union:
+            raise NotImplementedError(
+                "Bucket sizes are not kept when min_support=1 without sketches")
+        return [key for key, bucket in self.buckets.iteritems()
+                if (1 if isinstance(bucket, (int, long)) else len(bucket))
+                >= min_size]
+
+    def heavy_bucket_info(self):
+        """Return counts of capped buckets and of skipped work
+
+        :rtype: dict
+        """
+        return dict(capped_buckets=len(self.capped_buckets),
+                    skipped_comparisons=self.num_skipped_comparisons,
+                    stopped_keys=self.num_stopped_keys)
+
+    def add_duplicate(self, label, original):
+        """Add an exact duplicate of an already added item
+
+        The duplicate joins the cluster of the original without being
+        inserted into LSH buckets.
+        """
+        self.union_find.union(original, label)
+        self.num_duplicates += 1
+
     def add_key(self, key, label=None, sketch=None):
         """Add one LSH key only (with associated info)
         Cannot use min_support in this case (it is always equal to one)
@@ -106,17 +367,38 @@ class Cluster(object):
                 if is_close(matched_sketch):
                     union_find.union(matched_label, label)
 
+    def flush(self):
+        """Finish adding items passed to add_item (items are added right
+        away here, see ShardedCluster)
+        """
+        pass
+
     def get_clusters(self):
         """
-        :return: a list of sets representing clusters
+        :return: a list of sets representing clusters (only sets that
+                 changed since the last call are rebuilt)
         :rtype: list
         """
         return self.union_find.sets()
 
+    def get_cluster(self, label):
+        """
+        :return: labels in the cluster of a label
+        :rtype: list
+        """
+        return self.union_find.members(label)
+
+    def get_cluster_size(self, label):
+        """
+        :return: number of labels in the cluster of a label
+        :rtype: int
+        """
+        return self.union_find.set_size(label)
+
 
 class MinHashCluster(Cluster):
     def __init__(self, width=12, bandwidth=3, lsh_scheme="a0",
-                 universe_size=None, kmin=1, seed=0):
+                 universe_size=None, kmin=1, seed=0, key_type="str"):
         """
 
         :param width: Number of bands
@@ -128,18 +410,257 @@ class MinHashCluster(Cluster):
         :param universe_size: A prime number of size close to token universe
                               cardinality
         :type universe_size: long
+        :param key_type: Type of LSH keys ("str" or "int")
+        :type key_type: str
         """
-        lsh_hasher = LSHC(bandwidth, width=width, scheme=lsh_scheme) \
+        lsh_hasher = LSHC(bandwidth, width=width, scheme=lsh_scheme,
+                          key_type=key_type) \
             if bandwidth > 1 \
             else None
         signer = MinHashSignature(width,
                                   lsh_hasher=lsh_hasher,
                                   universe_size=universe_size,
                                   kmin=kmin,
-                                  seed=seed)
+                                  seed=seed,
+                                  key_type=key_type)
         super(MinHashCluster, self).__init__(signer=signer)
 
 
+def _run_shard(conn, count_matches):
+    """Serve a shard of ShardedCluster buckets
+
+    Receives batches of (item index, label, sketch, keys) tuples, where keys
+    are (position in the item signature, key) pairs, and replies to every
+    batch with a list of (item index, matched label, key position, matched
+    sketch, support) tuples. Support is the number of keys in this shard
+    shared by the two items, and the matched sketch is the one stored in
+    the bucket of the last such key (at the given position). Without
+    counting, only the first item of every bucket is kept and matched
+    (with support of one).
+    """
+    buckets = defaultdict(dict)
+    representatives = dict()
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        matches = []
+        if count_matches:
+            for idx, label, sketch, keys in batch:
+                counter = Counter()
+                sketches = dict()
+                for pos, key in keys:
+                    bucket = buckets[key]
+                    bucket[label] = sketch
+                    counter.update(bucket.keys())
+                    for matched_label, matched_sketch in bucket.iteritems():
+                        sketches[matched_label] = (pos, matched_sketch)
+                for matched_label, support in counter.iteritems():
+                    if matched_label != label:
+                        pos, matched_sketch = sketches[matched_label]
+                        matches.append((idx, matched_label, pos,
+                                        matched_sketch, support))
+        else:
+            get_representative = representatives.setdefault
+            for idx, label, _, keys in batch:
+                for pos, key in keys:
+                    representative = get_representative(key, label)
+                    if representative != label:
+                        matches.append((idx, representative, pos, None, 1))
+        conn.send(matches)
+    conn.close()
+
+
+class ShardedCluster(Cluster):
+    """Same as Cluster, but with LSH buckets partitioned by key hash
+    across worker processes
+
+    Items are sent to shards in batches of batch_size, every shard getting
+    the keys it owns. Shards add the items to their buckets and reply with
+    candidate merge edges, which are applied to the global union_find here.
+    Supports of an edge found by different shards are summed before
+    comparing them to min_support. When a label was added more than once
+    with different sketches, the sketch compared is taken from the bucket
+    of the last key the two items share, as Cluster does, so the clusters
+    are the same as those built by Cluster with the same options.
+
+    Shard processes are started on first use and stopped by close (or on
+    leaving a with block).
+
+    >>> with ShardedCluster(num_shards=2) as cluster:
+    ...     cluster.add_item([1, 2], label="a")
+    ...     cluster.add_item([3, 2], label="b")
+    ...     cluster.add_item([4, 5], label="c")
+    ...     sorted(map(sorted, cluster.get_clusters()))
+    [['a', 'b'], ['c']]
+    """
+
+    def __init__(self, num_shards=2, batch_size=1000, signer=None,
+                 sketch_dist_fn=None, max_dist=0, min_support=1,
+                 sketch_operator=operator.__and__, sketch_bits=0,
+                 stop_keys=None):
+        """
+        :param num_shards: number of shard processes
+        :type num_shards: int
+        :param batch_size: number of items to send to shards at once
+        :type batch_size: int
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards must be positive")
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        super(ShardedCluster, self).__init__(
+            signer=signer, sketch_dist_fn=sketch_dist_fn, max_dist=max_dist,
+            min_support=min_support, sketch_operator=sketch_operator,
+            sketch_bits=sketch_bits, stop_keys=stop_keys)
+        self.num_shards = num_shards
+        self.batch_size = batch_size
+        self._pending = []
+        self._shards = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start_shards(self):
+        shards = []
+        for _ in xrange(self.num_shards):
+            conn, shard_conn = Pipe()
+            process = Process(target=_run_shard,
+                              args=(shard_conn, not self._fast_union))
+            process.daemon = True
+            process.start()
+            shard_conn.close()
+            shards.append((process, conn))
+        self._shards = shards
+
+    def close(self):
+        """Add pending items and stop shard processes
+
+        Buckets are lost with the shards, so no items can be added after
+        this (clusters can still be read).
+        """
+        if self._shards is None:
+            return
+        self.flush()
+        for process, conn in self._shards:
+            conn.send(None)
+            conn.close()
+            process.join()
+        self._shards = None
+
+    def add_item(self, item, label=None, sketch=None):
+        # Set default label for this set
+        if label is None:
+            label = item
+
+        # Add to union-find structure
+        self.union_find.__getitem__(label)
+        self.num_items += 1
+
+        # Get signature vector and hash it
+        keys = item \
+            if self.signer is None \
+            else self.signer.get_signature(item)
+
+        stop_keys = self.stop_keys
+        if stop_keys:
+            num_keys = len(keys)
+            keys = [key for key in keys if key not in stop_keys]
+            self.num_stopped_keys += num_keys - len(keys)
+
+        self._pending.append((label, sketch, keys))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_key(self, key, label=None, sketch=None):
+        raise NotImplementedError("Adding single keys is not supported "
+                                  "by ShardedCluster")
+
+    def get_heavy_keys(self, min_size):
+        raise NotImplementedError("Buckets are kept by shard processes")
+
+    def flush(self):
+        """Send pending items to shards and apply the edges found"""
+        batch = self._pending
+        if not batch:
+            return
+        self._pending = []
+        if self._shards is None:
+            self._start_shards()
+        num_shards = self.num_shards
+        shard_batches = [[] for _ in xrange(num_shards)]
+        for idx, (label, sketch, keys) in enumerate(batch):
+            shard_keys = defaultdict(list)
+            for pos, key in enumerate(keys):
+                shard_keys[hash(key) % num_shards].append((pos, key))
+            for shard, keys in shard_keys.iteritems():
+                shard_batches[shard].append((idx, label, sketch, keys))
+
+        # all shards work on the batch at once
+        for (_, conn), shard_batch in izip(self._shards, shard_batches):
+            conn.send(shard_batch)
+        union = self.union_find.union
+        if self._fast_union:
+            for _, conn in self._shards:
+                for idx, matched_label, _, _, _ in conn.recv():
+                    union(matched_label, batch[idx][0])
+            return
+
+        # sum supports of the same match found by different shards, keeping
+        # the sketch found under the last shared key
+        edges = dict()
+        for _, conn in self._shards:
+            for idx, matched_label, pos, matched_sketch, support \
+                    in conn.recv():
+                edge = edges.get((idx, matched_label))
+                if edge is None:
+                    edges[idx, matched_label] = \
+                        [support, pos, matched_sketch]
+                else:
+                    edge[0] += support
+                    if pos > edge[1]:
+                        edge[1] = pos
+                        edge[2] = matched_sketch
+        closeness_measures = dict()
+        for (idx, matched_label), (support, _, matched_sketch) \
+                in edges.iteritems():
+            label, sketch, _ = batch[idx]
+            is_close = closeness_measures.get(idx)
+            if is_close is None:
+                is_close = self._closeness_measure(sketch)
+                closeness_measures[idx] = is_close
+            if is_close(support, matched_sketch):
+                union(matched_label, label)
+
+    def get_clusters(self):
+        """
+        :return: a list of sets representing clusters (only sets that
+                 changed since the last call are rebuilt)
+        :rtype: list
+        """
+        self.flush()
+        return self.union_find.sets()
+
+    def get_cluster(self, label):
+        """
+        :return: labels in the cluster of a label
+        :rtype: list
+        """
+        self.flush()
+        return self.union_find.members(label)
+
+    def get_cluster_size(self, label):
+        """
+        :return: number of labels in the cluster of a label
+        :rtype: int
+        """
+        self.flush()
+        return self.union_find.set_size(label)
+
+
 class SketchModel(object):
     """A pseudo-enum of supported models"""
     simhash = 0
@@ -163,11 +684,27 @@ def get_default_shingler(**opts):
     return shingler
 
 
+# HDClustering instance used by pool workers (inherited on fork)
+_WORKER_CLUSTERING = None
+
+
+def _init_worker(clustering):
+    global _WORKER_CLUSTERING
+    _WORKER_CLUSTERING = clustering
+
+
+def _map_chunk_worker(chunk):
+    """Sign a chunk of (obj, body, label, prefix) tuples in a pool worker"""
+    return _WORKER_CLUSTERING._sign_chunk(chunk)
+
+
 class HDClustering(object):
 
     def __init__(self, cfg, content_filter=None, trace_every=0,
                  get_body=None, get_label=None, get_prefix=None, min_support=None,
-                 seed=0, normalizer=None, tokenizer=None):
+                 seed=0, normalizer=None, tokenizer=None, chunk_size=None,
+                 num_workers=None, max_in_flight=None, ordered=None,
+                 fingerprint_table_size=None, stop_keys=None, num_shards=None):
 
         """Read configuration"""
         self.cfg = cfg
@@ -177,6 +714,31 @@ class HDClustering(object):
 
         self.trace_every = trace_every
 
+        # Number of documents to sign at once
+        self.chunk_size = cfg.get('chunk_size', 1) \
+            if chunk_size is None else chunk_size
+
+        # Number of worker processes to sign chunks in (0 to sign in the
+        # calling process), the most chunks being signed at a time (0 for
+        # twice the number of workers), and whether to add signed documents
+        # in input order
+        self.num_workers = cfg.get('num_workers', 0) \
+            if num_workers is None else num_workers
+        self.max_in_flight = cfg.get('max_in_flight', 0) \
+            if max_in_flight is None else max_in_flight
+        if self.max_in_flight <= 0:
+            self.max_in_flight = 2 * self.num_workers
+        self.ordered = cfg.get('ordered', True) \
+            if ordered is None else ordered
+
+        # Table of content fingerprints used to skip signing of exact
+        # duplicates (0 to disable). Workers keep separate tables, so
+        # duplicates signed by different workers are only found by LSH.
+        if fingerprint_table_size is None:
+            fingerprint_table_size = cfg.get('fingerprint_table_size', 0)
+        self.fingerprints = FingerprintTable(fingerprint_table_size) \
+            if fingerprint_table_size > 0 else None
+
         # Set options
         self.content_filter = content_filter
         self.min_support = cfg['min_support'] if min_support is None else min_support
@@ -190,9 +752,25 @@ class HDClustering(object):
         # Configure minhash signer
         sig_width = cfg['sig_width']
         lsh_hasher = LSHC(width=sig_width, **cfg['lsh_options'])
-        self.signer = MinHashSignature(sig_width,
-                                       lsh_hasher=lsh_hasher,
-                                       kmin=cfg['kmin'])
+        signer_name = cfg.get('sig_engine', 'python')
+        try:
+            signer_class = SIGNER_MAP[signer_name]
+        except KeyError:
+            raise RuntimeError("Unknown signature engine specified: '%s'"
+                               % signer_name)
+
+        # Configure shared cache of shingle hashes
+        self.hash_cache_size = cfg.get('hash_cache_size', 0)
+        self._hash_caches = dict()
+        signer_opts = dict()
+        if self.hash_cache_size > 0:
+            if signer_class is MinHashSignature:
+                raise RuntimeError("Hash cache requires the numpy signature engine")
+            signer_opts['hash_cache'] = self.get_hash_cache()
+        self.signer = signer_class(sig_width,
+                                   lsh_hasher=lsh_hasher,
+                                   kmin=cfg['kmin'],
+                                   **signer_opts)
 
         # Configure shingler
         cfg_key_shingle = cfg['shingler']
@@ -203,6 +781,7 @@ class HDClustering(object):
         self.sketch_enabled = cfg_sketch['enabled']
         self.sketch_dist_fn = None
         self.max_dist = None
+        self.sketch_operator = OPERATOR_MAP['and']
         if self.sketch_enabled:
             algorithm_name = cfg_sketch['algorithm']
             try:
@@ -220,7 +799,8 @@ class HDClustering(object):
             elif sketch_algorithm == SketchModel.simhash:
                 del cfg_sketch_shingler['enabled']
                 self.sketch_shingler = Shingler(**cfg_sketch_shingler)
-                self.sketch_signer = SimHashSignature(self.sketch_bits, seed=seed)
+                self.sketch_signer = SimHashSignature(
+                    self.sketch_bits, seed=seed, hash_cache=self.get_hash_cache(seed))
             elif sketch_algorithm == SketchModel.minhash:
                 del cfg_sketch_shingler['enabled']
                 self.sketch_shingler = Shingler(**cfg_sketch_shingler)
@@ -234,29 +814,139 @@ class HDClustering(object):
                           (1.0 - float(cfg_sketch['resemblance']))))
             self.sketch_dist_fn = hamming
             self.sketch_operator = OPERATOR_MAP[cfg_sketch.get('operator', 'and')]
-        self.cluster_builder = Cluster(sketch_dist_fn=self.sketch_dist_fn,
-                                       max_dist=self.max_dist,
-                                       min_support=self.min_support,
-                                       sketch_operator=self.sketch_operator)
 
-    def _map_iter(self, data):
-        """Find clusters in an iterable"""
+        # Number of processes to partition LSH buckets across (0 to keep
+        # all buckets in the calling process)
+        self.num_shards = cfg.get('num_shards', 0) \
+            if num_shards is None else num_shards
+        if self.num_shards > 0:
+            if cfg.get('max_bucket_size', 0) or cfg.get('compact_index', False):
+                raise RuntimeError("Sharded clustering does not support "
+                                   "max_bucket_size or compact_index")
+            self.cluster_builder = ShardedCluster(num_shards=self.num_shards,
+                                                  sketch_dist_fn=self.sketch_dist_fn,
+                                                  max_dist=self.max_dist,
+                                                  min_support=self.min_support,
+                                                  sketch_operator=self.sketch_operator,
+                                                  stop_keys=stop_keys)
+        else:
+            self.cluster_builder = Cluster(sketch_dist_fn=self.sketch_dist_fn,
+                                           max_dist=self.max_dist,
+                                           min_support=self.min_support,
+                                           sketch_operator=self.sketch_operator,
+                                           max_bucket_size=cfg.get('max_bucket_size', 0),
+                                           heavy_bucket_mode=cfg.get('heavy_bucket_mode', 'cap'),
+                                           stop_keys=stop_keys,
+                                           compact_index=cfg.get('compact_index', False))
+
+    def get_hash_cache(self, seed=0):
+        """Return hash cache shared by signers with the given seed
+
+        :returns: a HashCache instance or None if caching is disabled
+        :rtype: HashCache
+        """
+        if self.hash_cache_size <= 0:
+            return None
+        hash_cache = self._hash_caches.get(seed)
+        if hash_cache is None:
+            hash_cache = HashCache(self.hash_cache_size, seed=seed)
+            self._hash_caches[seed] = hash_cache
+        return hash_cache
+
+    def fingerprint_info(self):
+        """Return counts of exact duplicates and the work skipped for them
+
+        :rtype: dict
+        """
+        cluster_builder = self.cluster_builder
+        num_duplicates = cluster_builder.num_duplicates
+        total = cluster_builder.num_items + num_duplicates
+        lsh_hasher = self.signer.lsh_hasher
+        num_keys = 1 if lsh_hasher is None else len(lsh_hasher.bands)
+        info = dict(documents=total,
+                    duplicates=num_duplicates,
+                    duplicate_rate=float(num_duplicates) / total if total else 0.0,
+                    bucket_inserts_skipped=num_duplicates * num_keys)
+        if self.fingerprints is not None and self.num_workers <= 0:
+            # pool workers use their own copies of the table
+            info['table'] = self.fingerprints.info()
+        return info
+
+    def hash_cache_info(self):
+        """Return statistics of hash caches keyed by seed
+
+        :rtype: dict
+        """
+        return {seed: hash_cache.info()
+                for seed, hash_cache in self._hash_caches.iteritems()}
 
+    def _unpack(self, i, obj):
+        """Return (obj, body, label, prefix) tuple of i-th object"""
         get_body = self._get_body
         get_label = self._get_label
         get_prefix = self._get_prefix
+        body = obj if get_body is None else get_body(obj)
+        label = i if get_label is None else get_label(obj)
+        prefix = None if get_prefix is None else get_prefix(obj)
+        return obj, body, label, prefix
 
-        for i, obj in enumerate(data):
-            body = obj if get_body is None else get_body(obj)
-            label = i if get_label is None else get_label(obj)
-            prefix = None if get_prefix is None else get_prefix(obj)
+    def _iter_chunks(self, data):
+        """Split an iterable into lists of (obj, body, label, prefix) tuples"""
+        unpack = self._unpack
+        for chunk in chunked(enumerate(data), self.chunk_size):
+            yield [unpack(i, obj) for i, obj in chunk]
 
-            for feat in self._map_item(obj, body, label, prefix):
+    def _map_iter(self, data):
+        """Find clusters in an iterable"""
+        for chunk in self._iter_chunks(data):
+            for feat in self._map_chunk(chunk):
                 yield feat
 
-    def _map_item(self, obj, body, label, prefix=None):
+    def _parallel_map_iter(self, data):
+        """Find clusters in an iterable using a pool of worker processes
+
+        Chunks are signed by workers (see _map_chunk_worker) while the
+        calling process only adds signed documents to clusters. Workers get
+        a copy of this object when they are forked, so labels, bodies and
+        prefixes are extracted before chunks are sent out. At most
+        max_in_flight chunks are read ahead of the consumer.
+        """
+
+        # the pool reads chunks in a separate thread, which blocks here
+        # until the consumer has taken enough results
+        slots = threading.Semaphore(self.max_in_flight)
+        stopped = threading.Event()
+
+        def iter_chunks():
+            for chunk in self._iter_chunks(data):
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                yield chunk
+
+        pool = Pool(self.num_workers, initializer=_init_worker,
+                    initargs=(self,))
+        finished = False
+        try:
+            pool_map = pool.imap if self.ordered else pool.imap_unordered
+            for batch in pool_map(_map_chunk_worker, iter_chunks()):
+                slots.release()
+                for _, keys, label, sketch in batch:
+                    yield keys, (label, sketch)
+            finished = True
+        finally:
+            if finished:
+                pool.close()
+            else:
+                # unblock the chunk reader and stop workers
+                stopped.set()
+                slots.release()
+                pool.terminate()
+            pool.join()
+
+    def _get_tokens(self, obj):
+        """Return content tokens, or None if the content filter rejects obj"""
 
-        # Extract features
         src = MessageSource.source(obj)
         obj_content = obj['content']
         normalized_content, meta = self.normalizer.normalize(obj_content)
@@ -267,25 +957,97 @@ class HDClustering(object):
                 obj, content_tokens=content_tokens, urls=meta.get('url_components', []), src=src)
         else:
             rule_accept = False
-        if not rule_accept:
-            features = self.shingler.get_shingles(content_tokens, prefix=prefix)
-            if self.sketch_enabled and (self.sketch_shingler is None or self.sketch_signer is None):
-                keys, sketch = self.signer.get_signature(features, with_sketch=True)
-            elif self.sketch_enabled and (self.sketch_shingler is not None and self.sketch_signer is not None):
-                keys = self.signer.get_signature(features)
-                sketch_features = self.sketch_shingler.get_shingles(content_tokens)
-                sketch = self.sketch_signer.get_signature(sketch_features)
+        return None if rule_accept else content_tokens
+
+    def _map_item(self, obj, body, label, prefix=None):
+        return self._map_chunk([(obj, body, label, prefix)])
+
+    def _map_chunk(self, chunk, dedupe=True):
+        """Sign a chunk of (obj, body, label, prefix) tuples at once
+
+        If fingerprint table is enabled and dedupe is set, exact duplicates
+        of earlier documents are not signed and have a Duplicate in place
+        of their keys (and None for sketch).
+
+        :returns: a generator of (keys, (label, sketch)) tuples
+        :rtype: collections.Iterable
+        """
+        for _, keys, label, sketch in self._iter_signed(chunk, dedupe=dedupe):
+            yield keys, (label, sketch)
+
+    def _iter_signed(self, chunk, dedupe=True):
+        """Same as _map_chunk, but yields (position in chunk, keys, label,
+        sketch) tuples, so that results can be matched to inputs even when
+        labels repeat
+        """
+
+        # Extract features
+        labels = []
+        features = []
+        sketch_features = []
+        # positions and labels of accepted documents with labels of their
+        # originals (None for documents to be signed)
+        accepted = []
+        fingerprints = self.fingerprints if dedupe else None
+        use_sketch_signer = self.sketch_enabled and \
+            (self.sketch_shingler is not None and self.sketch_signer is not None)
+        for idx, (obj, body, label, prefix) in enumerate(chunk):
+            content_tokens = self._get_tokens(obj)
+            if content_tokens is None:
+                continue
+            if fingerprints is not None:
+                original = fingerprints.setdefault(
+                    fingerprint128(content_tokens, prefix), label)
+                if original != label:
+                    accepted.append((idx, label, original))
+                    continue
+            accepted.append((idx, label, None))
+            labels.append(label)
+            features.append(self.shingler.get_shingles(content_tokens, prefix=prefix))
+            if use_sketch_signer:
+                sketch_features.append(self.sketch_shingler.get_shingles(content_tokens))
+        if not labels:
+            for idx, label, original in accepted:
+                yield idx, Duplicate(original), label, None
+            return
+
+        # Sign all accepted documents
+        signer = self.signer
+        if self.sketch_enabled and not use_sketch_signer:
+            minhashes, sketches = signer.get_signatures(features, with_sketch=True)
+            sketches = sketches.tolist()
+        elif use_sketch_signer:
+            minhashes = signer.get_signatures(features)
+            sketches = map(words2long, self.sketch_signer
+                           .get_signatures(sketch_features).tolist())
+        else:
+            minhashes = signer.get_signatures(features)
+            sketches = [None] * len(labels)
+        signed = izip(labels, signer.get_batch_keys(minhashes), sketches)
+        for idx, label, original in accepted:
+            if original is None:
+                label, keys, sketch = next(signed)
+                yield idx, keys, label, sketch
             else:
-                keys = self.signer.get_signature(features)
-                sketch = None
-            yield (keys, (label, sketch))
+                yield idx, Duplicate(original), label, None
+
+    def _sign_chunk(self, chunk):
+        """Same as _map_chunk, but returns a compact list
+
+        :returns: a list of (position in chunk, keys, label, sketch) tuples
+        :rtype: list
+        """
+        return list(self._iter_signed(chunk))
 
     def clusters_from_iter(self, data):
         """Find clusters in an iterable"""
 
         cluster_builder = self.cluster_builder
         trace_every = self.trace_every
-        for i, obj in enumerate(self._map_iter(data)):
+        features = self._parallel_map_iter(data) \
+            if self.num_workers > 0 \
+            else self._map_iter(data)
+        for i, obj in enumerate(features):
             if trace_every > 0 and (not i % trace_every):
                 LOG.info("Processing line " + str(i))
 
@@ -293,21 +1055,31 @@ class HDClustering(object):
             label, sketch = val \
                 if isinstance(val, tuple) \
                 else (val, None)
-            cluster_builder.add_item(keys, label=label, sketch=sketch)
+            if isinstance(keys, Duplicate):
+                cluster_builder.add_duplicate(label, keys.original)
+            else:
+                cluster_builder.add_item(keys, label=label, sketch=sketch)
 
         return cluster_builder.get_clusters()
 
     def mapper(self, obj):
         """Perform a mapper task in MR"""
+        return self.mapper_chunk([obj])
+
+    def mapper_chunk(self, objs):
+        """Perform a mapper task in MR on a chunk of objects at once"""
         get_body = self._get_body
         get_label = self._get_label
         get_prefix = self._get_prefix
 
-        body = obj if get_body is None else get_body(obj)
-        label = obj if get_label is None else get_label(obj)
-        prefix = None if get_prefix is None else get_prefix(obj)
+        chunk = []
+        for obj in objs:
+            body = obj if get_body is None else get_body(obj)
+            label = obj if get_label is None else get_label(obj)
+            prefix = None if get_prefix is None else get_prefix(obj)
+            chunk.append((obj, body, label, prefix))
 
-        for keys, val in self._map_item(obj, body, label, prefix):
+        for keys, val in self._map_chunk(chunk, dedupe=False):
             for key in keys:
                 yield key, val
 
@@ -0,0 +1,240 @@
+"""
+Cost-aware selection of LSH parameters
+
+The probability that two signatures share at least one LSH key, as a
+function of Jaccard similarity of the underlying sets, is an S-shaped curve
+determined by signature width, band size and banding scheme. Integrating
+this curve below a target threshold gives the expected rate of false
+positives, and integrating its complement above the threshold gives the
+rate of false negatives. Every band adds a bucket insert and a counter
+update per document in Cluster.add_item, so among parameter sets that meet
+a quality target we pick the one with the fewest (weighted) bands.
+"""
+
+import random
+import time
+from collections import namedtuple
+from itertools import product
+from logging import getLogger
+import numpy as np
+from lsh_hdc import create_sig_bands, band_key, format_key
+
+LOG = getLogger(__name__)
+
+
+LSHParams = namedtuple("LSHParams", ["width", "bandwidth", "scheme", "kmin",
+                                     "num_bands", "cost", "error",
+                                     "false_positives", "false_negatives"])
+
+
+def collision_curve(width, bandwidth, scheme, similarities, num_samples=2000,
+                    seed=0):
+    """Probability of a band match as a function of Jaccard similarity
+
+    Each signature element is assumed to match with probability equal to
+    Jaccard similarity, independently of other elements. For the "a0" scheme
+    (non-overlapping bands) the curve is 1 - (1 - s ** r) ** b. Overlapping
+    schemes are estimated from random draws shared across the similarity
+    grid: a band matches at similarity s when all of its uniform variates
+    are below s, so a sample has a match once s exceeds the minimum over
+    bands of the maximum variate in a band.
+
+    >>> curve = collision_curve(12, 3, "a0", [0.0, 1.0])
+    >>> curve.tolist()
+    [0.0, 1.0]
+
+    :param width: signature length
+    :type width: int
+    :param bandwidth: rows per band
+    :type bandwidth: int
+    :param scheme: LSH banding scheme
+    :type scheme: str
+    :param similarities: Jaccard similarities to evaluate the curve at
+    :type similarities: collections.Iterable
+    :param num_samples: number of random draws for overlapping schemes
+    :type num_samples: int
+    :param seed: random seed for overlapping schemes
+    :type seed: int
+    :returns: probability of at least one band match at every similarity
+    :rtype: numpy.ndarray
+    """
+    similarities = np.asarray(similarities, dtype=np.float64)
+    if scheme == "a0":
+        num_bands = width // bandwidth
+        return 1.0 - (1.0 - similarities ** bandwidth) ** num_bands
+    _, bands = create_sig_bands(width, bandwidth, scheme)
+    uniforms = np.random.RandomState(seed).random_sample((num_samples, width))
+    first_match = np.empty(num_samples, dtype=np.float64)
+    # limit the size of gathered (samples, bands, bandwidth) blocks
+    step = max(1, (1 << 22) // max(1, bands.size))
+    for start in xrange(0, num_samples, step):
+        block = uniforms[start:start + step][:, bands]
+        first_match[start:start + step] = block.max(axis=2).min(axis=1)
+    first_match.sort()
+    return np.searchsorted(first_match, similarities, side="right") \
+        / float(num_samples)
+
+
+def error_rates(width, bandwidth, scheme, threshold, num_points=101, **kwargs):
+    """Average false positive and false negative rates around a threshold
+
+    False positive rate is the mean collision probability of pairs with
+    similarity below the threshold and false negative rate is the mean
+    probability of no collision above it, assuming uniformly distributed
+    similarities.
+
+    :param threshold: target Jaccard similarity
+    :type threshold: float
+    :param num_points: number of grid points on either side of threshold
+    :type num_points: int
+    :returns: a tuple of false positive and false negative rates
+    :rtype: tuple
+    """
+    if not 0.0 < threshold < 1.0:
+        raise ValueError("threshold must be between zero and one")
+    lower = np.linspace(0.0, threshold, num_points)
+    upper = np.linspace(threshold, 1.0, num_points)
+    curve = collision_curve(width, bandwidth, scheme,
+                            np.concatenate([lower, upper]), **kwargs)
+    false_positives = np.trapz(curve[:num_points], lower) / threshold
+    false_negatives = np.trapz(1.0 - curve[num_points:], upper) \
+        / (1.0 - threshold)
+    return false_positives, false_negatives
+
+
+def count_bands(width, bandwidth, scheme):
+    """Number of bands (LSH keys per document) of a scheme
+
+    >>> count_bands(12, 3, "a0")
+    4
+
+    :rtype: int
+    """
+    _, bands = create_sig_bands(width, bandwidth, scheme)
+    return len(bands)
+
+
+def measure_band_cost(num_docs=2000, num_bands=20, key_type="str", seed=0,
+                      min_support=2, sketch_dist_fn=None, max_dist=0,
+                      sketch_bits=64):
+    """Measure the time Cluster.add_item spends per band per document
+
+    The Cluster is built with the given min_support and sketch settings, so
+    that the measurement reflects the matching path used when clustering.
+    With the default min_support=2, and whenever a sketch distance is given,
+    this includes bucket inserts and counter updates. With min_support=1
+    and no sketches, Cluster only unites each document with the first
+    document of each bucket, which is much cheaper. Keys are drawn at
+    random, so the measurement does not include unions of matching labels.
+
+    :param num_docs: number of documents to add
+    :type num_docs: int
+    :param num_bands: number of LSH keys per document
+    :type num_bands: int
+    :param key_type: type of LSH keys ("str" or "int")
+    :type key_type: str
+    :param min_support: smallest number of shared keys to merge documents
+    :type min_support: int
+    :param sketch_dist_fn: distance between sketches (no sketches if None)
+    :type sketch_dist_fn: function
+    :param max_dist: largest sketch distance to merge documents
+    :type max_dist: int
+    :param sketch_bits: number of bits in random sketches
+    :type sketch_bits: int
+    :returns: seconds per band per document
+    :rtype: float
+    """
+    from lsh_hdc.cluster import Cluster
+    make_key = band_key if key_type == "int" else format_key
+    rng = random.Random(seed)
+    docs = [[make_key(band, rng.getrandbits(64)) for band in xrange(num_bands)]
+            for _ in xrange(num_docs)]
+    sketches = [rng.getrandbits(sketch_bits) for _ in docs] \
+        if sketch_dist_fn is not None \
+        else [None] * num_docs
+    cluster = Cluster(sketch_dist_fn=sketch_dist_fn, max_dist=max_dist,
+                      min_support=min_support)
+    started = time.time()
+    for label, keys in enumerate(docs):
+        cluster.add_item(keys, label=label, sketch=sketches[label])
+    return (time.time() - started) / (num_docs * num_bands)
+
+
+def optimize_lsh(threshold, fp_weight=1.0, fn_weight=1.0, max_error=0.05,
+                 band_cost=1.0, hash_cost=0.0, widths=None, bandwidths=None,
+                 schemes=("a0", "a1", "a2", "b2"), kmins=(1,), max_bands=1000,
+                 **kwargs):
+    """Find the cheapest LSH parameters that meet a quality target
+
+    Error of a parameter set is the weighted average of its false positive
+    and false negative rates (see error_rates). Cost per document is
+    ``num_bands * band_cost + (width / kmin) * hash_cost``, where costs can
+    be measured with measure_band_cost. The curve model treats every
+    signature element the same regardless of kmin, so kmin only affects
+    the number of hash functions.
+
+    If no parameter set meets the target, the one with the lowest error is
+    returned and a warning is logged.
+
+    :param threshold: target Jaccard similarity
+    :type threshold: float
+    :param fp_weight: weight of false positive rate
+    :type fp_weight: float
+    :param fn_weight: weight of false negative rate
+    :type fn_weight: float
+    :param max_error: highest acceptable weighted error
+    :type max_error: float
+    :param band_cost: cost of one band per document
+    :type band_cost: float
+    :param hash_cost: cost of one hash function per document
+    :type hash_cost: float
+    :param widths: signature lengths to consider (default 4 to 128)
+    :type widths: collections.Iterable
+    :param bandwidths: band sizes to consider (default 1 to 8)
+    :type bandwidths: collections.Iterable
+    :param schemes: banding schemes to consider
+    :type schemes: collections.Iterable
+    :param kmins: values of kmin to consider
+    :type kmins: collections.Iterable
+    :param max_bands: skip schemes generating more bands than this
+    :type max_bands: int
+    :returns: selected parameters with their cost and error rates
+    :rtype: LSHParams
+    """
+    if widths is None:
+        widths = xrange(4, 129, 4)
+    if bandwidths is None:
+        bandwidths = xrange(1, 9)
+    total_weight = float(fp_weight + fn_weight)
+    best = None
+    best_error = None
+    for width, bandwidth, scheme, kmin in \
+            product(widths, bandwidths, schemes, kmins):
+        if width % kmin != 0 or bandwidth > width:
+            continue
+        try:
+            num_bands = count_bands(width, bandwidth, scheme)
+        except ValueError:
+            continue
+        if num_bands > max_bands:
+            continue
+        cost = num_bands * band_cost + (width // kmin) * hash_cost
+        if best is not None and cost >= best.cost:
+            continue
+        false_positives, false_negatives = error_rates(
+            width, bandwidth, scheme, threshold, **kwargs)
+        error = (fp_weight * false_positives +
+                 fn_weight * false_negatives) / total_weight
+        params = LSHParams(width, bandwidth, scheme, kmin, num_bands, cost,
+                           error, false_positives, false_negatives)
+        if error <= max_error:
+            best = params
+        elif best_error is None or error < best_error.error:
+            best_error = params
+    if best is None:
+        if best_error is None:
+            raise ValueError("No valid LSH parameters to choose from")
+        LOG.warning("No LSH parameters meet error %.4f, lowest is %.4f",
+                    max_error, best_error.error)
+        return best_error
+    return best
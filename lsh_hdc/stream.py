@@ -0,0 +1,287 @@
+"""
+Incremental clustering of a live stream of documents
+
+Documents are submitted one at a time (from any thread), collected into
+small batches by size or by time, signed, and added to the long-lived
+Cluster of an HDClustering instance. Every submitted document gets an
+Assignment, a handle that callers can wait on to learn which cluster the
+document was placed in.
+
+Python 2 has no asyncio, so the ingestor runs on two threads connected by
+bounded queues: a batcher, which signs batches (or sends them to a pool of
+worker processes, see HDClustering num_workers), and an applier, which is
+the only thread that touches the cluster.
+"""
+
+import json
+import threading
+import time
+from Queue import Queue, Empty
+from itertools import count
+from multiprocessing import Pool
+from logging import getLogger
+from lsh_hdc.cluster import Duplicate, _init_worker, _map_chunk_worker
+
+LOG = getLogger(__name__)
+
+# marks the end of input in ingestor queues
+_STOP = object()
+
+
+class Assignment(object):
+    """Cluster assignment of a submitted document
+
+    The cluster of a document is identified by the label of the cluster
+    representative at the time the document was added. Documents rejected
+    by the content filter are assigned to None.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self._done = threading.Event()
+        self._cluster = None
+        self._error = None
+
+    def done(self):
+        """Whether the document has been clustered
+
+        :rtype: bool
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the document to be clustered
+
+        :param timeout: seconds to wait (wait forever if None)
+        :type timeout: float
+        :returns: label of cluster representative
+        :raises: RuntimeError
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Document %r was not clustered within %s seconds"
+                               % (self.label, timeout))
+        if self._error is not None:
+            raise self._error
+        return self._cluster
+
+    def _set_result(self, cluster):
+        self._cluster = cluster
+        self._done.set()
+
+    def _set_error(self, error):
+        self._error = error
+        self._done.set()
+
+
+class StreamingClusterer(object):
+    """Add a stream of documents to clusters with low latency
+
+    A batch is signed as soon as it has batch_size documents or when
+    max_delay seconds have passed since its first document arrived,
+    whichever comes first.
+
+    >>> with StreamingClusterer(hdc) as stream:             # doctest: +SKIP
+    ...     assignment = stream.submit(obj)
+    ...     cluster = assignment.result()
+    """
+
+    def __init__(self, clustering, batch_size=64, max_delay=0.005,
+                 max_pending=10000):
+        """
+        :param clustering: configured clustering (its signers, content
+                           filter, workers and cluster builder are used)
+        :type clustering: lsh_hdc.cluster.HDClustering
+        :param batch_size: largest number of documents to sign at once
+        :type batch_size: int
+        :param max_delay: longest time (in seconds) a document waits for
+                          its batch to fill up
+        :type max_delay: float
+        :param max_pending: number of submitted documents after which
+                            submit blocks until earlier ones are signed
+        :type max_pending: int
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self.clustering = clustering
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._counter = count()
+        self._lock = threading.Lock()
+        # guards _closed, so that nothing is queued behind the end of input
+        self._submit_lock = threading.Lock()
+        self._input = Queue(maxsize=max_pending)
+        num_workers = clustering.num_workers
+        if num_workers > 0:
+            self._pool = Pool(num_workers, initializer=_init_worker,
+                              initargs=(clustering,))
+            self._batches = Queue(maxsize=clustering.max_in_flight)
+        else:
+            self._pool = None
+            self._batches = Queue(maxsize=2)
+        self._closed = False
+        self._batcher = threading.Thread(target=self._run_batcher,
+                                         name="lsh-hdc-batcher")
+        self._applier = threading.Thread(target=self._run_applier,
+                                         name="lsh-hdc-applier")
+        for thread in (self._batcher, self._applier):
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, obj):
+        """Submit a document for clustering
+
+        :param obj: a document (same as an item passed to clusters_from_iter)
+        :returns: a handle to the cluster assignment of the document
+        :rtype: Assignment
+        :raises: RuntimeError
+        """
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed ingestor")
+            item = self.clustering._unpack(next(self._counter), obj)
+            assignment = Assignment(item[2])
+            self._input.put((item, assignment))
+        return assignment
+
+    def feed(self, data):
+        """Submit all documents from an iterable (such as a generator reading
+        a live stream)
+
+        :returns: a list of assignments
+        :rtype: list
+        """
+        return [self.submit(obj) for obj in data]
+
+    def feed_lines(self, fileobj):
+        """Submit JSON documents, one per line, read from a pipe or a socket
+        (use socket.makefile) until the other end is closed
+
+        :returns: a list of assignments
+        :rtype: list
+        """
+        return self.feed(json.loads(line) for line in iter(fileobj.readline, '')
+                         if line.strip())
+
+    def get_clusters(self):
+        """
+        :return: a list of sets representing clusters so far
+        :rtype: list
+        """
+        with self._lock:
+            return self.clustering.cluster_builder.get_clusters()
+
+    def close(self):
+        """Cluster all submitted documents and stop ingestor threads"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._input.put(_STOP)
+        self._batcher.join()
+        self._applier.join()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+    def _next_batch(self):
+        """Collect a batch of submitted documents
+
+        :returns: a list of (item, assignment) tuples and whether input ended
+        :rtype: tuple
+        """
+        first = self._input.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                entry = self._input.get(timeout=remaining) \
+                    if remaining > 0 \
+                    else self._input.get_nowait()
+            except Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run_batcher(self):
+        pool = self._pool
+        stopped = False
+        while not stopped:
+            batch, stopped = self._next_batch()
+            if not batch:
+                continue
+            chunk = [item for item, _ in batch]
+            if pool is not None:
+                result = pool.apply_async(_map_chunk_worker, (chunk,))
+            else:
+                try:
+                    result = self.clustering._sign_chunk(chunk)
+                except Exception as error:
+                    LOG.exception("Failed to sign a batch of %d documents",
+                                  len(chunk))
+                    result = error
+            self._batches.put((batch, result))
+        self._batches.put(_STOP)
+
+    def _run_applier(self):
+        while True:
+            entry = self._batches.get()
+            if entry is _STOP:
+                break
+            batch, result = entry
+            if self._pool is not None:
+                try:
+                    result = result.get()
+                except Exception as error:
+                    LOG.exception("Failed to sign a batch of %d documents",
+                                  len(batch))
+                    result = error
+            if isinstance(result, Exception):
+                for _, assignment in batch:
+                    assignment._set_error(result)
+                continue
+            # signed documents are keyed by position in batch, rejected
+            # ones are missing
+            signed = dict((entry[0], entry[1:]) for entry in result)
+            with self._lock:
+                try:
+                    self._apply_batch(batch, signed)
+                except Exception as error:
+                    LOG.exception("Failed to cluster a batch of %d documents",
+                                  len(batch))
+                    for _, assignment in batch:
+                        if not assignment.done():
+                            assignment._set_error(error)
+
+    def _apply_batch(self, batch, signed):
+        """Add signed documents of a batch to clusters and complete their
+        assignments
+        """
+        cluster_builder = self.clustering.cluster_builder
+        for idx, (_, assignment) in enumerate(batch):
+            entry = signed.get(idx)
+            if entry is None:
+                assignment._set_result(None)
+                continue
+            keys, label, sketch = entry
+            if isinstance(keys, Duplicate):
+                cluster_builder.add_duplicate(label, keys.original)
+            else:
+                cluster_builder.add_item(keys, label=label, sketch=sketch)
+        # sharded cluster builders add items in batches
+        cluster_builder.flush()
+        union_find = cluster_builder.union_find
+        for _, assignment in batch:
+            if not assignment.done():
+                assignment._set_result(union_find[assignment.label])
+
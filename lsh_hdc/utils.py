@@ -3,7 +3,7 @@ import random
 import operator
 import json
 import string
-from itertools import imap
+from itertools import imap, islice
 
 
 def totuple(a):
@@ -76,6 +76,28 @@ def last(it):
     return it[-1]
 
 
+def chunked(iterable, size):
+    """Split an iterable into lists of at most size elements
+
+    :param iterable: input sequence
+    :type iterable: collections.Iterable
+    :param size: maximum chunk size
+    :type size: int
+    :rtype: collections.iterable
+
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    if size < 1:
+        raise ValueError("chunk size must be a positive integer")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+
 def gapply(n, func, *args, **kwargs):
     """Apply a generating function n times to the argument list
 
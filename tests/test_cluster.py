@@ -1,7 +1,31 @@
 import unittest
-from lsh_hdc.utils import randset
+import random
+from lsh_hdc.utils import randset, randstr
 from lsh_hdc import jaccard_sim, get_bandwidth
-from lsh_hdc.cluster import MinHashCluster as Cluster
+from lsh_hdc.cluster import MinHashCluster as Cluster, HDClustering, \
+    Cluster as KeyCluster, ShardedCluster
+
+
+class SplitTokenizer(object):
+    def tokenize(self, text):
+        return text.split()
+
+
+class NullNormalizer(object):
+    def normalize(self, text):
+        return text, {}
+
+
+def zero_dist(sketch1, sketch2):
+    """Sketch distance for clusters that count bucket matches"""
+    return 0
+
+
+def hdc_config():
+    return dict(kmin=1, sig_width=12, min_support=1, sig_engine="numpy",
+                lsh_options=dict(bandwidth=3, scheme="a0"),
+                shingler=dict(span=2, skip=0, unique=True),
+                sketch=dict(enabled=False))
 
 
 class TestCluster(unittest.TestCase):
@@ -40,6 +64,196 @@ class TestCluster(unittest.TestCase):
         self.assertEqual(num_clusters, 2,
                          "Expected 2 clusters, got {}".format(num_clusters))
 
+    def test_int_keys(self):
+        """Integer LSH keys should give the same clusters as string keys"""
+        sets = [randset() for _ in xrange(20)]
+        sets.extend(s[:-1] for s in sets[:10])
+        clusters = []
+        for key_type in ("str", "int"):
+            cluster = Cluster(width=12, bandwidth=3, key_type=key_type)
+            for s in sets:
+                cluster.add_item(s)
+            clusters.append(sorted(map(sorted, cluster.get_clusters())))
+        self.assertEqual(clusters[0], clusters[1])
+
+    def test_parallel_hdclustering(self):
+        """Signing in worker processes should give the same clusters"""
+        words = [randstr(5) for _ in xrange(200)]
+        docs = []
+        for idx in xrange(0, 200, 10):
+            doc = words[idx:idx + 10]
+            docs.extend([doc, doc[:-1] + [randstr(5)]])
+        data = [dict(content=" ".join(doc)) for doc in docs]
+        clusters = []
+        for num_workers, ordered in ((0, True), (3, True), (3, False)):
+            hdc = HDClustering(hdc_config(), normalizer=NullNormalizer(),
+                               tokenizer=SplitTokenizer(), chunk_size=4,
+                               num_workers=num_workers, max_in_flight=2,
+                               ordered=ordered)
+            clusters.append(sorted(map(sorted, hdc.clusters_from_iter(data))))
+        self.assertEqual(clusters[0], clusters[1])
+        self.assertEqual(clusters[0], clusters[2])
+
+    def test_exact_duplicates(self):
+        """Exact duplicates should be clustered without being signed"""
+        docs = [[randstr(5) for _ in xrange(10)] for _ in xrange(20)]
+        data = [dict(content=" ".join(doc)) for doc in docs]
+        data.extend(data[:5] * 3)
+        clusters = []
+        for table_size in (0, 100):
+            hdc = HDClustering(hdc_config(), normalizer=NullNormalizer(),
+                               tokenizer=SplitTokenizer(), chunk_size=4,
+                               fingerprint_table_size=table_size)
+            clusters.append(sorted(map(sorted, hdc.clusters_from_iter(data))))
+        self.assertEqual(clusters[0], clusters[1])
+        info = hdc.fingerprint_info()
+        self.assertEqual(35, info['documents'])
+        self.assertEqual(15, info['duplicates'])
+        self.assertEqual(15 * 4, info['bucket_inserts_skipped'])
+        self.assertEqual(15, info['table']['hits'])
+
+    def test_heavy_buckets(self):
+        """Full buckets should be capped and stop keys ignored"""
+        def add_items(cluster):
+            for label in xrange(10):
+                cluster.add_item(["heavy", "key%d" % label], label=label)
+            return cluster
+
+        cluster = add_items(KeyCluster(sketch_dist_fn=zero_dist))
+        self.assertEqual(1, len(cluster.get_clusters()))
+        self.assertEqual(["heavy"], cluster.get_heavy_keys(5))
+
+        cluster = add_items(KeyCluster(sketch_dist_fn=zero_dist,
+                                       max_bucket_size=3))
+        self.assertEqual(8, len(cluster.get_clusters()))
+        self.assertEqual(dict(capped_buckets=1, skipped_comparisons=21,
+                              stopped_keys=0), cluster.heavy_bucket_info())
+
+        cluster = add_items(KeyCluster(sketch_dist_fn=zero_dist,
+                                       max_bucket_size=3,
+                                       heavy_bucket_mode="representative"))
+        self.assertEqual(1, len(cluster.get_clusters()))
+        self.assertEqual(14, cluster.heavy_bucket_info()['skipped_comparisons'])
+
+        for sketch_dist_fn in (zero_dist, None):
+            cluster = add_items(KeyCluster(sketch_dist_fn=sketch_dist_fn,
+                                           stop_keys=["heavy"]))
+            self.assertEqual(10, len(cluster.get_clusters()))
+            self.assertEqual(10, cluster.heavy_bucket_info()['stopped_keys'])
+
+    def test_representative_union(self):
+        """Uniting with first bucket items should give same clusters as
+        counting matches in buckets
+        """
+        items = [["key%d" % random.randint(0, 300) for _ in xrange(3)]
+                 for _ in xrange(200)]
+        clusters = []
+        for sketch_dist_fn in (None, zero_dist):
+            cluster = KeyCluster(sketch_dist_fn=sketch_dist_fn)
+            for label, keys in enumerate(items):
+                cluster.add_item(keys, label=label)
+            clusters.append(sorted(map(sorted, cluster.get_clusters())))
+        self.assertEqual(clusters[0], clusters[1])
+        self.assertGreater(len(clusters[0]), 1)
+        self.assertLess(len(clusters[0]), len(items))
+
+    def test_compact_index(self):
+        """Compact index should give the same clusters as dict buckets"""
+        items = [["key%d" % random.randint(0, 100) for _ in xrange(4)]
+                 for _ in xrange(300)]
+        sketches = [random.getrandbits(8) for _ in items]
+        options = [dict(min_support=2),
+                   dict(sketch_dist_fn=lambda a, b: bin(a ^ b).count("1"),
+                        max_dist=3),
+                   dict(min_support=2, max_bucket_size=10)]
+        for opts in options:
+            doc_sketches = sketches \
+                if 'sketch_dist_fn' in opts \
+                else [None] * len(items)
+            clusters = []
+            for compact_index in (False, True):
+                cluster = KeyCluster(compact_index=compact_index, **opts)
+                for label, keys in enumerate(items):
+                    cluster.add_item(keys, label=str(label),
+                                     sketch=doc_sketches[label])
+                # labels seen before should not be added twice, and can be
+                # added to more buckets
+                cluster.add_item(items[0], label="0", sketch=doc_sketches[0])
+                cluster.add_item(items[2], label="1", sketch=doc_sketches[1])
+                clusters.append((sorted(map(sorted, cluster.get_clusters())),
+                                 cluster.heavy_bucket_info()))
+            self.assertEqual(clusters[0], clusters[1])
+            for bucket in cluster.buckets.itervalues():
+                # single items are stored as bare label IDs
+                if isinstance(bucket, (int, long)):
+                    continue
+                self.assertGreater(len(bucket), 1)
+                self.assertEqual(sorted(set(bucket)), bucket.tolist())
+            self.assertLess(len(clusters[0][0]), len(items))
+
+    def test_sharded_cluster(self):
+        """Sharded buckets should give the same clusters as one process"""
+        items = [["key%d" % random.randint(0, 100) for _ in xrange(4)]
+                 for _ in xrange(300)]
+        sketches = [random.getrandbits(8) for _ in items]
+        options = [dict(),
+                   dict(min_support=2),
+                   dict(sketch_dist_fn=lambda a, b: bin(a ^ b).count("1"),
+                        max_dist=3),
+                   dict(min_support=2, stop_keys=["key0", "key1"])]
+        for opts in options:
+            doc_sketches = sketches \
+                if 'sketch_dist_fn' in opts \
+                else [None] * len(items)
+            expected = KeyCluster(**opts)
+            with ShardedCluster(num_shards=3, batch_size=7, **opts) as cluster:
+                for builder in (expected, cluster):
+                    for label, keys in enumerate(items):
+                        builder.add_item(keys, label=str(label),
+                                         sketch=doc_sketches[label])
+                self.assertEqual(sorted(map(sorted, expected.get_clusters())),
+                                 sorted(map(sorted, cluster.get_clusters())))
+            self.assertEqual(expected.heavy_bucket_info(),
+                             cluster.heavy_bucket_info())
+            self.assertLess(len(expected.get_clusters()), len(items))
+
+    def test_sharded_cluster_repeated_labels(self):
+        """Sharded buckets should compare the same sketch as one process
+        when a label is added again with a different sketch
+        """
+        # integer keys 0 and 1 belong to different shards
+        items = [([0, 1], "a", 0b000),
+                 ([1], "a", 0b111),
+                 ([0, 1], "b", 0b111)]
+        opts = dict(sketch_dist_fn=lambda a, b: bin(a ^ b).count("1"),
+                    max_dist=0)
+        expected = KeyCluster(**opts)
+        with ShardedCluster(num_shards=2, **opts) as cluster:
+            for builder in (expected, cluster):
+                for keys, label, sketch in items:
+                    builder.add_item(keys, label=label, sketch=sketch)
+            self.assertEqual([["a", "b"]],
+                             sorted(map(sorted, expected.get_clusters())))
+            self.assertEqual([["a", "b"]],
+                             sorted(map(sorted, cluster.get_clusters())))
+
+    def test_sharded_hdclustering(self):
+        """HDClustering with num_shards should give the same clusters"""
+        words = [randstr(5) for _ in xrange(200)]
+        docs = []
+        for idx in xrange(0, 200, 10):
+            doc = words[idx:idx + 10]
+            docs.extend([doc, doc[:-1] + [randstr(5)]])
+        data = [dict(content=" ".join(doc)) for doc in docs]
+        clusters = []
+        for num_shards in (0, 2):
+            hdc = HDClustering(hdc_config(), normalizer=NullNormalizer(),
+                               tokenizer=SplitTokenizer(), num_shards=num_shards)
+            clusters.append(sorted(map(sorted, hdc.clusters_from_iter(data))))
+            if num_shards > 0:
+                hdc.cluster_builder.close()
+        self.assertEqual(clusters[0], clusters[1])
+
     def test_cluster_threshold(self):
         """Expected error for threshold to similarity should be reasonable"""
         n_tests = 50
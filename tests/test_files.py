@@ -7,8 +7,10 @@ from functools import partial
 from itertools import islice
 from pkg_resources import resource_filename
 
-from lsh_hdc import Shingler
-from lsh_hdc.cluster import MinHashCluster as Cluster, HDClustering
+from lsh_hdc import Shingler, LSHC, MinHashSignature, \
+    OnePermutationMinHashSignature, VectorMinHashSignature, CharShingler
+from lsh_hdc.cluster import MinHashCluster as Cluster, HDClustering, \
+    Cluster as SignerCluster
 from lflearn.preprocess import RegexTokenizer
 from lflearn.metrics import describe_clusters
 
@@ -76,15 +78,97 @@ class TestFiles(unittest.TestCase):
         clusters = cluster.get_clusters()
         self.assertEqual(len(clusters), 97)
 
+    def test_names_bills_oph(self):
+        """One permutation hashing should give cluster counts close to
+        those of regular minhash on names and bills (averaged over seeds,
+        as 20 hashes vary a lot)
+        """
+        with open(get_resource_name('data/perrys.csv'), 'r') as fhandle:
+            names = set(line.rstrip() for line in fhandle)
+        with open(get_resource_name('data/bills100.txt'), 'r') as fhandle:
+            bills = [line.rstrip().split('|') for line in fhandle]
+        name_shingles = [(name, Shingler(3).get_shingles(name))
+                         for name in names]
+        bill_shingler = Shingler(span=3, tokenizer=RegexTokenizer())
+        bill_shingles = [(label, bill_shingler.get_shingles(text))
+                         for label, text in bills]
+        counts = dict()
+        for signer_class in (MinHashSignature, OnePermutationMinHashSignature):
+            num_names = num_bills = 0
+            for seed in xrange(SEED, SEED + 5):
+                names_cluster = SignerCluster(signer=signer_class(
+                    20, lsh_hasher=LSHC(5, 20, "a0"), seed=seed))
+                for name, shingles in name_shingles:
+                    names_cluster.add_item(shingles, name)
+                bills_cluster = SignerCluster(signer=signer_class(
+                    20, lsh_hasher=LSHC(5, 20, "a0"), seed=seed))
+                for label, shingles in bill_shingles:
+                    bills_cluster.add_item(shingles, label)
+                num_names += len(names_cluster.get_clusters())
+                num_bills += len(bills_cluster.get_clusters())
+            counts[signer_class.__name__] = (num_names, num_bills)
+        print json.dumps(counts)
+        mh_names, mh_bills = counts['MinHashSignature']
+        oph_names, oph_bills = counts['OnePermutationMinHashSignature']
+        self.assertLessEqual(abs(oph_names - mh_names), 0.25 * mh_names)
+        self.assertLessEqual(abs(oph_bills - mh_bills), 0.05 * mh_bills)
+
+    def test_names_char_shingler(self):
+        """Rolling character shingles should cluster names about as well as
+        tuple shingles (averaged over seeds, as 20 hashes vary a lot)
+        """
+        with open(get_resource_name('data/perrys.csv'), 'r') as fhandle:
+            names = sorted(set(line.rstrip() for line in fhandle))
+        tuple_shingles = map(Shingler(3).get_shingles, names)
+        char_shingles = CharShingler(3).get_shingles_batch(names)
+        num_tuple = num_char = 0
+        for seed in xrange(5):
+            signer = VectorMinHashSignature(
+                20, lsh_hasher=LSHC(5, 20, "a0"), seed=seed)
+            tuple_cluster = SignerCluster(signer=signer)
+            char_cluster = SignerCluster(signer=signer)
+            for name, shingles in zip(names, tuple_shingles):
+                tuple_cluster.add_item(shingles, name)
+            for name, shingles in zip(names, char_shingles):
+                char_cluster.add_item(shingles, name)
+            num_tuple += len(tuple_cluster.get_clusters())
+            num_char += len(char_cluster.get_clusters())
+        self.assertLessEqual(abs(num_char - num_tuple), 0.1 * num_tuple)
+
+    def test_simulated_oph(self):
+        """One permutation hashing should not lose recall or precision
+        compared to regular minhash
+        """
+        ratios = dict()
+        num_seeds = 3
+        for signer_class in (MinHashSignature, OnePermutationMinHashSignature):
+            precision = recall = 0.0
+            for seed in xrange(SEED, SEED + num_seeds):
+                signer = signer_class(30, lsh_hasher=LSHC(3, 30, "a0"), seed=seed)
+                results = TestFiles.run_simulated_manually(
+                    'data/simulated.txt', cluster=SignerCluster(signer=signer))
+                c = results['stats']
+                precision += c.get_precision()
+                recall += c.get_recall()
+            ratios[signer_class.__name__] = dict(
+                precision=precision / num_seeds,
+                recall=recall / num_seeds)
+        print json.dumps(ratios)
+        minhash = ratios['MinHashSignature']
+        oph = ratios['OnePermutationMinHashSignature']
+        self.assertGreaterEqual(oph['recall'], 0.95 * minhash['recall'])
+        self.assertGreaterEqual(oph['precision'], 0.95 * minhash['precision'])
+
     @staticmethod
     def run_simulated_manually(filepath, lines_to_read=sys.maxint,
-                               cluster_args=None):
+                               cluster_args=None, cluster=None):
         with open(get_resource_name(filepath), 'r') as fhandle:
             data = [line.rstrip().split(' ')
                     for line in islice(fhandle, lines_to_read)]
-        if cluster_args is None:
-            cluster_args = dict()
-        cluster = Cluster(**cluster_args)
+        if cluster is None:
+            if cluster_args is None:
+                cluster_args = dict()
+            cluster = Cluster(**cluster_args)
         shingler = Shingler(span=3)
         content_dict = dict()
         for pair in data:
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from lsh_hdc.optimize import collision_curve, error_rates, optimize_lsh, \
+    measure_band_cost
+
+
+class TestOptimize(unittest.TestCase):
+
+    def test_collision_curve(self):
+        """Overlapping bands should collide at least as often as disjoint"""
+        similarities = np.linspace(0.0, 1.0, 21)
+        curve_a0 = collision_curve(12, 3, "a0", similarities)
+        curve_a1 = collision_curve(12, 3, "a1", similarities)
+        self.assertEqual(0.0, curve_a1[0])
+        self.assertEqual(1.0, curve_a1[-1])
+        self.assertTrue((np.diff(curve_a1) >= 0.0).all())
+        # a1 bands include all a0 bands
+        self.assertTrue((curve_a1 >= curve_a0 - 0.05).all())
+
+    def test_error_rates(self):
+        """More rows per band should trade false positives for negatives"""
+        fp_narrow, fn_narrow = error_rates(24, 2, "a0", 0.5)
+        fp_wide, fn_wide = error_rates(24, 6, "a0", 0.5)
+        self.assertGreater(fp_narrow, fp_wide)
+        self.assertLess(fn_narrow, fn_wide)
+
+    def test_optimize_lsh(self):
+        """Cheapest parameters should meet the error target"""
+        params = optimize_lsh(0.5, max_error=0.10, widths=range(8, 65, 8),
+                              schemes=("a0", "a1"))
+        self.assertLessEqual(params.error, 0.10)
+        cheaper = optimize_lsh(0.5, max_error=0.15, widths=range(8, 65, 8),
+                               schemes=("a0", "a1"))
+        self.assertLessEqual(cheaper.cost, params.cost)
+
+
+    def test_measure_band_cost(self):
+        """Band cost should be measured with the given matching settings"""
+        hamming = lambda a, b: bin(a ^ b).count("1")
+        for opts in (dict(), dict(min_support=1),
+                     dict(sketch_dist_fn=hamming, max_dist=3)):
+            self.assertGreater(measure_band_cost(num_docs=50, **opts), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
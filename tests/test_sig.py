@@ -1,12 +1,33 @@
 # -*- coding: utf-8 -*-
 import unittest
 import random
+import numpy as np
 from cityhash import CityHash128
 from pymaptools.bitwise import hamming, bitstring_padded, from_bitstring
 from lsh_hdc.utils import randset, sigsim, randstr
 from lsh_hdc import MinHashSignature, SimHashSignature, MinHashSketchSignature, \
-    jaccard_sim, Shingler
+    VectorMinHashSignature, OnePermutationMinHashSignature, LSHC, \
+    BBitMinHashSignature, BBIT_SIZES, bbit_pack, bbit_unpack, \
+    WeightedMinHashSignature, CharShingler, jaccard_sim, weighted_jaccard_sim, Shingler, \
+    HashCache, hash64, words2long, BottomKSignature, BOTTOMK_EMPTY, \
+    bottomk_jaccard, bottomk_containment, bottomk_cardinality
 from lflearn.preprocess import RegexTokenizer
+from math import log1p
+
+
+def scalar_simhash(hashed_features, feature_weights, bit_depth):
+    """Reference SimHash over integer features, one bit at a time"""
+    mod_base = 1 << bit_depth
+    vec = [0] * bit_depth
+    for feature, weight in zip(hashed_features, feature_weights):
+        scaled_weight = log1p(weight)
+        mod_feature = feature % mod_base
+        for i in xrange(bit_depth):
+            if mod_feature & (1 << i):
+                vec[i] += scaled_weight
+            else:
+                vec[i] -= scaled_weight
+    return sum(1 << i for i in xrange(bit_depth) if vec[i] > 0)
 
 
 class TestSig(unittest.TestCase):
@@ -30,6 +51,125 @@ class TestSig(unittest.TestCase):
         shingles = t.get_shingles("the quick brown fox jumps over a lazy dog")
         self.assertEqual(("the", "brown", "jumps"), shingles[0])
 
+    def test_hashed_shingler(self):
+        """Hashed shingles should correspond to regular shingles"""
+        text = "the quick brown fox jumps over the quick brown dog"
+        for span, skip in ((3, 0), (5, 1), (4, 1), (20, 0)):
+            s = Shingler(span=span, skip=skip, unique=False,
+                         tokenizer=RegexTokenizer())
+            h = Shingler(span=span, skip=skip, unique=False,
+                         tokenizer=RegexTokenizer(), hashed=True)
+            shingles = s.get_shingles(text)
+            hashes = h.get_shingles(text)
+            self.assertEqual(np.uint64, hashes.dtype)
+            self.assertEqual(len(shingles), len(hashes))
+            # equal shingles should have equal hashes and vice versa
+            self.assertEqual(
+                [[a == b for b in shingles] for a in shingles],
+                [[a == b for b in hashes] for a in hashes])
+        h = Shingler(span=3, tokenizer=RegexTokenizer(), hashed=True)
+        self.assertEqual(7, len(h.get_shingles(text)))
+
+    def test_hashed_sbph_shingler(self):
+        """Hashed SBPH shingles should correspond to SBPH shingles"""
+        text = "the quick brown fox jumps over the quick brown dog"
+        for span, skip in ((4, 0), (4, 1), (5, 0), (2, 0), (20, 0), (20, 1)):
+            for words in (text, "the quick", "the", ""):
+                s = Shingler(span=span, skip=skip, unique=False,
+                             algorithm="sbph", tokenizer=RegexTokenizer())
+                h = Shingler(span=span, skip=skip, unique=False,
+                             algorithm="sbph", tokenizer=RegexTokenizer(),
+                             hashed=True)
+                shingles = s.get_shingles(words)
+                hashes = h.get_shingles(words)
+                self.assertEqual(len(shingles), len(hashes))
+                self.assertEqual(
+                    [[a == b for b in shingles] for a in shingles],
+                    [[a == b for b in hashes] for a in hashes])
+        # masked shingles should hash the same as standard shingles
+        s = Shingler(span=4, algorithm="sbph", tokenizer=RegexTokenizer(),
+                     hashed=True)
+        t = Shingler(span=3, tokenizer=RegexTokenizer(), hashed=True)
+        self.assertTrue(set(t.get_shingles(text)) <= set(s.get_shingles(text)))
+
+    def test_char_shingler(self):
+        """Rolling character shingles should correspond to tuple shingles"""
+        for span, skip in ((3, 0), (5, 1), (4, 1), (1, 0)):
+            s = Shingler(span=span, skip=skip, unique=False)
+            c = CharShingler(span=span, skip=skip, unique=False)
+            for text in ("abracadabra", "ab", ""):
+                shingles = s.get_shingles(text)
+                hashes = c.get_shingles(text)
+                self.assertEqual(len(shingles), len(hashes))
+                self.assertEqual(
+                    [[a == b for b in shingles] for a in shingles],
+                    [[a == b for b in hashes] for a in hashes])
+        c = CharShingler(3)
+        texts = ["abracadabra", "", "cadabra", u"abracadabra"]
+        batch = c.get_shingles_batch(texts, prefixes=[None, None, 1, None])
+        self.assertEqual(c.get_shingles("abracadabra").tolist(), batch[0].tolist())
+        self.assertEqual(c.get_shingles("cadabra", prefix=1).tolist(),
+                         batch[2].tolist())
+        self.assertEqual(batch[0].tolist(), batch[3].tolist())
+        self.assertEqual(7, len(batch[0]))
+
+    def test_hashed_shingle_signatures(self):
+        """Signers should accept hashed shingles"""
+        s = Shingler(span=2, unique=True)
+        h = Shingler(span=2, unique=True, hashed=True)
+        mh = VectorMinHashSignature(100)
+        err = 0.0
+        for _ in xrange(20):
+            texts = (randstr(30), randstr(30))
+            texts = (texts[0], texts[0][:20] + texts[1][:10])
+            expected = jaccard_sim(*map(s.get_shingles, texts))
+            sigs = [mh.get_signature(h.get_shingles(text)) for text in texts]
+            err += abs(expected - sigsim(*sigs, dim=100))
+        self.assertGreaterEqual(0.1, err / 20)
+
+    def test_stream_hashes(self):
+        """Streamed shingle hashes should match hashed shingles"""
+        text = "the quick brown fox jumps over the quick brown dog"
+        for span, skip, kmin in ((3, 0, 0), (5, 1, 0), (4, 1, 0), (20, 0, 0),
+                                 (3, 0, 20), (2, 0, 3)):
+            h = Shingler(span=span, skip=skip, kmin=kmin, unique=False,
+                         tokenizer=RegexTokenizer(), hashed=True)
+            for chunk_size in (1, 2, 7, 4096):
+                for prefix in (None, "x"):
+                    expected = h.get_shingles(text, prefix=prefix)
+                    chunks = list(h.iter_hashes(text, prefix=prefix,
+                                                chunk_size=chunk_size))
+                    self.assertEqual(expected.tolist(),
+                                     np.concatenate(chunks).tolist())
+        h = Shingler(span=3, hashed=True, unique=False)
+        self.assertEqual(h.get_shingles([]).tolist(),
+                         np.concatenate(list(h.iter_hashes([]))).tolist())
+
+    def test_stream_signatures(self):
+        """Signatures of streamed hashes should match those of hash sets"""
+        h = Shingler(span=2, hashed=True)
+        signers = [VectorMinHashSignature(24), VectorMinHashSignature(24, kmin=3),
+                   OnePermutationMinHashSignature(24), BottomKSignature(24),
+                   BBitMinHashSignature(24, bits=2)]
+        for text in (randstr(200), randstr(5), ""):
+            shingles = h.get_shingles(text)
+            for signer in signers:
+                expected = signer.get_signature(shingles)
+                actual = signer.get_signature_stream(
+                    h.iter_hashes(text, chunk_size=16))
+                self.assertEqual(expected, actual)
+        with self.assertRaises(NotImplementedError):
+            WeightedMinHashSignature(24).get_signature_stream([shingles])
+
+        sh = SimHashSignature(64)
+        text = randstr(200)
+        shingles = h.get_shingles(text)
+        expected = sh._sig_with_weights(shingles.tolist(),
+                                        [1.0] * len(shingles))
+        actual = sh.get_signature_stream(
+            np.array_split(shingles, 5) + [(shingles[:0], [])])
+        self.assertLessEqual(hamming(expected, actual), 2)
+
     def test_signature_length(self):
         """Signatures should have correct dimension"""
         mh = MinHashSignature(10 * 10)
@@ -199,6 +339,354 @@ class TestSig(unittest.TestCase):
             avg_err,
             msg="Accuracy test failed. (avg error: %f)" % avg_err)
 
+    def test_vector_signature_length(self):
+        """Vectorized signatures should have correct dimension"""
+        mh = VectorMinHashSignature(10 * 10)
+        self.assertEqual(100, len(mh.get_signature(randset())))
+        mh = VectorMinHashSignature(10 * 10, kmin=4)
+        self.assertEqual(100, len(mh.get_signature(randset())))
+        self.assertEqual(100, len(mh.get_signature([])))
+
+    def test_vector_consistent_signature(self):
+        """Vectorized signatures should be reproducible for a given seed"""
+        s = randset()
+        mh1 = VectorMinHashSignature(10 * 10, seed=42)
+        mh2 = VectorMinHashSignature(10 * 10, seed=42)
+        mh3 = VectorMinHashSignature(10 * 10, seed=43)
+        self.assertEqual(mh1.get_signature(s), mh2.get_signature(s))
+        self.assertNotEqual(mh1.get_signature(s), mh3.get_signature(s))
+
+    def test_vector_signature_similarity(self):
+        """Vectorized signatures should estimate Jaccard similarity"""
+        n_tests = 100
+        expected_error = 1.0 / 10  # Expected error is O(1/sqrt(dim))
+        mh = VectorMinHashSignature(10 * 10)
+        err = 0.0
+
+        for _ in xrange(n_tests):
+            sets = (randset(), randset())
+            sigs = map(mh.get_signature, sets)
+            jsim = jaccard_sim(*sets)
+            ssim = sigsim(*sigs, dim=100)
+            err += abs(jsim - ssim)
+
+        avg_err = err / n_tests
+        self.assertGreaterEqual(
+            expected_error,
+            avg_err,
+            msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
+    def test_batch_signatures(self):
+        """Batch signatures should match one-at-a-time signatures"""
+        batch = [randset() for _ in xrange(20)] + [()]
+        for signer_class in (MinHashSignature, VectorMinHashSignature):
+            for kmin in (1, 3):
+                mh = signer_class(12, kmin=kmin, lsh_hasher=LSHC(3, 12, "a0"))
+                mh.configure_sketcher(sketch_size=12)
+                matrix, sketches = mh.get_signatures(batch, with_sketch=True)
+                self.assertEqual((len(batch), 12), matrix.shape)
+                for row, sketch, vec in zip(matrix.tolist(), sketches.tolist(), batch):
+                    self.assertEqual(mh.get_signature(vec, with_sketch=True),
+                                     (mh.get_keys(row), sketch))
+
+    def test_batch_wide_sketches(self):
+        """Batch sketches wider than 64 bits should not be truncated"""
+        batch = [randset() for _ in xrange(5)]
+        for sketch_type in ('minhash', 'simhash'):
+            mh = VectorMinHashSignature(200, lsh_hasher=LSHC(4, 200, "a0"))
+            mh.configure_sketcher(sketch_type=sketch_type, sketch_size=160)
+            _, sketches = mh.get_signatures(batch, with_sketch=True)
+            self.assertEqual([mh.get_signature(vec, with_sketch=True)[1]
+                              for vec in batch], sketches.tolist())
+
+    def test_batch_simhash(self):
+        """Batch SimHash signatures should match one-at-a-time signatures"""
+        sh = SimHashSignature(64)
+        batch = ["abracadabra", "", "arbcd"]
+        matrix = sh.get_signatures(batch)
+        self.assertEqual((3, 1), matrix.shape)
+        self.assertEqual(map(sh.get_signature, batch),
+                         map(words2long, matrix.tolist()))
+
+    def test_batch_simhash_widths(self):
+        """Batch SimHash signatures should match at any bit depth"""
+        batch = [randstr(20) for _ in xrange(10)] + [""]
+        for bit_depth in (8, 32, 64):
+            sh = SimHashSignature(bit_depth)
+            matrix = sh.get_signatures(batch)
+            self.assertEqual(map(sh.get_signature, batch),
+                             map(words2long, matrix.tolist()))
+
+    def test_int_keys(self):
+        """Integer LSH keys should match where string keys match"""
+        sets = (randset(), randset())
+        sets += (sets[0][:-1],)
+        for lsh_hasher in (None, LSHC(3, 12, "a0", key_type="int")):
+            mh_str = VectorMinHashSignature(
+                12, lsh_hasher=None if lsh_hasher is None else LSHC(3, 12, "a0"))
+            mh_int = VectorMinHashSignature(12, lsh_hasher=lsh_hasher,
+                                            key_type="int")
+            str_keys = map(mh_str.get_signature, sets)
+            int_keys = map(mh_int.get_signature, sets)
+            for keys in int_keys:
+                self.assertTrue(all(isinstance(key, int) for key in keys))
+            for idx in (1, 2):
+                self.assertEqual(
+                    [a == b for a, b in zip(str_keys[0], str_keys[idx])],
+                    [a == b for a, b in zip(int_keys[0], int_keys[idx])])
+
+    def test_lsh_band_hashes(self):
+        """Band hashes should be polynomial hashes of band columns mod 2^64"""
+        lsh = LSHC(3, 12, "a1")
+        mh = VectorMinHashSignature(12, lsh_hasher=lsh)
+        matrix = mh.get_signatures([randset() for _ in xrange(5)])
+        hashes = lsh.band_hashes(matrix).tolist()
+        for row, row_hashes in zip(matrix.tolist(), hashes):
+            expected = [sum(row[col] * 31 ** idx for idx, col in enumerate(band))
+                        % (1 << 64) for band in lsh.bands.tolist()]
+            self.assertEqual(expected, row_hashes)
+        self.assertEqual(map(mh.get_keys, matrix), mh.get_batch_keys(matrix))
+
+    def test_lsh_seed_argument(self):
+        """Seed should still be accepted as the fourth argument of LSHC"""
+        matrix = VectorMinHashSignature(12).get_signatures([randset()])
+        expected = LSHC(3, 12, "a1").hash_matrix(matrix)
+        for lsh in (LSHC(3, 12, "a1", 0), LSHC(3, 12, "a1", seed=7)):
+            self.assertEqual("str", lsh.key_type)
+            self.assertEqual(expected, lsh.hash_matrix(matrix))
+
+    def test_simhash_wide(self):
+        """Wide SimHash should extend the 64-bit signature"""
+        sh64 = SimHashSignature(64)
+        sh512 = SimHashSignature(512)
+        batch = [[randstr(5) for _ in xrange(100)] for _ in xrange(5)]
+        sigs = map(sh512.get_signature, batch)
+        self.assertEqual(map(sh64.get_signature, batch),
+                         [sig & ((1 << 64) - 1) for sig in sigs])
+        matrix = sh512.get_signatures(batch)
+        self.assertEqual((5, 8), matrix.shape)
+        self.assertEqual(sigs, map(words2long, matrix.tolist()))
+
+        # half of the features in common should give about a quarter of
+        # bits different, unrelated sets about half
+        doc = batch[0][:50] + batch[1][:50]
+        dist_close = hamming(sigs[0], sh512.get_signature(doc))
+        dist_far = hamming(sigs[0], sigs[2])
+        self.assertLess(dist_close, dist_far)
+        self.assertAlmostEqual(256, dist_far, delta=64)
+
+    def test_simhash_wide_int_features(self):
+        """Wide SimHash of integer features (such as minhash sketches)
+        should treat every integer as one feature"""
+        mh = MinHashSignature(200)
+        mh.configure_sketcher(sketch_type='simhash', sketch_size=192)
+        for _ in xrange(5):
+            minhashes = mh._get_minhashes(randset())
+            expected = scalar_simhash(mh._sketch_getter(minhashes),
+                                      mh._sketch_weights, 192)
+            self.assertEqual(expected, mh._get_sketch(minhashes))
+        sh = SimHashSignature(256)
+        features = [random.getrandbits(300) for _ in xrange(50)]
+        weights = [random.random() for _ in features]
+        self.assertEqual(scalar_simhash(features, weights, 256),
+                         sh._sig_with_weights(features, weights))
+
+    def test_oph_signature_similarity(self):
+        """One permutation hashing should estimate Jaccard similarity"""
+        n_tests = 100
+        # rotation has higher variance on sparse sets
+        for densification, expected_error in (("optimal", 0.10),
+                                              ("rotation", 0.15)):
+            mh = OnePermutationMinHashSignature(
+                10 * 10, densification=densification)
+            self.assertEqual(100, len(mh.get_signature(())))
+            err = 0.0
+            for _ in xrange(n_tests):
+                sets = (randset(), randset())
+                sigs = map(mh.get_signature, sets)
+                err += abs(jaccard_sim(*sets) - sigsim(*sigs, dim=100))
+            avg_err = err / n_tests
+            self.assertGreaterEqual(
+                expected_error,
+                avg_err,
+                msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
+    def test_oph_densification_cost(self):
+        """Optimal densification should probe at most probes_per_bin bins
+        per empty bin, without a table growing with width squared"""
+        for width in (64, 512):
+            mh = OnePermutationMinHashSignature(width, probes_per_bin=8)
+            self.assertEqual((width,), mh.hashes.shape)
+            num_probes = [0]
+            get_probes = mh._get_probes
+
+            def counting_probes(empty, attempts):
+                probes = get_probes(empty, attempts)
+                num_probes[0] += probes.size
+                return probes
+
+            mh._get_probes = counting_probes
+            sig = mh.get_signature(randset())
+            self.assertEqual(width, len(sig))
+            self.assertLessEqual(num_probes[0], 8 * width)
+
+    def test_bbit_pack_roundtrip(self):
+        """Packing should keep exactly the lowest b bits"""
+        minhashes = np.array([[random.getrandbits(64) for _ in xrange(61)]
+                              for _ in xrange(3)], dtype=np.uint64)
+        for bits in BBIT_SIZES:
+            packed = bbit_pack(minhashes, bits)
+            self.assertEqual((3, (61 * bits + 7) // 8), packed.shape)
+            unpacked = bbit_unpack(packed, bits, 61).astype(np.uint64)
+            expected = minhashes & np.uint64((1 << bits) - 1)
+            self.assertTrue((unpacked == expected).all())
+
+    def test_bbit_jaccard(self):
+        """b-bit estimator should correct for random collisions"""
+        set1 = set(xrange(0, 200))
+        set2 = set(xrange(100, 300))
+        jsim = jaccard_sim(set1, set2)
+        n_seeds = 10
+        for bits in BBIT_SIZES:
+            estimates = []
+            for seed in xrange(n_seeds):
+                mh = BBitMinHashSignature(400, bits=bits, seed=seed)
+                sig1 = mh.get_signature(set1)
+                sig2 = mh.get_signature(set2)
+                self.assertEqual(400 * bits // 8, len(sig1))
+                self.assertEqual(1.0, mh.jaccard(sig1, sig1))
+                packed = mh.get_signatures([set1, set2])
+                self.assertEqual(sig1, packed[0].tobytes())
+                estimates.append(mh.jaccard(sig1, sig2))
+            avg_estimate = sum(estimates) / n_seeds
+            self.assertAlmostEqual(jsim, avg_estimate, delta=0.05)
+
+    def test_weighted_signature_similarity(self):
+        """Weighted minhash should estimate weighted Jaccard similarity"""
+        n_tests = 100
+        expected_error = 1.0 / 10
+        weights = (0.1, 1.0, 2.0, 5.5)
+        mh = WeightedMinHashSignature(10 * 10)
+        err = 0.0
+        for _ in xrange(n_tests):
+            vecs = [{feature: random.choice(weights)
+                     for feature in random.sample(xrange(20), 10)}
+                    for _ in xrange(2)]
+            sigs = map(mh.get_signature, vecs)
+            err += abs(weighted_jaccard_sim(*vecs) - sigsim(*sigs, dim=100))
+        avg_err = err / n_tests
+        self.assertGreaterEqual(
+            expected_error,
+            avg_err,
+            msg="Accuracy test failed. (avg error: %f)" % avg_err)
+
+    def test_weighted_batch(self):
+        """Weighted minhash should aggregate repeated features and match
+        batch signatures
+        """
+        mh = WeightedMinHashSignature(24, lsh_hasher=LSHC(3, 24, "a0"))
+        shingles = Shingler(span=2, unique=False).get_shingles("abracadabra")
+        pairs = [(shingle, 1.0) for shingle in shingles]
+        counts = dict()
+        for shingle in shingles:
+            counts[shingle] = counts.get(shingle, 0.0) + 1.0
+        self.assertEqual(mh.get_signature(pairs), mh.get_signature(counts))
+        matrix = mh.get_signatures([pairs, {}, counts])
+        self.assertEqual(mh.get_signature(pairs), mh.get_keys(matrix[0]))
+        self.assertEqual(mh.get_signature([]), mh.get_keys(matrix[1]))
+
+    def test_batch_blocks(self):
+        """Batches split into several blocks should give the same signatures
+        as single documents"""
+        import lsh_hdc
+        batch = [randset() for _ in xrange(30)] + [()]
+        weighted_batch = [[(feature, 1.0 + idx) for idx, feature
+                           in enumerate(vec)] for vec in batch]
+        block_size = lsh_hdc._PERMUTE_BLOCK_SIZE
+        lsh_hdc._PERMUTE_BLOCK_SIZE = 24 * 20
+        try:
+            blocks = lsh_hdc._feature_blocks(
+                np.array(map(len, batch), dtype=np.intp), 24)
+            self.assertGreater(len(blocks), 1)
+            for first, last in blocks:
+                self.assertLess(first, last)
+            for mh, docs in ((VectorMinHashSignature(24), batch),
+                             (VectorMinHashSignature(24, kmin=3), batch),
+                             (WeightedMinHashSignature(24), weighted_batch)):
+                matrix = mh.get_signatures(docs)
+                self.assertEqual([mh._get_minhashes(vec) for vec in docs],
+                                 matrix.tolist())
+        finally:
+            lsh_hdc._PERMUTE_BLOCK_SIZE = block_size
+
+    def test_hash_cache(self):
+        """Hash cache should return same hashes as hash64 while staying
+        bounded and counting hits and misses
+        """
+        cache = HashCache(maxsize=10, seed=5)
+        for _ in xrange(3):
+            for item in xrange(5):
+                self.assertEqual(hash64(item, 5), cache(item))
+        self.assertEqual(5, cache.hits // 2)
+        self.assertEqual(5, cache.misses)
+        items = [randstr(3) for _ in xrange(100)]
+        self.assertEqual([hash64(item, 5) for item in items],
+                         cache.hash_many(items))
+        self.assertEqual(10, len(cache))
+        self.assertEqual(10, cache.info()['size'])
+
+    def test_hash_cache_signers(self):
+        """Signers should give same results with and without a cache"""
+        cache = HashCache(maxsize=50)
+        shingler = Shingler(span=3)
+        docs = [shingler.get_shingles(randstr(random.randint(0, 20)))
+                for _ in xrange(20)]
+        pairs = [(VectorMinHashSignature(12),
+                  VectorMinHashSignature(12, hash_cache=cache)),
+                 (SimHashSignature(64),
+                  SimHashSignature(64, hash_cache=cache))]
+        for signer, cached_signer in pairs:
+            for doc in docs:
+                self.assertEqual(signer.get_signature(doc),
+                                 cached_signer.get_signature(doc))
+        self.assertGreater(cache.hits, 0)
+        with self.assertRaises(ValueError):
+            VectorMinHashSignature(12, seed=1, hash_cache=cache)
+
+    def test_bottomk_sketch(self):
+        """Bottom-k sketches should be sorted, fixed-size and padded"""
+        bk = BottomKSignature(16)
+        sketch = bk.get_signatures([[1, 2, 2, 3], range(100)])
+        self.assertEqual((2, 16), sketch.shape)
+        self.assertEqual(3, len(bk.get_keys(sketch[0])))
+        self.assertTrue((sketch[0][3:] == BOTTOMK_EMPTY).all())
+        self.assertEqual(3.0, bottomk_cardinality(sketch[0]))
+        self.assertEqual(sorted(sketch[1].tolist()), sketch[1].tolist())
+        self.assertEqual(1.0, bottomk_jaccard(sketch[1], sketch[1]))
+
+    def test_bottomk_estimators(self):
+        """Bottom-k estimators should approximate Jaccard similarity and
+        containment
+        """
+        n_tests = 100
+        expected_error = 1.0 / 10
+        bk = BottomKSignature(64)
+        jaccard_err = 0.0
+        containment_err = 0.0
+        for _ in xrange(n_tests):
+            size = random.randint(50, 500)
+            offset = random.randint(0, size)
+            set1 = set(xrange(size))
+            set2 = set(xrange(offset, offset + size + random.randint(0, 100)))
+            sketch1, sketch2 = bk.get_signatures([set1, set2])
+            jaccard_err += abs(
+                jaccard_sim(set1, set2) - bottomk_jaccard(sketch1, sketch2))
+            containment_err += abs(
+                float(len(set1 & set2)) / len(set1) -
+                bottomk_containment(sketch1, sketch2))
+        self.assertGreaterEqual(expected_error, jaccard_err / n_tests)
+        self.assertGreaterEqual(expected_error, containment_err / n_tests)
+
 
 if __name__ == '__main__':
     unittest.main()
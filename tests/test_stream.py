@@ -0,0 +1,97 @@
+import unittest
+from StringIO import StringIO
+import json
+from lsh_hdc.utils import randstr
+from lsh_hdc.cluster import HDClustering
+from lsh_hdc.stream import StreamingClusterer
+from tests.test_cluster import NullNormalizer, SplitTokenizer, hdc_config
+
+
+def near_duplicates(num_pairs=20):
+    docs = []
+    for _ in xrange(num_pairs):
+        doc = [randstr(5) for _ in xrange(10)]
+        docs.extend([doc, doc[:-1] + [randstr(5)]])
+    return [dict(content=" ".join(doc)) for doc in docs]
+
+
+class DropFilter(object):
+    def accept(self, obj, **kwargs):
+        """Reject (by matching a rule) documents marked with drop"""
+        return obj.get('drop', False), 0.0
+
+
+class TestStream(unittest.TestCase):
+
+    def get_clustering(self, **kwargs):
+        return HDClustering(hdc_config(), normalizer=NullNormalizer(),
+                            tokenizer=SplitTokenizer(), **kwargs)
+
+    def test_same_clusters(self):
+        """Streamed documents should be clustered same as a batch"""
+        data = near_duplicates()
+        expected = self.get_clustering().clusters_from_iter(data)
+        for num_workers in (0, 2):
+            clustering = self.get_clustering(num_workers=num_workers)
+            with StreamingClusterer(clustering, batch_size=3) as stream:
+                assignments = stream.feed(data)
+                results = [a.result(timeout=10) for a in assignments]
+            self.assertEqual(sorted(map(sorted, expected)),
+                             sorted(map(sorted, stream.get_clusters())))
+            # assigned representatives end up in the same final cluster
+            final = dict((label, idx) for idx, cluster
+                         in enumerate(stream.get_clusters()) for label in cluster)
+            self.assertEqual([final[a.label] for a in assignments],
+                             [final[result] for result in results])
+
+    def test_feed_lines(self):
+        """Should read JSON documents from a file-like object"""
+        data = near_duplicates(3)
+        lines = StringIO("".join(json.dumps(obj) + "\n" for obj in data))
+        with StreamingClusterer(self.get_clustering(), max_delay=0.0) as stream:
+            assignments = stream.feed_lines(lines)
+        self.assertEqual(range(6), [a.label for a in assignments])
+        self.assertTrue(all(a.done() for a in assignments))
+
+    def test_errors(self):
+        """Signing errors should be raised when waiting on assignments"""
+        with StreamingClusterer(self.get_clustering()) as stream:
+            assignment = stream.submit(dict(body="no content"))
+            with self.assertRaises(KeyError):
+                assignment.result(timeout=10)
+        with self.assertRaises(RuntimeError):
+            stream.submit(dict(content="closed"))
+
+    def test_repeated_labels(self):
+        """Results should go to the right documents when labels repeat"""
+        clustering = self.get_clustering(content_filter=DropFilter(),
+                                         get_label=lambda obj: obj['id'])
+        data = [dict(content="a b c d", id="x", drop=True),
+                dict(content="e f g h", id="x")]
+        with StreamingClusterer(clustering, batch_size=2,
+                                max_delay=1.0) as stream:
+            assignments = stream.feed(data)
+        self.assertEqual([None, "x"],
+                         [a.result(timeout=10) for a in assignments])
+
+    def test_apply_errors(self):
+        """Errors adding documents to clusters should be raised when
+        waiting on assignments"""
+        clustering = self.get_clustering()
+
+        def add_item(*args, **kwargs):
+            raise ValueError("cannot add")
+
+        clustering.cluster_builder.add_item = add_item
+        with StreamingClusterer(clustering) as stream:
+            assignment = stream.submit(dict(content="a b c d"))
+            with self.assertRaises(ValueError):
+                assignment.result(timeout=10)
+            # the applier keeps running after errors
+            del clustering.cluster_builder.add_item
+            self.assertEqual(1, stream.submit(dict(content="e f g h"))
+                             .result(timeout=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 __author__ = 'escherba'
 
 import unittest
+import random
 from pymaptools import UnionFind
+from lsh_hdc.unionfind import UnionFind as ArrayUnionFind
 
 
 class TestUnionFind(unittest.TestCase):
@@ -12,6 +14,33 @@ class TestUnionFind(unittest.TestCase):
         uf.union(3, 0)
         self.assertEqual(uf.sets(), [[0, 1, 2, 3]])
 
+    def test_array_union_find(self):
+        """Array union-find should give the same sets as pymaptools"""
+        pairs = [(random.randint(0, 500), random.randint(0, 500))
+                 for _ in xrange(300)]
+        uf = UnionFind()
+        auf = ArrayUnionFind()
+        for idx, (a, b) in enumerate(pairs):
+            uf.union(a, b)
+            auf.union(a, b)
+            if idx % 50 == 0:
+                # sets should be updated incrementally between polls
+                self.assertEqual(sorted(map(sorted, uf.sets())),
+                                 sorted(map(sorted, auf.sets())))
+        self.assertEqual(sorted(map(sorted, uf.sets())),
+                         sorted(map(sorted, auf.sets())))
+        # sets are not shared with the cache
+        self.assertTrue(all(isinstance(labels, tuple) for labels in auf.sets()))
+        auf.members(pairs[0][0]).append("extra")
+        self.assertNotIn("extra", set().union(*auf.sets()))
+        for a, _ in pairs[:20]:
+            members = auf.members(a)
+            self.assertIn(a, members)
+            self.assertEqual(len(members), auf.set_size(a))
+            self.assertIn(auf[a], members)
+        self.assertEqual([], auf.members("missing"))
+        self.assertEqual(0, auf.set_size("missing"))
+
 
 if __name__ == '__main__':
     unittest.main()
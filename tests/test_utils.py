@@ -1,8 +1,14 @@
 __author__ = 'escherba'
 
+import os
+import shutil
+import tempfile
 import unittest
+from itertools import combinations
 from lsh_hdc.utils import sort_by_length
-from lsh_hdc import create_sig_selectors
+import numpy as np
+from lsh_hdc import create_sig_selectors, create_sig_bands, lsh_combinations, \
+    _SIG_BANDS
 
 
 class TestUtils(unittest.TestCase):
@@ -42,6 +48,56 @@ class TestUtils(unittest.TestCase):
         selectors = create_sig_selectors(8, 3, "a3")
         self.assertEqual(len(selectors), 56)
 
+    def test_lsh_combinations(self):
+        """Bands should be the first matching combination of every left part"""
+        for width in xrange(1, 10):
+            for bandwidth in xrange(1, min(width, 4) + 1):
+                for ramp in xrange(1, bandwidth + 1):
+                    expected = set()
+                    seen = set()
+                    for left_cols in combinations(range(bandwidth), ramp):
+                        for band in combinations(range(width), bandwidth):
+                            left = tuple(band[col] for col in left_cols)
+                            if left not in seen:
+                                seen.add(left)
+                                expected.add(band)
+                    self.assertEqual(sorted(expected),
+                                     lsh_combinations(width, bandwidth, ramp))
+
+    def test_create_sig_bands_cache(self):
+        """Bands should be cached on disk by width, bandwidth and scheme"""
+        cache_dir = tempfile.mkdtemp()
+        try:
+            _, bands = create_sig_bands(12, 3, "a2", cache_dir=cache_dir)
+            self.assertEqual(["bands-12-3-a2.npy"], os.listdir(cache_dir))
+            self.assertEqual(lsh_combinations(12, 3, 2),
+                             map(tuple, bands.tolist()))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_create_sig_bands_invalid_cache(self):
+        """Stale or corrupt cached bands should be rebuilt and rewritten"""
+        cache_dir = tempfile.mkdtemp()
+        path = os.path.join(cache_dir, "bands-12-3-a1.npy")
+        _SIG_BANDS.pop((12, 3, "a1"), None)
+        expected = create_sig_bands(12, 3, "a1")[1].tolist()
+        try:
+            stale = [np.zeros((4, 2), dtype=np.intp),
+                     np.zeros((4, 3), dtype=np.float64),
+                     np.array([[0, 1, 12]], dtype=np.intp)]
+            for bands in stale + ["corrupt"]:
+                if isinstance(bands, str):
+                    with open(path, "wb") as fh:
+                        fh.write(bands)
+                else:
+                    np.save(path, bands)
+                _SIG_BANDS.pop((12, 3, "a1"), None)
+                _, bands = create_sig_bands(12, 3, "a1", cache_dir=cache_dir)
+                self.assertEqual(expected, bands.tolist())
+                self.assertEqual(expected, np.load(path).tolist())
+        finally:
+            shutil.rmtree(cache_dir)
+
 
 if __name__ == '__main__':
     unittest.main()